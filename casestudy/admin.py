@@ -1,5 +1,10 @@
 from django.contrib import admin
+from django.db.models.functions import Substr
 from .models import Client, Location, Industry, Casestudy, Comment
+from .pagination import CappedCountPaginator
+from .search import search
+
+PREVIEW_LENGTH = 50
 
 # Try to import SummernoteModelAdmin, fallback to regular ModelAdmin if not available
 try:
@@ -12,7 +17,8 @@ except ImportError:
 @admin.register(Casestudy)
 class CasestudyAdmin(SummernoteModelAdmin):
 
-    list_display = ('title', 'slug',)
+    list_display = ('title', 'slug', 'approved_comment_count',
+                    'pending_comment_count')
     search_fields = ['title']
     #list_filter = ('status',)
     prepopulated_fields = {'slug': ('title',)}
@@ -22,22 +28,48 @@ class CasestudyAdmin(SummernoteModelAdmin):
         if SUMMERNOTE_AVAILABLE:
             self.summernote_fields = ('description',)
 
+    def get_search_results(self, request, queryset, search_term):
+        """Use the full-text index instead of a LIKE scan on title"""
+        return search(queryset, search_term), False
+
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
-    list_display = ('casestudy', 'author', 'approved', 'created_on')
+    list_display = ('casestudy', 'author', 'content_preview', 'approved', 'created_on')
     list_filter = ('approved', 'created_on')
     search_fields = ('author__username', 'content', 'casestudy__title')
     list_editable = ('approved',)
     actions = ['approve_comments', 'disapprove_comments']
-    
+    # Moderation queue: oldest first, served by comment_approved_created_idx
+    ordering = ('created_on', 'id')
+    list_select_related = ('casestudy', 'author')
+    # Never COUNT(*) the whole table; cap the filtered count instead
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+    def get_queryset(self, request):
+        """Load only the columns the changelist shows, plus a preview"""
+        queryset = super().get_queryset(request)
+        if request.resolver_match and request.resolver_match.url_name.endswith('_changelist'):
+            queryset = queryset.only(
+                'approved', 'created_on', 'casestudy__title',
+                'author__username',
+            ).annotate(
+                preview=Substr('content', 1, PREVIEW_LENGTH + 1)
+            )
+        return queryset
+
     def content_preview(self, obj):
         """Show first 50 characters of comment content"""
-        return obj.content[:50] + "..." if len(obj.content) > 50 else obj.content
+        content = getattr(obj, 'preview', None)
+        if content is None:
+            content = obj.content
+        return content[:PREVIEW_LENGTH] + "..." if len(content) > PREVIEW_LENGTH else content
     content_preview.short_description = 'Comment Preview'
     
     def approve_comments(self, request, queryset):
         """Bulk action to approve selected comments"""
-        updated = queryset.update(approved=True)
+        updated = queryset.set_approved(True)
         if updated == 1:
             message = '1 comment was successfully approved and is now visible to users.'
         else:
@@ -47,7 +79,7 @@ class CommentAdmin(admin.ModelAdmin):
     
     def disapprove_comments(self, request, queryset):
         """Bulk action to disapprove selected comments"""
-        updated = queryset.update(approved=False)
+        updated = queryset.set_approved(False)
         if updated == 1:
             message = '1 comment was disapproved and is now hidden from public view.'
         else:
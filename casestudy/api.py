@@ -0,0 +1,218 @@
+"""
+Read-only JSON API (v1) for case studies and their approved comments.
+
+Endpoints (see ``casestudy/urls.py``)::
+
+    GET /api/v1/casestudies/                      cursor-paginated list
+    GET /api/v1/casestudies/<slug>/               one case study
+    GET /api/v1/casestudies/<slug>/comments/      approved comments
+
+``?fields=a,b,c`` selects a sparse fieldset; only the matching columns
+are fetched through ``.values()``. The list accepts the same ``q`` and
+facet filters as the home page. Successful responses carry an ``ETag``
+derived from the content generation, so a matching ``If-None-Match`` gets
+a 304 without touching the database; errors carry none. Output is compact JSON, which GZipMiddleware
+compresses well.
+"""
+
+import hashlib
+from functools import wraps
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import Http404, JsonResponse
+from django.urls import reverse
+from django.views.decorators.http import condition, require_safe
+
+from coreflowepc.middleware import query_budget
+
+from .caching import get_generation
+from .models import Casestudy, Comment
+from .pagination import CursorPaginator, InvalidCursor
+from .search import FACETS, search
+
+API_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Public field name -> ORM lookup passed to .values()
+CASESTUDY_FIELDS = {
+    'id': 'id',
+    'slug': 'slug',
+    'title': 'title',
+    'excerpt': 'excerpt',
+    'description': 'description',
+    'client': 'client__client',
+    'location': 'location__location',
+    'industry': 'industry__industry',
+    'image': 'casestudyimage',
+    'comment_count': 'approved_comment_count',
+    'created_on': 'created_on',
+    'updated_on': 'updated_on',
+}
+CASESTUDY_LIST_DEFAULT = (
+    'id', 'slug', 'title', 'excerpt', 'client', 'location', 'industry',
+    'updated_on',
+)
+COMMENT_FIELDS = {
+    'id': 'id',
+    'author': 'author__username',
+    'content': 'content',
+    'created_on': 'created_on',
+}
+COMMENT_DEFAULT = ('id', 'author', 'content', 'created_on')
+
+
+class BadRequest(Exception):
+    """Invalid query parameters; reported to the client as a 400."""
+
+
+def _generation_etag(request, *args, **kwargs):
+    """
+    ETag from the content generation and URL: no database access.
+
+    Only valid because every write to what these endpoints return bumps
+    the generation (``casestudy/signals.py``), including edits to the
+    text of an already-approved comment and renames of comment authors.
+    """
+    key = f'{get_generation()}:{request.get_full_path()}'
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def _json(data, status=200):
+    return JsonResponse(
+        data, status=status, encoder=DjangoJSONEncoder,
+        json_dumps_params={'separators': (',', ':')},
+    )
+
+
+def _api_view(view_func):
+    """Common wrapping for API views: GET/HEAD only, ETag, JSON errors."""
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        try:
+            return view_func(request, *args, **kwargs)
+        except BadRequest as e:
+            return _json({'error': str(e)}, status=400)
+        except Http404 as e:
+            return _json({'error': str(e)}, status=404)
+    conditional_view = condition(etag_func=_generation_etag)(_wrapped_view)
+
+    @wraps(view_func)
+    def _etag_on_success(request, *args, **kwargs):
+        response = conditional_view(request, *args, **kwargs)
+        # An error is not a representation a client should revalidate
+        if response.status_code not in (200, 304) and response.has_header('ETag'):
+            del response['ETag']
+        return response
+    return require_safe(_etag_on_success)
+
+
+def _fields(request, available, default):
+    """Parse ``?fields=`` against the allowed ``available`` mapping."""
+    raw = request.GET.get('fields')
+    if not raw:
+        return list(default)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise BadRequest('Unknown field(s): %s. Available: %s' % (
+            ', '.join(unknown), ', '.join(available)
+        ))
+    return fields
+
+
+def _page_size(request):
+    value = request.GET.get('limit', '')
+    if not value:
+        return API_PAGE_SIZE
+    if not value.isdigit() or not 0 < int(value) <= MAX_PAGE_SIZE:
+        raise BadRequest(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+    return int(value)
+
+
+def _serialize(rows, fields, available):
+    """Rename ORM lookups back to public field names."""
+    results = []
+    for row in rows:
+        item = {}
+        for name in fields:
+            value = row[available[name]]
+            if name == 'image':
+                value = getattr(value, 'url', value) or None
+            item[name] = value
+        results.append(item)
+    return results
+
+
+def _paginate(request, queryset, fields, available, ordering):
+    """Cursor-paginate a .values() queryset and build the response body."""
+    lookups = {available[name] for name in fields}
+    lookups.update(name.lstrip('-') for name in ordering)
+    paginator = CursorPaginator(
+        queryset.values(*lookups), _page_size(request), ordering=ordering
+    )
+    try:
+        page = paginator.page(request.GET.get('cursor') or None)
+    except InvalidCursor as e:
+        raise BadRequest(str(e))
+
+    def link(cursor):
+        if cursor is None:
+            return None
+        params = request.GET.copy()
+        params['cursor'] = cursor
+        return request.build_absolute_uri(
+            f'{request.path}?{params.urlencode()}'
+        )
+
+    return {
+        'results': _serialize(page.object_list, fields, available),
+        'next': link(page.next_cursor),
+        'previous': link(page.previous_cursor),
+    }
+
+
+@query_budget(queries=2, time_ms=100)
+@_api_view
+def casestudy_list(request):
+    """List case studies, filtered like the home page."""
+    fields = _fields(request, CASESTUDY_FIELDS, CASESTUDY_LIST_DEFAULT)
+    queryset = search(Casestudy.objects.all(), request.GET.get('q'))
+    for name, _ in FACETS:
+        value = request.GET.get(name, '')
+        if value.isdigit():
+            queryset = queryset.filter(**{f'{name}_id': value})
+    return _json(_paginate(
+        request, queryset, fields, CASESTUDY_FIELDS, ('title', 'id')
+    ))
+
+
+@query_budget(queries=1, time_ms=50)
+@_api_view
+def casestudy_item(request, slug):
+    """Return one case study (all fields unless ``?fields=`` says otherwise)."""
+    fields = _fields(request, CASESTUDY_FIELDS, CASESTUDY_FIELDS)
+    lookups = [CASESTUDY_FIELDS[name] for name in fields]
+    row = Casestudy.objects.filter(slug=slug).values(*lookups).first()
+    if row is None:
+        raise Http404('No case study matches the given query.')
+    data = _serialize([row], fields, CASESTUDY_FIELDS)[0]
+    data['comments_url'] = request.build_absolute_uri(
+        reverse('api_casestudy_comments', args=[slug])
+    )
+    return _json(data)
+
+
+@query_budget(queries=2, time_ms=100)
+@_api_view
+def casestudy_comments(request, slug):
+    """List the approved comments of a case study, newest first."""
+    fields = _fields(request, COMMENT_FIELDS, COMMENT_DEFAULT)
+    casestudy_id = Casestudy.objects.filter(slug=slug).values_list(
+        'id', flat=True
+    ).first()
+    if casestudy_id is None:
+        raise Http404('No case study matches the given query.')
+    queryset = Comment.objects.filter(casestudy_id=casestudy_id, approved=True)
+    return _json(_paginate(
+        request, queryset, fields, COMMENT_FIELDS, ('-created_on', '-id')
+    ))
@@ -0,0 +1,383 @@
+"""
+In-process load benchmark used by ``manage.py benchmark``.
+
+Scenarios drive the real URL patterns (case study list and search, detail,
+comment list, comment post/edit/delete, admin changelists) through one of
+two drivers:
+
+- ``ClientDriver``: Django's test ``Client``, no network, lowest noise;
+- ``ServerDriver``: a threaded ``wsgiref`` server on a free local port,
+  requested over HTTP with cookies and CSRF, i.e. the full WSGI path.
+
+Every response carries a ``Server-Timing`` header (the command enables
+it for all requests), which is where per-request query counts come
+from, in either driver. ``summarize`` turns raw samples into
+p50/p95/p99 latency, throughput and query statistics; ``compare`` diffs
+two results.
+"""
+
+import http.cookiejar
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+from socketserver import ThreadingMixIn
+
+from django.contrib.auth.models import User
+from django.test import Client
+from django.urls import reverse
+
+from .models import Casestudy, Comment
+
+BENCHMARK_USER = 'benchmark-user'
+_QUERIES_RE = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+class Request:
+    __slots__ = ('method', 'path', 'data', 'auth')
+
+    def __init__(self, method, path, data=None, auth=False):
+        self.method = method
+        self.path = path
+        self.data = data
+        self.auth = auth
+
+
+# Drivers --------------------------------------------------------------------
+
+class ClientDriver:
+    """Requests through ``django.test.Client``; one per thread."""
+
+    name = 'client'
+
+    def __init__(self, fixture):
+        self.anonymous = Client()
+        self.authenticated = Client()
+        self.authenticated.force_login(fixture.user)
+
+    def request(self, request):
+        client = self.authenticated if request.auth else self.anonymous
+        if request.method == 'POST':
+            response = client.post(request.path, request.data or {})
+        else:
+            response = client.get(request.path)
+        return response.status_code, response.headers.get('Server-Timing', '')
+
+    def close(self):
+        pass
+
+
+class _ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietHandler(WSGIRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalServer:
+    """The project's WSGI application on a free port, in a thread."""
+
+    def __init__(self, application):
+        self.httpd = make_server(
+            '127.0.0.1', 0, application,
+            server_class=_ThreadingWSGIServer, handler_class=_QuietHandler,
+        )
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class ServerDriver:
+    """Requests over HTTP to a ``LocalServer``; one per thread."""
+
+    name = 'server'
+
+    def __init__(self, server, fixture):
+        self.url = server.url
+        self.anonymous = self._opener()
+        self.authenticated = self._opener()
+        # Reuse a session created in-process instead of posting the login form
+        client = Client()
+        client.force_login(fixture.user)
+        session_cookie = client.cookies[next(iter(client.cookies))]
+        self._set_cookie(self.authenticated, session_cookie.key, session_cookie.value)
+        # The comment form sets the CSRF cookie for POSTs to echo back
+        self._send(self.authenticated, Request(
+            'GET', reverse('casestudy_detail', args=[fixture.slug(0)])
+        ))
+
+    def _opener(self):
+        jar = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(jar), _NoRedirect,
+        )
+        opener.jar = jar
+        return opener
+
+    def _set_cookie(self, opener, name, value):
+        host = urllib.parse.urlsplit(self.url).hostname
+        opener.jar.set_cookie(http.cookiejar.Cookie(
+            0, name, value, None, False, host, False, False, '/', True,
+            False, None, False, None, None, {},
+        ))
+
+    def _csrf_token(self, opener):
+        for cookie in opener.jar:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def _send(self, opener, request):
+        data = None
+        headers = {}
+        if request.method == 'POST':
+            data = urllib.parse.urlencode(request.data or {}).encode()
+            headers['X-CSRFToken'] = self._csrf_token(opener)
+            headers['Referer'] = self.url + request.path
+        http_request = urllib.request.Request(
+            self.url + request.path, data=data, headers=headers,
+            method=request.method,
+        )
+        try:
+            with opener.open(http_request, timeout=60) as response:
+                response.read()
+                return response.status, response.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code, e.headers.get('Server-Timing', '')
+
+    def request(self, request):
+        opener = self.authenticated if request.auth else self.anonymous
+        return self._send(opener, request)
+
+    def close(self):
+        pass
+
+
+# Scenarios ------------------------------------------------------------------
+
+class Fixture:
+    """
+    What the scenarios need from the database: slugs, a user, comments.
+
+    The user is a superuser created for this run only, under a name of
+    its own, without a password; ``cleanup`` deletes it again.
+    """
+
+    def __init__(self, sample_size=200):
+        slugs = list(
+            Casestudy.objects.order_by('-approved_comment_count', 'pk')
+            .values_list('slug', flat=True)[:sample_size]
+        )
+        if not slugs:
+            raise ValueError('No case studies to benchmark; run seed_synthetic first.')
+        self.user = User.objects.create_user(
+            f'{BENCHMARK_USER}-{uuid.uuid4().hex[:8]}',
+            is_staff=True, is_superuser=True,
+        )
+        self.slugs = slugs
+        self.words = ['plant', 'energy', 'safety', 'water', 'carbon']
+        self.lock = threading.Lock()
+        self.own_comments = []
+
+    def slug(self, i):
+        return self.slugs[i % len(self.slugs)]
+
+    def prepare_comments(self, count):
+        """Create comments of the benchmark user for edit/delete to use."""
+        casestudy = Casestudy.objects.get(slug=self.slugs[0])
+        comments = [
+            Comment.objects.create(
+                casestudy=casestudy, author=self.user,
+                content=f'Benchmark comment {n}',
+            )
+            for n in range(count)
+        ]
+        with self.lock:
+            self.own_comments.extend(comments)
+
+    def take_comment(self):
+        with self.lock:
+            return self.own_comments.pop()
+
+    def cleanup(self):
+        """Delete the benchmark user and its comments (counters follow)."""
+        for comment in Comment.objects.filter(author=self.user):
+            comment.delete()
+        self.user.delete()
+
+
+def _comment_edit(fixture, i):
+    comment = fixture.take_comment()
+    with fixture.lock:
+        fixture.own_comments.insert(0, comment)
+    return Request('POST', reverse(
+        'comment_edit', args=[comment.casestudy.slug, comment.pk]
+    ), {'content': f'Edited benchmark comment {i}'}, auth=True)
+
+
+def _comment_delete(fixture, i):
+    comment = fixture.take_comment()
+    return Request('POST', reverse(
+        'comment_delete', args=[comment.casestudy.slug, comment.pk]
+    ), auth=True)
+
+
+# name -> (build Request(fixture, i), comments to create beforehand per request)
+SCENARIOS = {
+    'list': (lambda f, i: Request('GET', reverse('home')), 0),
+    'list_search': (
+        lambda f, i: Request('GET', reverse('home') + f'?q={f.words[i % len(f.words)]}'), 0,
+    ),
+    'detail': (
+        lambda f, i: Request('GET', reverse('casestudy_detail', args=[f.slug(i)])), 0,
+    ),
+    'detail_authenticated': (
+        lambda f, i: Request('GET', reverse('casestudy_detail', args=[f.slug(i)]), auth=True), 0,
+    ),
+    'comment_list': (
+        lambda f, i: Request('GET', reverse('comment_list', args=[f.slug(i)])), 0,
+    ),
+    'comment_post': (
+        lambda f, i: Request('POST', reverse('casestudy_detail', args=[f.slug(i)]),
+                             {'content': f'Benchmark comment {i}'}, auth=True), 0,
+    ),
+    'comment_edit': (_comment_edit, 0),
+    'comment_delete': (_comment_delete, 1),
+    'admin_casestudies': (
+        lambda f, i: Request('GET', reverse('admin:casestudy_casestudy_changelist'), auth=True), 0,
+    ),
+    'admin_comments': (
+        lambda f, i: Request('GET', reverse('admin:casestudy_comment_changelist'), auth=True), 0,
+    ),
+}
+
+
+def run_scenario(name, fixture, make_driver, requests, warmup=0, concurrency=1):
+    """
+    Run ``requests`` measured requests of scenario ``name``.
+
+    Returns ``(samples, wall seconds)``; each sample is
+    ``(latency seconds, status, queries or None)``.
+    """
+    build, comments_per_request = SCENARIOS[name]
+    if name == 'comment_edit':
+        fixture.prepare_comments(max(1, concurrency))
+    if comments_per_request:
+        fixture.prepare_comments((requests + warmup) * comments_per_request)
+
+    counter = iter(range(requests + warmup))
+    counter_lock = threading.Lock()
+    samples = []
+    samples_lock = threading.Lock()
+
+    def worker():
+        driver = make_driver()
+        try:
+            while True:
+                with counter_lock:
+                    i = next(counter, None)
+                if i is None:
+                    return
+                request = build(fixture, i)
+                start = time.perf_counter()
+                status, server_timing = driver.request(request)
+                elapsed = time.perf_counter() - start
+                if i < warmup:
+                    continue
+                match = _QUERIES_RE.search(server_timing)
+                with samples_lock:
+                    samples.append((elapsed, status, int(match.group(1)) if match else None))
+        finally:
+            driver.close()
+
+    # Warm-up requests are taken first from the shared counter
+    threads = [threading.Thread(target=worker) for _ in range(max(1, concurrency))]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, time.perf_counter() - started
+
+
+# Statistics -----------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(fraction * len(sorted_values) + 0.5 - 1e-9))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(samples, wall):
+    latencies = sorted(latency * 1000 for latency, _, _ in samples)
+    queries = [q for _, _, q in samples if q is not None]
+    errors = sum(1 for _, status, _ in samples if status >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'p50_ms': _round(percentile(latencies, 0.50)),
+        'p95_ms': _round(percentile(latencies, 0.95)),
+        'p99_ms': _round(percentile(latencies, 0.99)),
+        'mean_ms': _round(sum(latencies) / len(latencies)) if latencies else None,
+        'throughput_rps': _round(len(samples) / wall) if wall else None,
+        'queries_avg': _round(sum(queries) / len(queries)) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+# (metric, True if higher is better)
+COMPARED_METRICS = (
+    ('p50_ms', False), ('p95_ms', False), ('p99_ms', False),
+    ('throughput_rps', True), ('queries_avg', False),
+)
+
+
+def compare(result, baseline, tolerance):
+    """
+    Compare two results scenario by scenario.
+
+    Returns ``(rows, regressions)``: rows are ``(scenario, metric, baseline,
+    current, change %)`` and regressions the rows worse than
+    ``tolerance`` percent. Query counts regress on any increase.
+    """
+    rows, regressions = [], []
+    for name, current in result['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS:
+            old, new = previous.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old * 100 if old else 0.0
+            row = (name, metric, old, new, round(change, 1))
+            rows.append(row)
+            worse = -change if higher_is_better else change
+            limit = 0 if metric.startswith('queries') else tolerance
+            if worse > limit:
+                regressions.append(row)
+    return rows, regressions
@@ -0,0 +1,67 @@
+"""
+Versioned cache keys for the casestudy application.
+
+Rather than deleting individual cache entries when content changes, every
+cache key that depends on case study content embeds a *generation* number.
+Saving or deleting a ``Casestudy``, ``Client``, ``Location`` or
+``Industry`` bumps the generation (see ``casestudy/signals.py``), so all
+existing keys are orphaned at once and simply age out of the cache. This
+lets fragments be cached for hours while edits still show up immediately.
+
+The ``a``-prefixed functions are the same for async views; they go
+through the cache's async API so the event loop never waits on it.
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+GENERATION_KEY = 'casestudy:generation'
+
+
+def get_generation():
+    """Return the current content generation, seeding it if missing."""
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so an evicted counter never reuses old keys
+        cache.add(GENERATION_KEY, int(time.time()), None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+async def aget_generation():
+    """Async version of :func:`get_generation`."""
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(GENERATION_KEY, int(time.time()), None)
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Invalidate every versioned key by advancing the generation."""
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        get_generation()
+        return cache.incr(GENERATION_KEY)
+
+
+def make_key(*parts):
+    """Build a cache key that is only valid for the current generation."""
+    return ':'.join(
+        ['casestudy', str(get_generation())] + [str(part) for part in parts]
+    )
+
+
+async def amake_key(*parts):
+    """Async version of :func:`make_key`."""
+    return ':'.join(
+        ['casestudy', str(await aget_generation())] + [str(part) for part in parts]
+    )
+
+
+def fragment_timeout():
+    """Timeout, in seconds, for versioned template fragments."""
+    return getattr(settings, 'CASESTUDY_CACHE_TIMEOUT', 60 * 60 * 24)
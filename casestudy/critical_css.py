@@ -0,0 +1,308 @@
+"""
+Per-template critical CSS.
+
+``python manage.py build_critical_css`` renders every page in ``PAGES``
+against fixture data, collects the elements that make up the first
+``FOLD_ELEMENTS`` of the page (a stand-in for "above the fold" without a
+headless browser), and keeps only the rules of ``STYLESHEETS`` whose
+selectors match one of them. The result is written to
+``settings.CRITICAL_CSS_DIR`` together with a manifest of the
+stylesheets it covers.
+
+``{% critical_css %}`` (``casestudy/templatetags/critical_css.py``) inlines
+the file for the template being rendered and loads the covered
+stylesheets asynchronously; stylesheets a build could not cover stay
+render-blocking, so a missing build never means an unstyled first paint.
+
+The selector matcher is deliberately generous: pseudo-classes are
+ignored and sibling combinators match anywhere, so it may keep a rule
+too many but should not drop one that is needed.
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from django.conf import settings
+
+# (href, attributes, extract). Static paths or absolute URLs, in cascade
+# order; extract=False sheets are only ever loaded asynchronously
+STYLESHEETS = (
+    ('css/style.css', {}, True),
+    ('https://cdn.jsdelivr.net/npm/bootstrap@5.0.1/dist/css/bootstrap.min.css', {
+        'integrity': 'sha384-+0n0xVW2eSR5OomGNYDnhzAbDsOXxcvSN1TPprVMTNDbiYZCxYbOOl7+AMvyTG2x',
+        'crossorigin': 'anonymous',
+    }, True),
+    ('https://cdnjs.cloudflare.com/ajax/libs/font-awesome/4.7.0/css/font-awesome.min.css', {}, True),
+    # font-display: swap; never worth blocking on
+    ('https://fonts.googleapis.com/css2?family=Roboto:wght@300&family=Lato:wght@300;700&family=Bebas+Neue&display=swap', {}, False),
+)
+
+# (template name, URL name, URL kwargs from the fixture)
+PAGES = (
+    ('casestudy/index.html', 'home', None),
+    ('casestudy/casestudy_detail.html', 'casestudy_detail', 'slug'),
+    ('account/login.html', 'account_login', None),
+    ('account/signup.html', 'account_signup', None),
+)
+
+FOLD_ELEMENTS = 200
+MANIFEST_NAME = 'manifest.json'
+
+_VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link',
+    'meta', 'param', 'source', 'track', 'wbr',
+}
+
+
+def is_remote(href):
+    return href.startswith(('http://', 'https://', '//'))
+
+
+def file_name(template_name):
+    """``casestudy/index.html`` -> ``casestudy__index.css``."""
+    return os.path.splitext(template_name)[0].replace('/', '__') + '.css'
+
+
+# HTML ---------------------------------------------------------------------
+
+class Element:
+    __slots__ = ('tag', 'id', 'classes', 'attrs', 'parent')
+
+    def __init__(self, tag, attrs, parent):
+        attrs = dict(attrs)
+        self.tag = tag
+        self.id = attrs.get('id')
+        self.classes = set((attrs.get('class') or '').split())
+        self.attrs = attrs
+        self.parent = parent
+
+
+class _FoldParser(HTMLParser):
+    """Collect the first ``limit`` elements of ``<body>`` (plus html/body)."""
+
+    def __init__(self, limit):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.elements = []
+        self.stack = []
+        self.counted = 0
+
+    def handle_starttag(self, tag, attrs):
+        parent = self.stack[-1] if self.stack else None
+        element = Element(tag, attrs, parent)
+        in_body = any(e.tag == 'body' for e in self.stack)
+        if tag in ('html', 'body') or (in_body and self.counted < self.limit):
+            self.elements.append(element)
+            if in_body:
+                self.counted += 1
+        if tag not in _VOID_ELEMENTS:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in _VOID_ELEMENTS and self.stack and self.stack[-1].tag == tag:
+            self.stack.pop()
+
+    def handle_endtag(self, tag):
+        for index in range(len(self.stack) - 1, -1, -1):
+            if self.stack[index].tag == tag:
+                del self.stack[index:]
+                break
+
+
+def fold_elements(html, limit=FOLD_ELEMENTS):
+    parser = _FoldParser(limit)
+    parser.feed(html)
+    parser.close()
+    return parser.elements
+
+
+# Selectors ----------------------------------------------------------------
+
+_PSEUDO_RE = re.compile(r'::?[\w-]+(\((?:[^()]|\([^()]*\))*\))?')
+_COMPOUND_RE = re.compile(
+    r'(?P<tag>^[\w-]+|^\*)|#(?P<id>[\w-]+)|\.(?P<cls>[\w-]+)'
+    r'|\[(?P<attr>[\w-]+)(?:[~|^$*]?=["\']?(?P<value>[^"\'\]]*)["\']?)?\s*(?:i\s*)?\]'
+)
+
+
+def split_top_level(text, separator=','):
+    """Split on ``separator`` outside parentheses and brackets."""
+    parts, depth, start = [], 0, 0
+    for index, char in enumerate(text):
+        if char in '([':
+            depth += 1
+        elif char in ')]':
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:index])
+            start = index + 1
+    parts.append(text[start:])
+    return [part.strip() for part in parts if part.strip()]
+
+
+def _compounds(selector):
+    """``'div > .a:hover b'`` -> ``[(' ', 'div'), ('>', '.a'), (' ', 'b')]``."""
+    selector = _PSEUDO_RE.sub('', selector)
+    tokens = re.split(r'\s*([>+~])\s*|\s+', selector.strip())
+    compounds, combinator = [], ' '
+    for token in tokens:
+        if not token:
+            continue
+        if token in '>+~':
+            combinator = token
+            continue
+        compounds.append((combinator, token))
+        combinator = ' '
+    return compounds
+
+
+def _matches_compound(element, compound):
+    for match in _COMPOUND_RE.finditer(compound):
+        if match.group('tag') and match.group('tag') != '*':
+            if element.tag != match.group('tag').lower():
+                return False
+        elif match.group('id') and element.id != match.group('id'):
+            return False
+        elif match.group('cls') and match.group('cls') not in element.classes:
+            return False
+        elif match.group('attr'):
+            if match.group('attr') not in element.attrs:
+                return False
+    return True
+
+
+def selector_matches(selector, elements):
+    """Whether ``selector`` matches one of ``elements`` (generously)."""
+    compounds = _compounds(selector)
+    if not compounds:
+        # Only pseudo-classes, e.g. :root or ::selection
+        return True
+    # Pair each compound with the combinator to its right
+    steps = [
+        (compounds[i + 1][0], compounds[i][1])
+        for i in range(len(compounds) - 2, -1, -1)
+    ]
+    last = compounds[-1][1]
+    for element in elements:
+        if not _matches_compound(element, last):
+            continue
+        node = element.parent
+        ok = True
+        for combinator, compound in steps:
+            if combinator in '+~':
+                if not any(_matches_compound(e, compound) for e in elements):
+                    ok = False
+                    break
+                continue
+            while node is not None and not _matches_compound(node, compound):
+                if combinator == '>':
+                    node = None
+                    break
+                node = node.parent
+            if node is None:
+                ok = False
+                break
+            node = node.parent
+        if ok:
+            return True
+    return False
+
+
+# CSS ----------------------------------------------------------------------
+
+def _blocks(css):
+    """Yield ``(prelude, body)`` for every top-level block or statement."""
+    index, length = 0, len(css)
+    while index < length:
+        brace = css.find('{', index)
+        semicolon = css.find(';', index)
+        if semicolon != -1 and (brace == -1 or semicolon < brace):
+            # @import / @charset statement
+            yield css[index:semicolon].strip(), None
+            index = semicolon + 1
+            continue
+        if brace == -1:
+            break
+        depth, end = 1, brace + 1
+        while end < length and depth:
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+            end += 1
+        yield css[index:brace].strip(), css[brace + 1:end - 1]
+        index = end
+
+
+def _absolute_urls(css, base_url):
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('data:', '#')) or is_remote(url) or url.startswith('/'):
+            return match.group(0)
+        return f'url({match.group(1)}{urljoin(base_url, url)}{match.group(1)})'
+
+    return re.sub(r'url\(\s*(["\']?)([^"\')]+)\1\s*\)', replace, css)
+
+
+def extract(css, elements, base_url=''):
+    """Return the rules of ``css`` that apply to ``elements``."""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    kept = []
+    deferred = []   # @keyframes / @font-face, kept only if referenced
+    for prelude, body in _blocks(css):
+        if body is None:
+            if prelude.lower().startswith('@charset'):
+                continue
+            kept.append(prelude + ';')
+        elif prelude.startswith(('@media', '@supports')):
+            inner = extract(body, elements)
+            if inner:
+                kept.append(f'{prelude}{{{inner}}}')
+        elif prelude.startswith('@'):
+            deferred.append((prelude, body))
+        else:
+            selectors = [
+                s for s in split_top_level(prelude)
+                if selector_matches(s, elements)
+            ]
+            if selectors:
+                kept.append(f'{",".join(selectors)}{{{" ".join(body.split())}}}')
+    result = '\n'.join(kept)
+    for prelude, body in deferred:
+        name = prelude.split(None, 1)[1] if ' ' in prelude else ''
+        if prelude.startswith('@font-face'):
+            family = re.search(r'font-family\s*:\s*["\']?([^;"\']+)', body)
+            name = family.group(1) if family else ''
+        if name and name.strip() in result:
+            result += f'\n{prelude}{{{" ".join(body.split())}}}'
+    return _absolute_urls(result, base_url) if base_url else result
+
+
+# Build output -------------------------------------------------------------
+
+def output_dir():
+    return str(settings.CRITICAL_CSS_DIR)
+
+
+@lru_cache(maxsize=None)
+def _load(template_name):
+    directory = output_dir()
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding='utf-8') as f:
+            manifest = json.load(f)
+        with open(os.path.join(directory, file_name(template_name)), encoding='utf-8') as f:
+            return f.read(), frozenset(manifest['stylesheets'])
+    except (OSError, ValueError, KeyError):
+        return None, frozenset()
+
+
+def load(template_name):
+    """``(critical css or None, hrefs it covers)`` for a template."""
+    if settings.DEBUG:
+        _load.cache_clear()
+    return _load(template_name)
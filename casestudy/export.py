@@ -0,0 +1,185 @@
+"""
+Streaming CSV/NDJSON export of case studies and comments.
+
+Rows are read with ``QuerySet.iterator(chunk_size=...)`` from a
+``values_list()`` query and encoded one line at a time, so memory use stays
+flat however large the tables get. The same generators back the staff-only
+``/export/<kind>.<format>`` endpoints (a ``StreamingHttpResponse``) and the
+``export_data`` management command.
+
+Filters: ``since``/``until`` dates (inclusive, on ``created_on``) and, for
+comments, ``approved``.
+
+CSV cells starting with ``=``, ``+``, ``-``, ``@``, a tab or a carriage
+return get a leading ``'`` so spreadsheets show user-written text (comments
+are anyone's input) instead of evaluating it as a formula. NDJSON is
+written unchanged.
+"""
+
+import csv
+import datetime
+import json
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponseBadRequest, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.http import require_safe
+
+from coreflowepc.middleware import query_budget
+
+from .models import Casestudy, Comment
+
+CHUNK_SIZE = 2000
+
+# kind -> (model, [(column name, ORM lookup), ...])
+EXPORTS = {
+    'casestudies': (Casestudy, [
+        ('id', 'id'),
+        ('title', 'title'),
+        ('slug', 'slug'),
+        ('client', 'client__client'),
+        ('location', 'location__location'),
+        ('industry', 'industry__industry'),
+        ('excerpt', 'excerpt'),
+        ('description', 'description'),
+        ('image', 'casestudyimage'),
+        ('approved_comments', 'approved_comment_count'),
+        ('pending_comments', 'pending_comment_count'),
+        ('created_on', 'created_on'),
+        ('updated_on', 'updated_on'),
+    ]),
+    'comments': (Comment, [
+        ('id', 'id'),
+        ('casestudy', 'casestudy__slug'),
+        ('author', 'author__username'),
+        ('content', 'content'),
+        ('approved', 'approved'),
+        ('created_on', 'created_on'),
+    ]),
+}
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class ExportError(ValueError):
+    """Invalid export kind, format or filter."""
+
+
+def _day_start(value, name):
+    day = value if isinstance(value, datetime.date) else parse_date(value or '')
+    if day is None:
+        raise ExportError(f'{name} must be a date (YYYY-MM-DD)')
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def export_rows(kind, since=None, until=None, approved=None):
+    """
+    Return ``(columns, rows)`` for an export.
+
+    ``rows`` is a lazy iterator of tuples; nothing is fetched until it is
+    consumed, and then only ``CHUNK_SIZE`` rows are held at a time.
+    """
+    if kind not in EXPORTS:
+        raise ExportError(f'Unknown export {kind!r}; choose from {", ".join(EXPORTS)}')
+    model, columns = EXPORTS[kind]
+    queryset = model.objects.order_by('id')
+    if since:
+        queryset = queryset.filter(created_on__gte=_day_start(since, 'since'))
+    if until:
+        end = _day_start(until, 'until') + datetime.timedelta(days=1)
+        queryset = queryset.filter(created_on__lt=end)
+    if approved is not None:
+        if model is not Comment:
+            raise ExportError('The approved filter only applies to comments')
+        queryset = queryset.filter(approved=approved)
+    rows = queryset.values_list(*[lookup for _, lookup in columns])
+    return [name for name, _ in columns], rows.iterator(chunk_size=CHUNK_SIZE)
+
+
+def _plain(value):
+    """Reduce field values (e.g. Cloudinary resources) to JSON/CSV scalars."""
+    if value is None or isinstance(value, (str, int, bool)):
+        return value
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value)
+
+
+# Spreadsheet apps run cells starting with these as formulas
+_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value):
+    """A CSV cell, with text that looks like a formula quoted by a ``'``."""
+    value = _plain(value)
+    if isinstance(value, str) and value.startswith(_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class _Echo:
+    """File-like object whose write() returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(columns, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(map(_csv_cell, row))
+
+
+def ndjson_lines(columns, rows):
+    encoder = json.JSONEncoder(separators=(',', ':'))
+    for row in rows:
+        yield encoder.encode(dict(zip(columns, map(_plain, row)))) + '\n'
+
+
+def export_lines(fmt, columns, rows):
+    if fmt == 'csv':
+        return csv_lines(columns, rows)
+    if fmt == 'ndjson':
+        return ndjson_lines(columns, rows)
+    raise ExportError(f'Unknown format {fmt!r}; choose from {", ".join(FORMATS)}')
+
+
+def parse_approved(value):
+    """Map ``yes``/``no`` style filter values to a boolean (or None)."""
+    if value in (None, ''):
+        return None
+    value = value.lower()
+    if value in ('1', 'true', 'yes'):
+        return True
+    if value in ('0', 'false', 'no'):
+        return False
+    raise ExportError('approved must be true or false')
+
+
+@query_budget(queries=3)
+@require_safe
+@staff_member_required
+def export(request, kind, fmt):
+    """Stream an export to staff, e.g. ``/export/comments.csv?approved=false``."""
+    if kind not in EXPORTS or fmt not in FORMATS:
+        raise Http404('Unknown export')
+    try:
+        columns, rows = export_rows(
+            kind,
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+            approved=parse_approved(request.GET.get('approved')),
+        )
+    except ExportError as e:
+        return HttpResponseBadRequest(str(e))
+    response = StreamingHttpResponse(
+        export_lines(fmt, columns, rows), content_type=FORMATS[fmt]
+    )
+    filename = f'{kind}-{timezone.localdate():%Y%m%d}.{fmt}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'private, no-store'
+    return response
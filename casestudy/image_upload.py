@@ -0,0 +1,198 @@
+"""
+Content-addressed image upload pipeline used by ``upload_cloudinary``.
+
+Files are identified by the SHA-256 of their bytes, so:
+
+- byte-identical copies (``Fire-Gas-Detection.png`` and the hashed
+  ``Fire-Gas-Detection.d797d6af367a.png`` left by collectstatic) are
+  uploaded once;
+- a JSON manifest records every uploaded digest and is saved after each
+  success, so re-runs skip finished work and an interrupted run resumes
+  where it stopped.
+
+Uploads run on a bounded thread pool and are retried with exponential
+backoff. The storage API sits behind a small uploader interface:
+``CloudinaryUploader`` for production and ``LocalUploader``, which copies
+into a directory, as a stand-in for development and tests.
+"""
+
+import hashlib
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+# name.<12 hex chars>.ext, as written by ManifestStaticFilesStorage
+_HASHED_NAME_RE = re.compile(r'^(?P<stem>.+)\.[0-9a-f]{12}(?P<ext>\.\w+)$')
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def canonical_name(filename):
+    """Strip a collectstatic content hash: ``a.0123456789ab.png`` -> ``a.png``."""
+    match = _HASHED_NAME_RE.match(filename)
+    if match:
+        return match.group('stem') + match.group('ext')
+    return filename
+
+
+class Manifest:
+    """Thread-safe ``digest -> upload record`` map persisted as JSON."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding='utf-8') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+
+    def __contains__(self, digest):
+        return digest in self.entries
+
+    def get(self, digest):
+        return self.entries.get(digest)
+
+    def record(self, digest, entry):
+        """Store an entry and write the manifest atomically."""
+        with self.lock:
+            self.entries[digest] = entry
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+
+
+class CloudinaryUploader:
+    """Upload to Cloudinary using the configured credentials."""
+
+    name = 'cloudinary'
+
+    def upload(self, path, public_id):
+        import cloudinary.uploader
+        result = cloudinary.uploader.upload(
+            path, public_id=public_id, overwrite=True, resource_type='image',
+        )
+        return {'public_id': result['public_id'], 'url': result['secure_url']}
+
+
+class LocalUploader:
+    """Stand-in for the storage API: copy files into ``directory``."""
+
+    name = 'local'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def upload(self, path, public_id):
+        extension = os.path.splitext(path)[1]
+        target = os.path.join(self.directory, public_id + extension)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(path, target)
+        return {'public_id': public_id, 'url': 'file://' + os.path.abspath(target)}
+
+
+def scan(directory, skip=()):
+    """
+    Group the images in ``directory`` by content.
+
+    Returns ``{digest: [filename, ...]}`` with un-hashed names first.
+    Hashed copies of a file whose current content differs (stale
+    collectstatic leftovers) are left out.
+    """
+    groups = {}
+    for entry in sorted(os.scandir(directory), key=lambda e: e.name):
+        if not entry.is_file() or entry.name.startswith('.'):
+            continue
+        if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        if canonical_name(entry.name) in skip:
+            continue
+        groups.setdefault(file_digest(entry.path), []).append(entry.name)
+    current = {name for names in groups.values() for name in names}
+    for digest, names in list(groups.items()):
+        names.sort(key=lambda name: (canonical_name(name) != name, name))
+        if canonical_name(names[0]) != names[0] and canonical_name(names[0]) in current:
+            del groups[digest]
+    return groups
+
+
+def upload_with_retry(uploader, path, public_id, attempts=4, backoff=1.0):
+    """Call ``uploader.upload``, retrying with exponential backoff and jitter."""
+    for attempt in range(1, attempts + 1):
+        try:
+            return uploader.upload(path, public_id)
+        except Exception:
+            if attempt == attempts:
+                raise
+            time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+
+def run_pipeline(directory, uploader, manifest, folder='case_studies',
+                 workers=4, attempts=4, backoff=1.0, skip=(), log=None):
+    """
+    Upload every new image in ``directory`` once per distinct content.
+
+    Returns ``(uploaded, skipped, failed)`` where ``failed`` maps file
+    names to the final exception. ``log(message)`` receives progress.
+    """
+    log = log or (lambda message: None)
+    groups = scan(directory, skip=skip)
+    pending = {}
+    skipped = 0
+    for digest, names in groups.items():
+        if digest in manifest:
+            skipped += 1
+            entry = manifest.get(digest)
+            files = sorted(set(entry['files']) | set(names))
+            if files != sorted(entry['files']):
+                manifest.record(digest, dict(entry, files=files))
+            continue
+        pending[digest] = names
+
+    uploaded = 0
+    failed = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for digest, names in pending.items():
+            stem = os.path.splitext(canonical_name(names[0]))[0]
+            public_id = f'{folder}/{stem}' if folder else stem
+            future = pool.submit(
+                upload_with_retry, uploader,
+                os.path.join(directory, names[0]), public_id,
+                attempts, backoff,
+            )
+            futures[future] = (digest, names)
+        for future in as_completed(futures):
+            digest, names = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed[names[0]] = e
+                log(f'failed {names[0]}: {e}')
+                continue
+            manifest.record(digest, {
+                'public_id': result['public_id'],
+                'url': result['url'],
+                'files': names,
+                'uploaded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            })
+            uploaded += 1
+            duplicates = f' (+{len(names) - 1} duplicate(s))' if len(names) > 1 else ''
+            log(f'uploaded {names[0]} -> {result["public_id"]}{duplicates}')
+    return uploaded, skipped, failed
@@ -0,0 +1,267 @@
+"""
+Management command to suggest indexes from the slow-query log.
+
+Reads the NDJSON file written by ``QueryBudgetMiddleware`` (see
+``coreflowepc/middleware.py``), groups the queries by SQL shape, replays
+one sample of each ``SELECT`` with ``EXPLAIN QUERY PLAN`` (SQLite) or
+``EXPLAIN (FORMAT JSON)`` (PostgreSQL) and reports full table scans and
+sorts that an index could have avoided. For each such table it suggests a
+composite index made of the equality columns of the ``WHERE`` clause
+followed by the ``ORDER BY`` (or range) columns, unless an existing index
+already starts with those columns, and prints the matching migration
+operation.
+
+Unless ``settings.SLOW_QUERY_LOG_PARAMS`` was on when the log was written,
+the parameter values are redacted and each query is explained with NULLs.
+SQLite plans the same either way; PostgreSQL may fold ``= NULL`` predicates
+away, so analyse a log written with parameters (e.g. on a staging copy)
+there.
+
+The suggestions are heuristics: review them against the real data
+distribution before adding an index.
+"""
+
+import json
+import re
+from collections import OrderedDict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, models
+
+_WHERE_RE = re.compile(
+    r'\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|$)', re.S
+)
+_ORDER_RE = re.compile(r'\bORDER BY\b(.*?)(?:\bLIMIT\b|\bOFFSET\b|$)', re.S)
+_FROM_RE = re.compile(r'\bFROM\s+"(\w+)"')
+_GROUP_RE = re.compile(r'\(([^()]*)\)', re.S)
+_SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+
+def _column_re(table, operators):
+    return re.compile(r'"%s"\."(\w+)"\s*(?:%s)' % (re.escape(table), operators))
+
+
+def _strip_or_groups(where):
+    """
+    Drop parenthesised groups containing OR, innermost first.
+
+    Predicates under an OR can't drive an index prefix. Other groups are
+    kept, with their parentheses turned into brackets so the loop ends.
+    """
+    def replace(match):
+        if re.search(r'\bOR\b', match.group(1)):
+            return ''
+        return '[%s]' % match.group(1)
+
+    previous = None
+    while previous != where:
+        previous, where = where, _GROUP_RE.sub(replace, where)
+    return where
+
+
+class Command(BaseCommand):
+    """
+    Replay logged slow queries with EXPLAIN and suggest missing indexes.
+
+    Usage: python manage.py advise_indexes [--log FILE] [--min-ms 0]
+           [--limit 20]
+    """
+    help = 'Explain slow queries from the slow-query log and suggest indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--log', default=getattr(settings, 'SLOW_QUERY_LOG', None),
+            help='Slow-query NDJSON file (default: settings.SLOW_QUERY_LOG)',
+        )
+        parser.add_argument(
+            '--min-ms', type=float, default=0,
+            help='Ignore shapes whose slowest run was faster than this',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=20,
+            help='Analyse at most this many shapes, by total time',
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            raise CommandError(
+                f'EXPLAIN analysis is not supported on {connection.vendor}'
+            )
+        shapes = self.read_log(options['log'])
+        shapes = [
+            shape for shape in shapes.values()
+            if shape['max_ms'] >= options['min_ms']
+        ]
+        shapes.sort(key=lambda shape: shape['total_ms'], reverse=True)
+        if not shapes:
+            self.stdout.write(self.style.SUCCESS('No slow SELECT queries logged.'))
+            return
+
+        suggestions = OrderedDict()
+        for shape in shapes[:options['limit']]:
+            self.report_shape(shape, suggestions)
+
+        if not suggestions:
+            self.stdout.write(self.style.SUCCESS(
+                'No missing indexes found for the logged queries.'
+            ))
+            return
+        self.stdout.write(self.style.WARNING(
+            f'\n{len(suggestions)} suggested index(es). Add them to the '
+            "models' Meta.indexes and run makemigrations, or use:"
+        ))
+        for model, index in suggestions.values():
+            self.stdout.write(
+                '    migrations.AddIndex(\n'
+                f"        model_name='{model._meta.model_name}',\n"
+                f'        index=models.Index(fields={index.fields!r}, '
+                f"name='{index.name}'),\n"
+                '    ),'
+            )
+
+    def read_log(self, path):
+        """Group logged SELECT statements by shape."""
+        if not path:
+            raise CommandError('No slow-query log configured; pass --log')
+        shapes = {}
+        try:
+            with open(path, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('params') is None:
+                        continue  # not a SELECT (redacted params are [null, ...])
+                    shape = shapes.setdefault(record['shape'], {
+                        'sql': record['sql'],
+                        'params': record['params'],
+                        'count': 0,
+                        'total_ms': 0.0,
+                        'max_ms': 0.0,
+                        'views': set(),
+                    })
+                    shape['count'] += 1
+                    shape['total_ms'] += record['duration_ms']
+                    shape['max_ms'] = max(shape['max_ms'], record['duration_ms'])
+                    shape['views'].add(record['view'])
+        except FileNotFoundError:
+            raise CommandError(f'Slow-query log {path} does not exist')
+        return shapes
+
+    def report_shape(self, shape, suggestions):
+        sql = shape['sql']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"\n{shape['count']}x, {shape['total_ms']:.1f}ms total, "
+            f"{shape['max_ms']:.1f}ms max in {', '.join(sorted(shape['views']))}"
+        ))
+        self.stdout.write(f'  {sql[:300]}')
+        try:
+            plan, scanned, sorted_ = self.explain(sql, shape['params'])
+        except DatabaseError as e:
+            self.stdout.write(self.style.ERROR(f'  EXPLAIN failed: {e}'))
+            return
+        for line in plan:
+            self.stdout.write(f'    {line}')
+
+        tables = set(scanned)
+        if sorted_:
+            main_table = _FROM_RE.search(sql)
+            if main_table:
+                tables.add(main_table.group(1))
+        for table in sorted(tables):
+            problem = 'full scan' if table in scanned else 'sort without index'
+            index = self.suggest_index(sql, table)
+            if index is None:
+                self.stdout.write(self.style.WARNING(
+                    f'  {problem} of {table}; no better index found'
+                ))
+                continue
+            model, new_index = index
+            self.stdout.write(self.style.WARNING(
+                f'  {problem} of {table}: suggest index on '
+                f"({', '.join(new_index.fields)})"
+            ))
+            suggestions[(table, tuple(new_index.fields))] = index
+
+    def explain(self, sql, params):
+        """Return (plan lines, fully scanned tables, needs sort)."""
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                details = [row[3] for row in cursor.fetchall()]
+                scanned = [
+                    match.group(1) for match in map(_SQLITE_SCAN_RE.match, details)
+                    if match
+                ]
+                sorted_ = any('USE TEMP B-TREE FOR ORDER BY' in d for d in details)
+                return details, scanned, sorted_
+
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            lines, scanned, sorted_ = [], [], False
+            stack = [(plan[0]['Plan'], 0)]
+            while stack:
+                node, depth = stack.pop()
+                relation = node.get('Relation Name')
+                lines.append('  ' * depth + node['Node Type'] + (
+                    f' on {relation}' if relation else ''
+                ))
+                if node['Node Type'] == 'Seq Scan':
+                    scanned.append(relation)
+                elif node['Node Type'] in ('Sort', 'Incremental Sort'):
+                    sorted_ = True
+                for child in reversed(node.get('Plans', [])):
+                    stack.append((child, depth + 1))
+            return lines, scanned, sorted_
+
+    def suggest_index(self, sql, table):
+        """
+        Build a composite index for ``table`` from the query's predicates.
+
+        Returns ``(model, models.Index)`` or None when there is nothing to
+        index or an existing index already leads with the same columns.
+        """
+        model = next(
+            (m for m in apps.get_models() if m._meta.db_table == table), None
+        )
+        if model is None:
+            return None
+
+        where = _WHERE_RE.search(sql)
+        where = _strip_or_groups(where.group(1) if where else '')
+        equality = _column_re(table, r'=|\bIN\b|\bIS\b|\]|\bAND\b|$').findall(where)
+        ranges = _column_re(table, r'<|>|\bBETWEEN\b').findall(where)
+        order = _ORDER_RE.search(sql)
+        order = _column_re(table, r'\s|,|$').findall(order.group(1)) if order else []
+
+        columns_by_name = {f.column: f for f in model._meta.concrete_fields}
+        pk_column = model._meta.pk.column
+        # Equality columns can go in any order; use the model's for stable
+        # suggestions, then the sort (or first range) columns
+        fields = list(columns_by_name)
+        equality = sorted(set(equality) & set(fields), key=fields.index)
+        columns = []
+        for column in equality + (order or ranges[:1]):
+            if column in columns_by_name and column not in columns:
+                columns.append(column)
+        if len(columns) > 1 and columns[-1] == pk_column:
+            columns.pop()  # the primary key is the implicit tie-breaker
+        if not columns or columns == [pk_column]:
+            return None
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        for constraint in constraints.values():
+            existing = constraint['columns'] or []
+            if constraint['index'] and existing[:len(columns)] == columns:
+                return None
+
+        index = models.Index(fields=[columns_by_name[c].name for c in columns])
+        index.set_name_with_model(model)
+        return model, index
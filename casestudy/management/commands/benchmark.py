@@ -0,0 +1,171 @@
+"""
+Management command to run the load benchmark.
+
+Runs the scenarios of ``casestudy.benchmark`` against the current
+database (fill it with ``seed_synthetic`` first) and reports p50/p95/p99
+latency, throughput, queries per request and peak memory per scenario.
+``--output`` saves the result as JSON; ``--baseline`` compares against a
+saved result and fails when a scenario got slower than ``--tolerance``
+percent or issues more queries.
+
+Comment scenarios write to the database as a temporary superuser
+(``benchmark-user-<random>``); it and its comments are deleted again at
+the end.
+"""
+
+import json
+import logging
+import platform
+import resource
+import sys
+import time
+
+import django
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from casestudy.benchmark import (
+    SCENARIOS, ClientDriver, Fixture, LocalServer, ServerDriver, compare,
+    run_scenario, summarize,
+)
+from casestudy.models import Casestudy, Comment
+
+
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Command(BaseCommand):
+    """
+    Benchmark the main pages and comment actions.
+
+    Usage: python manage.py benchmark [--requests 200] [--server]
+           [--scenario detail] [--output result.json]
+           [--baseline baseline.json]
+    """
+    help = 'Run the load benchmark and optionally compare with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Measured requests per scenario')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+        parser.add_argument(
+            '--scenario', action='append', choices=sorted(SCENARIOS),
+            help='Scenario to run (repeatable); all by default',
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help='Parallel clients')
+        parser.add_argument(
+            '--server', action='store_true',
+            help='Go through a local HTTP server instead of the test client',
+        )
+        parser.add_argument('--output', help='Write the result as JSON to this file')
+        parser.add_argument('--baseline', help='Compare with a result saved by --output')
+        parser.add_argument(
+            '--tolerance', type=float, default=10.0,
+            help='Allowed slowdown in percent before --baseline fails',
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be at least 1.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline'], encoding='utf-8') as f:
+                baseline = json.load(f)
+        try:
+            fixture = Fixture()
+        except ValueError as e:
+            raise CommandError(e)
+        names = options['scenario'] or list(SCENARIOS)
+
+        # Server-Timing on every response is where the query counts come
+        # from; the middleware reads the rate when it is instantiated
+        timing_logger = logging.getLogger('coreflowepc.timing')
+        level = timing_logger.level
+        timing_logger.setLevel(logging.WARNING)
+        server = None
+        try:
+            with override_settings(
+                SERVER_TIMING_SAMPLE_RATE=1.0,
+                ALLOWED_HOSTS=['testserver', '127.0.0.1', 'localhost'],
+            ):
+                if options['server']:
+                    server = LocalServer(WSGIHandler())
+
+                    def make_driver():
+                        return ServerDriver(server, fixture)
+                else:
+                    def make_driver():
+                        return ClientDriver(fixture)
+
+                scenarios = {}
+                for name in names:
+                    samples, wall = run_scenario(
+                        name, fixture, make_driver, options['requests'],
+                        warmup=options['warmup'],
+                        concurrency=options['concurrency'],
+                    )
+                    scenarios[name] = summarize(samples, wall)
+                    self.write_row(name, scenarios[name])
+        finally:
+            if server is not None:
+                server.stop()
+            timing_logger.setLevel(level)
+            fixture.cleanup()
+
+        result = {
+            'meta': {
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'driver': 'server' if options['server'] else 'client',
+                'requests': options['requests'],
+                'warmup': options['warmup'],
+                'concurrency': options['concurrency'],
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'casestudies': Casestudy.objects.count(),
+                'comments': Comment.objects.count(),
+            },
+            'scenarios': scenarios,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        self.stdout.write(f'Peak RSS: {result["peak_rss_mb"]}MB')
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=1)
+                f.write('\n')
+            self.stdout.write(f'Result written to {options["output"]}.')
+
+        errors = sum(s['errors'] for s in scenarios.values())
+        if errors:
+            self.stdout.write(self.style.WARNING(f'{errors} requests failed.'))
+        if baseline is not None:
+            self.compare(result, baseline, options['tolerance'])
+        else:
+            self.stdout.write(self.style.SUCCESS('Benchmark complete.'))
+
+    def write_row(self, name, stats):
+        self.stdout.write(
+            f'{name:<22} p50 {stats["p50_ms"]:>8.1f}ms  p95 {stats["p95_ms"]:>8.1f}ms  '
+            f'p99 {stats["p99_ms"]:>8.1f}ms  {stats["throughput_rps"]:>7.1f} req/s  '
+            f'{stats["queries_avg"] if stats["queries_avg"] is not None else "-":>5} queries'
+            + (f'  {stats["errors"]} errors' if stats['errors'] else '')
+        )
+
+    def compare(self, result, baseline, tolerance):
+        rows, regressions = compare(result, baseline, tolerance)
+        for name, metric, old, new, change in rows:
+            line = f'{name:<22} {metric:<15} {old:>10} -> {new:<10} {change:+.1f}%'
+            if (name, metric, old, new, change) in regressions:
+                line = self.style.WARNING(line)
+            self.stdout.write(line)
+        if regressions:
+            raise CommandError(
+                f'{len(regressions)} metrics regressed beyond {tolerance}% '
+                f'(queries: any increase).'
+            )
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
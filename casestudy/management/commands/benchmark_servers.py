@@ -0,0 +1,231 @@
+"""
+Management command comparing the WSGI and ASGI deployment profiles.
+
+Starts gunicorn twice against the current database, with sync workers
+(``coreflowepc.wsgi``) and with uvicorn workers (``coreflowepc.asgi``),
+and drives each with an increasing number of concurrent connections.
+``--slow-client-ms`` makes clients dribble their request headers, like
+mobile connections would, each pausing a random 0-2x that long: a sync
+worker waits on every connection in turn, so one slow client holds up
+the faster ones queued behind it, while an async worker is not blocked. Reports latency percentiles,
+throughput, failed requests and the peak resident memory of the master
+plus its workers (read from ``/proc``, so Linux only).
+
+Needs ``uvicorn`` installed for the ASGI profile; it is skipped otherwise.
+"""
+
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from importlib.util import find_spec
+
+from django.core.management.base import BaseCommand, CommandError
+
+from casestudy.benchmark import summarize
+from casestudy.models import Casestudy
+
+PROFILES = {
+    'wsgi': ['coreflowepc.wsgi:application', '--worker-class', 'sync'],
+    'asgi': ['coreflowepc.asgi:application', '--worker-class', 'uvicorn.workers.UvicornWorker'],
+}
+# Status recorded for requests that got no HTTP response at all
+NO_RESPONSE = 599
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    """Resident memory, in MB, of ``pid`` and its direct children."""
+    pids = [pid]
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    total = 0
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total / 1024
+
+
+class MemorySampler(threading.Thread):
+    """Keep the peak of ``process_tree_rss`` until stopped."""
+
+    def __init__(self, pid, interval=0.2):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0.0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, process_tree_rss(self.pid))
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return round(self.peak, 1)
+
+
+async def fetch(port, path, slow_ms, timeout):
+    """One HTTP/1.1 request on a new connection; returns (latency, status)."""
+    start = time.perf_counter()
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection('127.0.0.1', port), timeout
+        )
+        try:
+            head = f'GET {path} HTTP/1.1\r\n'
+            headers = 'Host: 127.0.0.1\r\nAccept-Encoding: gzip\r\nConnection: close\r\n\r\n'
+            writer.write(head.encode())
+            if slow_ms:
+                await writer.drain()
+                await asyncio.sleep(slow_ms / 1000)
+            writer.write(headers.encode())
+            await writer.drain()
+            status_line = await asyncio.wait_for(reader.readline(), timeout)
+            await asyncio.wait_for(reader.read(), timeout)
+        finally:
+            writer.close()
+        status = int(status_line.split()[1])
+    except (OSError, asyncio.TimeoutError, IndexError, ValueError):
+        status = NO_RESPONSE
+    return time.perf_counter() - start, status
+
+
+async def load(port, paths, concurrency, duration, slow_ms, timeout):
+    """Keep ``concurrency`` clients busy for ``duration`` seconds."""
+    samples = []
+    deadline = time.perf_counter() + duration
+    rng = random.Random(0)
+
+    async def client(n):
+        i = n
+        while time.perf_counter() < deadline:
+            delay = rng.uniform(0, 2 * slow_ms)
+            latency, status = await fetch(port, paths[i % len(paths)], delay, timeout)
+            samples.append((latency, status, None))
+            i += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    return samples, time.perf_counter() - started
+
+
+class Command(BaseCommand):
+    """
+    Benchmark gunicorn sync workers against uvicorn workers.
+
+    Usage: python manage.py benchmark_servers [--workers 2]
+           [--concurrency 10 100 500] [--duration 10]
+           [--slow-client-ms 200] [--output servers.json]
+    """
+    help = 'Compare concurrency and memory of the WSGI and ASGI profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), default=['wsgi', 'asgi'])
+        parser.add_argument('--workers', type=int, default=2)
+        parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 500])
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+        parser.add_argument(
+            '--slow-client-ms', type=int, default=0,
+            help='Mean delay between the request line and the headers',
+        )
+        parser.add_argument('--path', action='append', help='URL to request (repeatable)')
+        parser.add_argument('--timeout', type=float, default=30.0, help='Per-request timeout in seconds')
+        parser.add_argument('--output', help='Write the result as JSON to this file')
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        paths = options['path']
+        if not paths:
+            casestudy = Casestudy.objects.order_by('pk').first()
+            if casestudy is None:
+                raise CommandError('No case studies to benchmark; run seed_synthetic first.')
+            paths = ['/', f'/case-study/{casestudy.slug}/']
+
+        result = {'options': {
+            key: options[key] for key in (
+                'workers', 'concurrency', 'duration', 'slow_client_ms', 'timeout',
+            )
+        }, 'paths': paths, 'profiles': {}}
+        for profile in options['profiles']:
+            if profile == 'asgi' and find_spec('uvicorn') is None:
+                self.stdout.write(self.style.WARNING('Skipping asgi: uvicorn is not installed.'))
+                continue
+            result['profiles'][profile] = self.run_profile(profile, paths, options)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(result, f, indent=1)
+                f.write('\n')
+            self.stdout.write(f'Result written to {options["output"]}.')
+        self.stdout.write(self.style.SUCCESS('Server benchmark complete.'))
+
+    def run_profile(self, profile, paths, options):
+        port = free_port()
+        command = [
+            sys.executable, '-m', 'gunicorn', *PROFILES[profile],
+            '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers']),
+            '--timeout', str(int(options['timeout']) + 30), '--log-level', 'warning',
+        ]
+        # gunicorn.conf.py still applies (preload, gc.freeze); the cache
+        # warm-up it starts would compete with the load
+        env = dict(os.environ, SERVER_TIMING_SAMPLE_RATE='0', WARM_CACHE_ON_START='0')
+        server = subprocess.Popen(command, env=env)
+        try:
+            self.wait_until_ready(server, port, paths[0])
+            idle_rss = round(process_tree_rss(server.pid), 1)
+            levels = {}
+            for concurrency in options['concurrency']:
+                sampler = MemorySampler(server.pid)
+                sampler.start()
+                samples, wall = asyncio.run(load(
+                    port, paths, concurrency, options['duration'],
+                    options['slow_client_ms'], options['timeout'],
+                ))
+                stats = summarize(samples, wall)
+                stats['peak_rss_mb'] = sampler.stop()
+                levels[str(concurrency)] = stats
+                self.stdout.write(
+                    f'{profile} c={concurrency:<5} p50 {stats["p50_ms"]:>9.1f}ms  '
+                    f'p95 {stats["p95_ms"]:>9.1f}ms  p99 {stats["p99_ms"]:>9.1f}ms  '
+                    f'{stats["throughput_rps"]:>8.1f} req/s  {stats["errors"]} errors  '
+                    f'{stats["peak_rss_mb"]}MB'
+                )
+        finally:
+            server.terminate()
+            try:
+                server.wait(10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+        return {'idle_rss_mb': idle_rss, 'concurrency': levels}
+
+    def wait_until_ready(self, server, port, path, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'gunicorn exited with status {server.returncode}')
+            _, status = asyncio.run(fetch(port, path, 0, 5))
+            if status < 500:
+                return
+            time.sleep(0.2)
+        raise CommandError(f'Server on port {port} did not become ready')
@@ -0,0 +1,150 @@
+"""
+Management command to build the per-template critical CSS.
+
+Renders every page in ``casestudy.critical_css.PAGES`` in a throwaway test
+database seeded with fixture data, and writes the rules of
+``STYLESHEETS`` used by the first ``--fold`` elements of each page to
+``settings.CRITICAL_CSS_DIR``. Re-run it, and commit the output, after
+changing templates or stylesheets.
+"""
+
+import json
+import os
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles import finders
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client as TestClient, override_settings
+from django.urls import reverse
+
+from casestudy.critical_css import (
+    FOLD_ELEMENTS, MANIFEST_NAME, PAGES, STYLESHEETS, extract, file_name,
+    fold_elements, is_remote, output_dir,
+)
+from casestudy.models import Casestudy, Client, Comment, Industry, Location
+
+FETCH_TIMEOUT = 10
+
+
+class Command(BaseCommand):
+    """
+    Extract the above-the-fold CSS of each public page.
+
+    Usage: python manage.py build_critical_css [--fold 200]
+    """
+    help = 'Build per-template critical CSS for {% critical_css %}'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fold', type=int, default=FOLD_ELEMENTS,
+            help='Elements from the top of <body> treated as above the fold',
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        sheets = self.load_stylesheets()
+        if not sheets:
+            raise CommandError('No stylesheet could be loaded.')
+
+        with override_settings(
+            ALLOWED_HOSTS=['*'],
+            # Private cache: nothing rendered from the real database
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'build-critical-css',
+            }},
+            STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+        ):
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False,
+            )
+            try:
+                pages = self.render_pages(self.seed())
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        directory = output_dir()
+        os.makedirs(directory, exist_ok=True)
+        for template_name, html in pages:
+            elements = fold_elements(html, options['fold'])
+            css = '\n'.join(
+                extract(text, elements, base_url)
+                for _, text, base_url in sheets
+            )
+            with open(os.path.join(directory, file_name(template_name)), 'w', encoding='utf-8') as f:
+                f.write(css + '\n')
+            self.stdout.write(
+                f'{template_name}: {len(elements)} elements, {len(css) / 1024:.1f}KB'
+            )
+        with open(os.path.join(directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump({
+                'stylesheets': [href for href, _, _ in sheets],
+                'templates': [template_name for template_name, _ in pages],
+            }, f, indent=1)
+            f.write('\n')
+        self.stdout.write(self.style.SUCCESS(
+            f'Critical CSS for {len(pages)} templates written to {directory}.'
+        ))
+
+    def load_stylesheets(self):
+        """Return ``[(href, css, base url)]`` for every sheet to extract from."""
+        sheets = []
+        for href, _, extract_rules in STYLESHEETS:
+            if not extract_rules:
+                continue
+            try:
+                if is_remote(href):
+                    with urlopen(href, timeout=FETCH_TIMEOUT) as response:
+                        text = response.read().decode('utf-8')
+                    base_url = href
+                else:
+                    path = finders.find(href)
+                    if path is None:
+                        raise OSError(f'{href} not found')
+                    with open(path, encoding='utf-8') as f:
+                        text = f.read()
+                    base_url = settings.STATIC_URL + href
+            except OSError as e:
+                # Left out of the manifest, so it stays render-blocking
+                self.stdout.write(self.style.WARNING(f'Skipping {href}: {e}'))
+                continue
+            sheets.append((href, text, base_url))
+        return sheets
+
+    def seed(self):
+        """Create the fixture data the pages are rendered with."""
+        user = User.objects.create_user('critical-css', password=None)
+        client = Client.objects.create(client='Fixture Client')
+        location = Location.objects.create(location='Fixture Location')
+        industry = Industry.objects.create(industry='Fixture Industry')
+        casestudies = [
+            Casestudy.objects.create(
+                title=f'Fixture Case Study {n}', slug=f'fixture-case-study-{n}',
+                client=client, location=location, industry=industry,
+                excerpt='A short excerpt of the case study. ' * 3,
+                description='<p>Description paragraph.</p>' * 5,
+            )
+            for n in range(1, 7)
+        ]
+        for n in range(3):
+            Comment.objects.create(
+                casestudy=casestudies[0], author=user,
+                content=f'Fixture comment {n}', approved=True,
+            )
+        return {'slug': casestudies[0].slug}
+
+    def render_pages(self, fixture):
+        client = TestClient()
+        pages = []
+        for template_name, url_name, kwarg in PAGES:
+            kwargs = {kwarg: fixture[kwarg]} if kwarg else None
+            response = client.get(reverse(url_name, kwargs=kwargs))
+            if response.status_code != 200:
+                raise CommandError(
+                    f'{url_name} returned {response.status_code}'
+                )
+            pages.append((template_name, response.content.decode()))
+        return pages
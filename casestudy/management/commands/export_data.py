@@ -0,0 +1,69 @@
+"""
+Management command to export case studies or comments as CSV or NDJSON.
+
+Rows are streamed in chunks (see ``casestudy/export.py``), so the export
+runs in constant memory whatever the table size.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from casestudy import export
+
+
+class Command(BaseCommand):
+    """
+    Stream case studies or comments to a file or stdout.
+
+    Usage: python manage.py export_data {casestudies,comments}
+           [--format csv|ndjson] [--since YYYY-MM-DD] [--until YYYY-MM-DD]
+           [--approved yes|no] [--output FILE]
+    """
+    help = 'Export case studies or comments as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(export.EXPORTS))
+        parser.add_argument(
+            '--format', default='csv', choices=sorted(export.FORMATS),
+        )
+        parser.add_argument('--since', help='Only rows created on or after this date')
+        parser.add_argument('--until', help='Only rows created on or before this date')
+        parser.add_argument(
+            '--approved', help='Comments only: filter on approval (yes/no)',
+        )
+        parser.add_argument(
+            '--output', '-o', help='File to write (default: stdout)',
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        try:
+            columns, rows = export.export_rows(
+                options['kind'],
+                since=options['since'],
+                until=options['until'],
+                approved=export.parse_approved(options['approved']),
+            )
+        except export.ExportError as e:
+            raise CommandError(e)
+
+        started = time.monotonic()
+        written = -1 if options['format'] == 'csv' else 0  # CSV header
+        output = options['output']
+        stream = (
+            open(output, 'w', encoding='utf-8', newline='') if output
+            else self.stdout
+        )
+        try:
+            for line in export.export_lines(options['format'], columns, rows):
+                stream.write(line)
+                written += 1
+        finally:
+            if output:
+                stream.close()
+        if output:
+            self.stdout.write(self.style.SUCCESS(
+                f'Exported {written} {options["kind"]} to {output} '
+                f'in {time.monotonic() - started:.2f}s.'
+            ))
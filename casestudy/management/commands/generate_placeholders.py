@@ -0,0 +1,66 @@
+"""
+Management command to compute the inline image placeholders of case studies.
+
+Only case studies whose image changed since their placeholder was made,
+or that have no recorded aspect ratio yet, are fetched (all of them with
+``--force``). Fetches run concurrently and
+the results are written with one bulk update.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from casestudy.caching import bump_generation
+from casestudy.models import Casestudy
+from casestudy.placeholders import placeholder_fields
+
+
+class Command(BaseCommand):
+    """
+    Compute LQIP placeholders and dominant colours for case study images.
+
+    Usage: python manage.py generate_placeholders [--force] [--workers 8]
+    """
+    help = 'Compute inline image placeholders and dominant colours'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Recompute placeholders that are already up to date',
+        )
+        parser.add_argument('--workers', type=int, default=8)
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        casestudies = list(Casestudy.objects.only(
+            'id', 'title', 'casestudyimage', 'image_placeholder_for',
+            'image_aspect',
+        ))
+
+        def compute(casestudy):
+            return casestudy, placeholder_fields(casestudy, force=options['force'])
+
+        changed = []
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            for casestudy, fields in pool.map(compute, casestudies):
+                if fields is None:
+                    continue
+                for name, value in fields.items():
+                    setattr(casestudy, name, value)
+                changed.append(casestudy)
+                self.stdout.write(
+                    f'{casestudy.title}: {fields["image_color"] or "no image"} '
+                    f'({len(fields["image_placeholder"])} bytes)'
+                )
+
+        if changed:
+            Casestudy.objects.bulk_update(changed, [
+                'image_placeholder', 'image_color', 'image_placeholder_for',
+                'image_aspect',
+            ], batch_size=500)
+            bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(changed)} placeholders updated, '
+            f'{len(casestudies) - len(changed)} unchanged or unavailable.'
+        ))
@@ -1,14 +1,249 @@
-from django.core.management.base import BaseCommand
+"""
+Management command to load case studies, idempotently and in bulk.
+
+Records come from JSON (a top-level array), NDJSON or CSV files, read as a
+stream, or from the built-in production data when no file is given. Each
+record needs ``title``, ``slug``, ``client``, ``location``, ``industry``
+and ``description``; ``excerpt`` is optional. Images are left to the
+``upload_cloudinary`` command.
+
+Records are processed in batches:
+
+- client, location and industry names are resolved through in-memory
+  maps, creating missing ones with ``bulk_create(ignore_conflicts=True)``;
+- case studies are upserted by slug with one
+  ``bulk_create(update_conflicts=True)`` per batch, so existing rows (and
+  their comments, counters and images) are kept and updated in place.
+
+The whole load runs in one transaction. Bulk operations skip model
+signals, so the search index is refreshed per batch and the cache
+generation is bumped at the end.
+"""
+
+import csv
+import io
+import json
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, transaction
+
+from casestudy.caching import bump_generation
 from casestudy.models import Casestudy, Client, Location, Industry
+from casestudy.search import index_casestudies
+
+REQUIRED_FIELDS = ('title', 'slug', 'client', 'location', 'industry', 'description')
+UPDATE_FIELDS = [
+    'title', 'client', 'location', 'industry', 'description', 'excerpt',
+    'updated_on',
+]
+# Lookup model -> (record key, model field)
+LOOKUPS = (
+    (Client, 'client'),
+    (Location, 'location'),
+    (Industry, 'industry'),
+)
+FORMATS = {
+    '.json': 'json',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.csv': 'csv',
+}
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """Yield the items of a top-level JSON array without reading it whole."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if not started:
+            if buffer:
+                if buffer[0] != '[':
+                    raise ValueError('JSON input must be an array of records')
+                buffer = buffer[1:]
+                started = True
+                continue
+        elif buffer.startswith(']'):
+            return
+        elif buffer.startswith(','):
+            buffer = buffer[1:]
+            continue
+        elif buffer:
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # A number at the end of the buffer may be cut short
+                if end < len(buffer) or eof or not isinstance(item, (int, float)):
+                    yield item
+                    buffer = buffer[end:]
+                    continue
+        if eof:
+            raise ValueError('Unexpected end of JSON input')
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buffer += chunk
+
+
+def iter_records(stream, fmt):
+    """Yield record dicts from an open text stream."""
+    if fmt == 'json':
+        yield from iter_json_array(stream)
+    elif fmt == 'ndjson':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(stream)
 
 
 class Command(BaseCommand):
+    """
+    Upsert case studies by slug from files or the built-in data.
+
+    Usage: python manage.py load_case_study_data [FILE ...]
+           [--format json|ndjson|csv] [--batch-size 1000]
+    """
     help = 'Load case study data for production deployment'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*',
+            help='JSON, NDJSON or CSV files ("-" for stdin); '
+                 'defaults to the built-in case studies',
+        )
+        parser.add_argument(
+            '--format', choices=sorted(set(FORMATS.values())),
+            help='Input format (default: guessed from the file extension)',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
     def handle(self, *args, **options):
-        self.stdout.write('🧹 Clearing existing case studies...')
-        Casestudy.objects.all().delete()
-        
+        """Execute the command."""
+        self.batch_size = options['batch_size']
+        self.lookup_ids = {model: {} for model, _ in LOOKUPS}
+        self.created = self.updated = self.skipped = 0
+        started = time.monotonic()
+
+        try:
+            with transaction.atomic():
+                if options['files']:
+                    for path in options['files']:
+                        self.load_file(path, options['format'])
+                else:
+                    self.stdout.write('🔧 Loading built-in case study data...')
+                    self.load(self.builtin_records(), 'built-in data')
+        except DatabaseError as e:
+            raise CommandError(f'Load failed, nothing was saved: {e}')
+        bump_generation()
+
+        elapsed = time.monotonic() - started
+        total = self.created + self.updated
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(self.style.SUCCESS(
+            f'🎉 Loaded {total} case studies ({self.created} created, '
+            f'{self.updated} updated, {self.skipped} skipped) in '
+            f'{elapsed:.2f}s, {rate:.0f} records/s.'
+        ))
+
+    def load_file(self, path, fmt=None):
+        if fmt is None:
+            extension = os.path.splitext(path)[1].lower()
+            fmt = FORMATS.get(extension)
+            if fmt is None:
+                raise CommandError(f'Cannot guess the format of {path}; use --format')
+        self.stdout.write(f'🔧 Loading {path} ({fmt})...')
+        if path == '-':
+            stream = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='')
+            self.load(iter_records(stream, fmt), 'stdin')
+            return
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                self.load(iter_records(stream, fmt), path)
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+        except ValueError as e:
+            raise CommandError(f'Invalid input in {path}: {e}')
+
+    def load(self, records, source):
+        batch = []
+        for number, record in enumerate(records, 1):
+            missing = [
+                key for key in REQUIRED_FIELDS
+                if not isinstance(record, dict) or not record.get(key)
+            ]
+            if missing:
+                self.skipped += 1
+                self.stdout.write(self.style.WARNING(
+                    f'❌ {source} record {number}: missing {", ".join(missing)}'
+                ))
+                continue
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.load_batch(batch)
+                batch = []
+        if batch:
+            self.load_batch(batch)
+
+    def resolve(self, model, field, names):
+        """Return {name: id} for ``names``, creating missing rows in bulk."""
+        known = self.lookup_ids[model]
+        wanted = set(names) - set(known)
+        if wanted:
+            model.objects.bulk_create(
+                [model(**{field: name}) for name in wanted],
+                ignore_conflicts=True,
+            )
+            known.update(
+                model.objects.filter(**{f'{field}__in': wanted})
+                .values_list(field, 'id')
+            )
+        return known
+
+    def load_batch(self, batch):
+        # The last record wins when a slug repeats within a batch
+        records = {record['slug']: record for record in batch}
+        ids = {
+            model: self.resolve(model, field, {r[field] for r in records.values()})
+            for model, field in LOOKUPS
+        }
+        existing = set(
+            Casestudy.objects.filter(slug__in=records).values_list('slug', flat=True)
+        )
+        Casestudy.objects.bulk_create(
+            [
+                Casestudy(
+                    title=record['title'],
+                    slug=slug,
+                    client_id=ids[Client][record['client']],
+                    location_id=ids[Location][record['location']],
+                    industry_id=ids[Industry][record['industry']],
+                    description=record['description'],
+                    excerpt=record.get('excerpt') or None,
+                )
+                for slug, record in records.items()
+            ],
+            update_conflicts=True,
+            unique_fields=['slug'],
+            update_fields=UPDATE_FIELDS,
+        )
+        index_casestudies(
+            Casestudy.objects.filter(slug__in=records).only(
+                'id', 'title', 'excerpt', 'description'
+            )
+        )
+        self.updated += len(existing)
+        self.created += len(records) - len(existing)
+
+    def builtin_records(self):
+        """The production case studies loaded when no file is given."""
         # Professional case study data with proper image mappings
         case_studies_data = [
             {
@@ -320,32 +555,4 @@ class Command(BaseCommand):
                 'image': 'modular-carbon-capture-utilization-ccu-unit.png'
             }
         ]
-        
-        self.stdout.write('🔧 Loading case study data...')
-        
-        for data in case_studies_data:
-            try:
-                # Get or create related objects
-                client_obj, _ = Client.objects.get_or_create(client=data['client'])
-                location_obj, _ = Location.objects.get_or_create(location=data['location'])
-                industry_obj, _ = Industry.objects.get_or_create(industry=data['industry'])
-                
-                # Create case study (without image initially)
-                casestudy = Casestudy.objects.create(
-                    title=data['title'],
-                    slug=data['slug'],
-                    client=client_obj,
-                    location=location_obj,
-                    industry=industry_obj,
-                    description=data['description'],
-                    excerpt=data['excerpt']
-                    # Note: casestudyimage will be set later by upload_cloudinary command
-                )
-                
-                self.stdout.write(f'✓ Created: {casestudy.title} (image will be added by upload_cloudinary command)')
-                
-            except Exception as e:
-                self.stdout.write(f'❌ Error creating {data["title"]}: {str(e)}')
-        
-        self.stdout.write('🎉 Case study data loading completed!')
-        self.stdout.write(f'📊 Total case studies: {Casestudy.objects.count()}')
+        return case_studies_data
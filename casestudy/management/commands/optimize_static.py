@@ -0,0 +1,120 @@
+"""
+Management command to shrink the static files before collectstatic.
+
+Recompresses PNG/JPEG/WebP losslessly in place (JPEG only where
+``jpegtran`` is installed) and records which hashed copies, duplicates
+and unreferenced files ``ServedSetFinder`` should leave out of
+collectstatic. See ``casestudy/static_assets.py``.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from casestudy.image_upload import file_digest
+from casestudy.static_assets import (
+    ALWAYS_SERVED, RECOMPRESS_EXTENSIONS, list_assets, load_manifest,
+    plan_exclusions, recompress, save_manifest,
+)
+
+
+class Command(BaseCommand):
+    """
+    Recompress static images and exclude unused files from collectstatic.
+
+    Usage: python manage.py optimize_static [--dry-run] [--no-recompress]
+           [--keep images/] [--workers N]
+    """
+    help = 'Losslessly recompress static images and prune the served set'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report what would change without writing anything',
+        )
+        parser.add_argument(
+            '--no-recompress', action='store_true',
+            help='Only update the served set',
+        )
+        parser.add_argument(
+            '--keep', action='append', default=[],
+            help='Always serve files under this prefix (repeatable)',
+        )
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        started = time.monotonic()
+        roots = [str(root) for root in settings.STATICFILES_DIRS]
+        if not roots:
+            raise CommandError('STATICFILES_DIRS is empty; nothing to optimize.')
+        for root in roots:
+            self.optimize(root, options)
+        self.stdout.write(self.style.SUCCESS(
+            f'Optimized static files in {time.monotonic() - started:.1f}s.'
+        ))
+
+    def optimize(self, root, options):
+        manifest = load_manifest(root)
+        dry_run = options['dry_run']
+
+        saved = 0
+        if not options['no_recompress']:
+            optimized = manifest['optimized']
+            # Files recorded with their current digest were already done
+            pending = [
+                name for name in list_assets(root)
+                if name.lower().endswith(RECOMPRESS_EXTENSIONS)
+                and optimized.get(name) != file_digest(os.path.join(root, name))
+            ]
+
+            def run(name):
+                path = os.path.join(root, name)
+                if dry_run:
+                    return name, 0, None
+                return name, recompress(path), file_digest(path)
+
+            with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+                for name, bytes_saved, digest in pool.map(run, pending):
+                    if digest:
+                        optimized[name] = digest
+                    if bytes_saved:
+                        saved += bytes_saved
+                        self.stdout.write(f'Recompressed: {name} (-{self.format_bytes(bytes_saved)})')
+            self.stdout.write(
+                f'{len(pending)} images checked, {self.format_bytes(saved)} saved.'
+            )
+
+        excluded = plan_exclusions(root, keep=ALWAYS_SERVED + tuple(options['keep']))
+        excluded_bytes = 0
+        for name, reason in sorted(excluded.items()):
+            excluded_bytes += os.path.getsize(os.path.join(root, name))
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Excluded: {name} ({reason})')
+        reasons = {}
+        for reason in excluded.values():
+            reason = reason.split(' of ')[0]
+            reasons[reason] = reasons.get(reason, 0) + 1
+        self.stdout.write(
+            f'{len(excluded)} files ({self.format_bytes(excluded_bytes)}) left out '
+            f'of collectstatic: '
+            + ', '.join(f'{count} {reason}' for reason, count in sorted(reasons.items()))
+        )
+
+        if not dry_run:
+            manifest['excluded'] = sorted(excluded)
+            manifest['optimized'] = {
+                name: digest for name, digest in manifest['optimized'].items()
+                if os.path.exists(os.path.join(root, name))
+            }
+            save_manifest(root, manifest)
+
+    def format_bytes(self, size):
+        for unit in ('B', 'KB', 'MB'):
+            if size < 1024:
+                return f'{size:.0f}{unit}' if unit == 'B' else f'{size:.1f}{unit}'
+            size /= 1024
+        return f'{size:.1f}GB'
@@ -0,0 +1,78 @@
+"""
+Management command to delete expired database sessions in small batches.
+
+``clearsessions`` deletes every expired row in one statement, which on a
+large ``django_session`` table holds a write lock for the whole run.
+This command deletes at most ``--batch-size`` rows per transaction,
+oldest first along the ``expire_date`` index, optionally pausing between
+batches, and can stop after ``--max-batches`` or ``--max-seconds`` so a
+scheduled run stays short; the next run carries on where it stopped.
+
+Sessions kept in the signed cookie (see ``coreflowepc/sessions.py``)
+expire by themselves and have no row to delete.
+"""
+
+import time
+
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+
+class Command(BaseCommand):
+    """
+    Delete expired sessions batch by batch.
+
+    Usage: python manage.py purge_sessions [--batch-size 1000]
+           [--max-batches N] [--max-seconds N] [--sleep 0.1]
+    """
+    help = 'Incrementally delete expired database sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--max-batches', type=int, default=None,
+            help='Stop after this many batches (default: until done)',
+        )
+        parser.add_argument(
+            '--max-seconds', type=float, default=None,
+            help='Stop starting new batches after this many seconds',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0.0,
+            help='Pause between batches, in seconds, to let other writers in',
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        now = timezone.now()
+        started = time.monotonic()
+        expired = Session.objects.filter(expire_date__lt=now).order_by('expire_date')
+        deleted = batches = 0
+        while True:
+            keys = list(expired.values_list('session_key', flat=True)[:options['batch_size']])
+            if not keys:
+                break
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+            batches += 1
+            if len(keys) < options['batch_size']:
+                break
+            if options['max_batches'] is not None and batches >= options['max_batches']:
+                break
+            if (options['max_seconds'] is not None
+                    and time.monotonic() - started >= options['max_seconds']):
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        remaining = expired.exists()
+        message = (
+            f'Deleted {deleted} expired sessions in {batches} batches '
+            f'({time.monotonic() - started:.1f}s).'
+        )
+        if remaining:
+            self.stdout.write(self.style.WARNING(
+                message + ' More remain; run it again to continue.'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
@@ -0,0 +1,49 @@
+"""
+Management command to rebuild the case study full-text search index.
+
+Normally the index is kept in sync on save; use this after bulk loads that
+bypass model signals, or to recover from a corrupted index.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from casestudy.models import Casestudy
+from casestudy.search import get_backend
+
+
+class Command(BaseCommand):
+    """
+    Rebuild the full-text search index from the Casestudy table.
+
+    Usage: python manage.py rebuild_search_index [--batch-size 500]
+    """
+    help = 'Rebuild the case study full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        backend = get_backend()
+        batch_size = options['batch_size']
+        started = time.monotonic()
+        indexed = 0
+        queryset = Casestudy.objects.only('id', 'title', 'excerpt', 'description')
+        with transaction.atomic():
+            backend.clear()
+            batch = []
+            for casestudy in queryset.iterator(chunk_size=batch_size):
+                batch.append(casestudy)
+                if len(batch) >= batch_size:
+                    backend.index(batch)
+                    indexed += len(batch)
+                    batch = []
+            backend.index(batch)
+            indexed += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {indexed} case studies with {type(backend).__name__} '
+            f'in {time.monotonic() - started:.2f}s.'
+        ))
@@ -0,0 +1,75 @@
+"""
+Management command to repair drift in the denormalized comment counters.
+
+``Casestudy.approved_comment_count`` and ``pending_comment_count`` are
+maintained incrementally. Raw SQL, ``QuerySet.update()`` calls that bypass
+``CommentQuerySet.set_approved()`` or crashes mid-request can make them
+drift; this command recounts from the comments table and fixes them.
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from casestudy.caching import bump_generation
+from casestudy.models import Casestudy, Comment
+
+
+class Command(BaseCommand):
+    """
+    Recount comments per case study and fix drifted counters.
+
+    Usage: python manage.py reconcile_comment_counts [--dry-run]
+    """
+    help = 'Recount approved/pending comments and fix drifted counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report drift without writing any changes',
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        actual = {}
+        rows = Comment.objects.order_by().values(
+            'casestudy', 'approved'
+        ).annotate(n=Count('id'))
+        for row in rows:
+            counts = actual.setdefault(row['casestudy'], [0, 0])
+            counts[0 if row['approved'] else 1] += row['n']
+
+        drifted = []
+        stored = Casestudy.objects.only(
+            'id', 'title', 'approved_comment_count', 'pending_comment_count'
+        )
+        for casestudy in stored.iterator(chunk_size=2000):
+            approved, pending = actual.get(casestudy.id, (0, 0))
+            if (casestudy.approved_comment_count != approved
+                    or casestudy.pending_comment_count != pending):
+                self.stdout.write(
+                    f'{casestudy.title}: approved '
+                    f'{casestudy.approved_comment_count} -> {approved}, '
+                    f'pending {casestudy.pending_comment_count} -> {pending}'
+                )
+                casestudy.approved_comment_count = approved
+                casestudy.pending_comment_count = pending
+                drifted.append(casestudy)
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('All comment counts are accurate.'))
+            return
+        if options['dry_run']:
+            self.stdout.write(
+                self.style.WARNING(f'{len(drifted)} case studies have drifted (dry run).')
+            )
+            return
+        with transaction.atomic():
+            Casestudy.objects.bulk_update(
+                drifted, ['approved_comment_count', 'pending_comment_count'],
+                batch_size=500,
+            )
+        bump_generation()
+        self.stdout.write(
+            self.style.SUCCESS(f'Fixed comment counts on {len(drifted)} case studies.')
+        )
@@ -0,0 +1,200 @@
+"""
+Management command to fill the database with synthetic, reproducible data.
+
+Generates users, lookups, case studies and comments at benchmark volumes
+from a fixed random seed, so two runs with the same options produce the
+same data. Rows are written with ``bulk_create`` in batches; like
+``load_case_study_data`` this skips model signals, so the search index
+is refreshed per batch and the comment counters are recounted at the end.
+
+Synthetic rows are recognisable by their ``synthetic-`` usernames and
+slugs. The command refuses to run on a database that already has them;
+start from a fresh database (``manage.py flush``) instead.
+"""
+
+import io
+import random
+import time
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from casestudy.caching import bump_generation
+from casestudy.models import Casestudy, Client, Comment, Industry, Location
+from casestudy.search import index_casestudies
+
+PREFIX = 'synthetic-'
+# Every synthetic user can log in with this password (benchmarks do)
+PASSWORD = 'synthetic-password'
+
+WORDS = (
+    'plant capacity upgrade pipeline reactor furnace turbine compressor '
+    'commissioning retrofit safety throughput emissions modular skid '
+    'control system instrumentation piping steel structure foundation '
+    'vessel heat exchanger boiler cooling tower substation cable tray '
+    'schedule budget scope design procurement construction handover '
+    'efficiency reliability maintenance shutdown startup testing permit '
+    'environmental water recovery energy storage grid solar wind carbon '
+    'capture hydrogen ammonia refinery terminal storage tank loading'
+).split()
+INDUSTRIES = (
+    'Oil & Gas', 'Chemicals', 'Mining', 'Metals', 'Power', 'Renewables',
+    'Water', 'Waste', 'Pharmaceuticals', 'Food & Beverage',
+)
+
+
+def sentence(rng, low=6, high=16):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return ' '.join(words).capitalize() + '.'
+
+
+def paragraph(rng, sentences=4):
+    return ' '.join(sentence(rng) for _ in range(sentences))
+
+
+class Command(BaseCommand):
+    """
+    Generate synthetic users, case studies and comments.
+
+    Usage: python manage.py seed_synthetic [--casestudies 10000]
+           [--comments 1000000] [--users 50000] [--seed 42]
+    """
+    help = 'Generate reproducible synthetic data at benchmark volumes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--casestudies', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=50000)
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--locations', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--approved', type=float, default=0.8,
+            help='Fraction of comments that are approved',
+        )
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        if (User.objects.filter(username__startswith=PREFIX).exists()
+                or Casestudy.objects.filter(slug__startswith=PREFIX).exists()):
+            raise CommandError(
+                'Synthetic data already exists; run it on a fresh database.'
+            )
+        if options['users'] < 1 and options['comments']:
+            raise CommandError('Comments need at least one user.')
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = time.monotonic()
+
+        with transaction.atomic():
+            user_ids = self.create_users(options['users'])
+            lookups = self.create_lookups(options)
+            casestudy_ids = self.create_casestudies(options['casestudies'], lookups)
+        # Comments commit per batch: a million rows in one transaction
+        # would hold the write lock for the whole run
+        self.create_comments(
+            options['comments'], casestudy_ids, user_ids, options['approved']
+        )
+        call_command('reconcile_comment_counts', stdout=io.StringIO())
+        bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(user_ids)} users, {len(casestudy_ids)} case studies '
+            f'and {options["comments"]} comments in '
+            f'{time.monotonic() - started:.1f}s (seed {options["seed"]}).'
+        ))
+
+    def batches(self, total):
+        for start in range(0, total, self.batch_size):
+            yield range(start, min(start + self.batch_size, total))
+
+    def create_users(self, count):
+        # Hashing is deliberately slow: hash once, share the hash
+        password = make_password(PASSWORD)
+        for batch in self.batches(count):
+            User.objects.bulk_create([
+                User(
+                    username=f'{PREFIX}user-{n:06d}',
+                    email=f'{PREFIX}user-{n:06d}@example.com',
+                    password=password,
+                )
+                for n in batch
+            ])
+        self.stdout.write(f'{count} users')
+        return list(
+            User.objects.filter(username__startswith=PREFIX)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    def create_lookups(self, options):
+        rows = {
+            Client: ('client', [f'Synthetic Client {n:04d}' for n in range(options['clients'])]),
+            Location: ('location', [f'Synthetic Location {n:04d}' for n in range(options['locations'])]),
+            Industry: ('industry', [f'Synthetic {name}' for name in INDUSTRIES]),
+        }
+        lookups = {}
+        for model, (field, names) in rows.items():
+            model.objects.bulk_create(
+                [model(**{field: name}) for name in names], ignore_conflicts=True
+            )
+            lookups[model] = list(
+                model.objects.filter(**{f'{field}__in': names})
+                .order_by('pk').values_list('pk', flat=True)
+            )
+        return lookups
+
+    def create_casestudies(self, count, lookups):
+        rng = self.rng
+        for batch in self.batches(count):
+            created = Casestudy.objects.bulk_create([
+                Casestudy(
+                    title=f'Synthetic {sentence(rng, 2, 5)[:-1]} {n:06d}',
+                    slug=f'{PREFIX}{n:06d}',
+                    client_id=rng.choice(lookups[Client]),
+                    location_id=rng.choice(lookups[Location]),
+                    industry_id=rng.choice(lookups[Industry]),
+                    excerpt=sentence(rng, 15, 30),
+                    description=''.join(
+                        f'<p>{paragraph(rng)}</p>' for _ in range(rng.randint(3, 8))
+                    ),
+                )
+                for n in batch
+            ])
+            # PKs are not returned by every backend; reload what is needed
+            if created and created[0].pk is None:
+                created = list(Casestudy.objects.filter(
+                    slug__in=[c.slug for c in created]
+                ))
+            index_casestudies(created)
+        self.stdout.write(f'{count} case studies')
+        return list(
+            Casestudy.objects.filter(slug__startswith=PREFIX)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+
+    def create_comments(self, count, casestudy_ids, user_ids, approved):
+        rng = self.rng
+        if not casestudy_ids:
+            return
+        # A few case studies attract most of the discussion
+        cum_weights = list(accumulate(1 / (rank + 1) for rank in range(len(casestudy_ids))))
+        started = time.monotonic()
+        for batch in self.batches(count):
+            targets = rng.choices(casestudy_ids, cum_weights=cum_weights, k=len(batch))
+            with transaction.atomic():
+                Comment.objects.bulk_create([
+                    Comment(
+                        casestudy_id=casestudy_id,
+                        author_id=rng.choice(user_ids),
+                        content=sentence(rng, 5, 40),
+                        approved=rng.random() < approved,
+                    )
+                    for casestudy_id in targets
+                ])
+            done = batch.stop
+            rate = done / max(time.monotonic() - started, 1e-9)
+            self.stdout.write(f'{done}/{count} comments ({rate:.0f}/s)')
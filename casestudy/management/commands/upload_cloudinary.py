@@ -1,97 +1,149 @@
-from django.core.management.base import BaseCommand
-import cloudinary
-import cloudinary.uploader
+"""
+Management command to upload case study images and link them to case studies.
+
+Uses the content-addressed pipeline in ``casestudy/image_upload.py``:
+identical files are uploaded once, finished uploads are recorded in a
+manifest so re-runs only upload new or changed images, and uploads run
+concurrently with retries. ``--uploader local`` copies into a directory
+instead of calling Cloudinary, for development and tests.
+
+Every case study is then matched to an uploaded file (see
+``match_image``) and saved normally, so the caches are invalidated and
+its placeholder is recomputed.
+"""
+
 import os
+
+import cloudinary
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.text import slugify
+
+from casestudy.image_upload import (
+    CloudinaryUploader, LocalUploader, Manifest, canonical_name, run_pipeline,
+)
 from casestudy.models import Casestudy
+from casestudy.placeholders import image_key, wait_for_refreshes
+
+SKIP_FILES = {'default.png'}
+
+
+def match_image(casestudy, public_ids):
+    """
+    Return the public id of ``casestudy``'s uploaded image, or None.
+
+    ``public_ids`` maps slugified file stems to public ids. Tried in turn:
+    the file its current image was uploaded from, its slug, its title,
+    then the longest multi-word stem its slug starts with (a shortened
+    name such as ``floating-roof`` for ``floating-roof-storage-system``).
+    """
+    current = image_key(casestudy.casestudyimage).rsplit('/', 1)[-1]
+    for candidate in (current, casestudy.slug, casestudy.title):
+        public_id = public_ids.get(slugify(candidate)) if candidate else None
+        if public_id:
+            return public_id
+    prefixes = [
+        stem for stem in public_ids
+        if '-' in stem and casestudy.slug.startswith(stem + '-')
+    ]
+    return public_ids[max(prefixes, key=len)] if prefixes else None
+
 
 class Command(BaseCommand):
+    """
+    Upload new images concurrently and point case studies at them.
+
+    Usage: python manage.py upload_cloudinary [--source static/images]
+           [--workers 4] [--uploader cloudinary|local] [--manifest FILE]
+    """
     help = 'Upload images to Cloudinary and update case studies'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source', default=os.path.join(settings.BASE_DIR, 'static', 'images'),
+        )
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--attempts', type=int, default=4,
+            help='Tries per file before giving up (exponential backoff)',
+        )
+        parser.add_argument(
+            '--uploader', choices=('cloudinary', 'local'), default='cloudinary',
+        )
+        parser.add_argument(
+            '--local-dir', default=os.path.join(settings.BASE_DIR, 'media', 'uploads'),
+            help='Target directory for --uploader local',
+        )
+        parser.add_argument(
+            '--manifest',
+            help='Upload manifest (default: .<uploader>-manifest.json in --source)',
+        )
+        parser.add_argument(
+            '--no-update', action='store_true',
+            help='Upload only; do not change any case study',
+        )
+
     def handle(self, *args, **options):
-        self.stdout.write("=== Uploading Images to Cloudinary ===")
-        
-        # Get credentials from environment variables
-        import os
-        cloud_name = os.environ.get('CLOUDINARY_CLOUD_NAME')
-        api_key = os.environ.get('CLOUDINARY_API_KEY')
-        api_secret = os.environ.get('CLOUDINARY_API_SECRET')
-        
-        self.stdout.write(f"Cloud Name: {cloud_name}")
-        self.stdout.write(f"API Key: {api_key}")
-        
-        if not all([cloud_name, api_key, api_secret]):
-            self.stdout.write(self.style.ERROR("❌ Missing Cloudinary credentials in environment variables!"))
-            self.stdout.write("Please check your env.py file or environment variables.")
-            return
-        
-        # Configure Cloudinary
-        cloudinary.config(
-            cloud_name=cloud_name,
-            api_key=api_key,
-            api_secret=api_secret,
-            secure=True
+        """Execute the command."""
+        source = options['source']
+        if not os.path.isdir(source):
+            raise CommandError(f'Directory {source} not found!')
+        uploader = self.get_uploader(options)
+        manifest = Manifest(options['manifest'] or os.path.join(
+            source, f'.{uploader.name}-manifest.json'
+        ))
+
+        self.stdout.write(f'=== Uploading images from {source} ({uploader.name}) ===')
+        uploaded, skipped, failed = run_pipeline(
+            source, uploader, manifest,
+            workers=options['workers'], attempts=options['attempts'],
+            skip=SKIP_FILES, log=self.stdout.write,
+        )
+        self.stdout.write(
+            f'{uploaded} uploaded, {skipped} already in the manifest, '
+            f'{len(failed)} failed.'
         )
-        
-        static_images_path = 'static/images'
-        
-        if not os.path.exists(static_images_path):
-            self.stdout.write(self.style.ERROR(f"Directory {static_images_path} not found!"))
-            return
-        
-        # Get all image files
-        image_files = [f for f in os.listdir(static_images_path) 
-                       if f.lower().endswith(('.png', '.jpg', '.jpeg'))]
-        
-        self.stdout.write(f"Found {len(image_files)} images to upload")
-        
-        uploaded_images = {}
-        
-        for image_file in image_files:
-            if image_file == 'default.png':
-                continue  # Skip default image
-                
-            try:
-                image_path = os.path.join(static_images_path, image_file)
-                self.stdout.write(f"Uploading {image_file}...")
-                
-                # Upload to Cloudinary
-                result = cloudinary.uploader.upload(
-                    image_path,
-                    public_id=f"case_studies/{image_file.split('.')[0]}",
-                    folder="case_studies"
-                )
-                
-                uploaded_images[image_file] = result['secure_url']
-                self.stdout.write(self.style.SUCCESS(f"✅ Uploaded: {result['secure_url']}"))
-                
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f"❌ Failed to upload {image_file}: {str(e)}"))
-        
-        # Update case studies with Cloudinary URLs
-        image_mapping = {
-            'Electric Arc Furnace (EAF) Expansion Project': 'electric-arc-furnace-eaf-expansion-project.png',
-            'Emergency Drainage & Venting System': 'Emergency-Drainage-Venting-System.png',
-            'Fire & Gas Detection Network': 'Fire-Gas-Detection.png',
-            'Floating Roof Storage System': 'floating-roof.png',
-            'Hazardous Waste Neutralization Unit': 'hazardous-waste-neutralization-unit.png',
-            'Iron Ore Pelletizing Plant': 'iron-ore-pelletizing.png',
-            'Modular Carbon Capture Utilization (CCU) Unit': 'modular-carbon-capture-utilization-ccu-unit.png',
-            'Renewable Energy Microgrid': 'renewable-energy-microgrid.png',
-            'Skid-Mounted Process Plant': 'skid-mounted-process-plant.png',
-            'Solid Waste Processing Plant': 'solid-waste-processing-plant.png',
-            'Tailings Reprocessing Facility': 'Tailings-Reprocessing.png',
-        }
-        
-        for title, image_file in image_mapping.items():
-            if image_file in uploaded_images:
-                try:
-                    case_study = Casestudy.objects.get(title=title)
-                    case_study.casestudyimage = uploaded_images[image_file]
-                    case_study.save()
-                    self.stdout.write(self.style.SUCCESS(f"✅ Updated {title} with Cloudinary URL"))
-                except Casestudy.DoesNotExist:
-                    self.stdout.write(self.style.WARNING(f"⚠️ Case study '{title}' not found"))
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f"❌ Error updating {title}: {str(e)}"))
-        
-        self.stdout.write(self.style.SUCCESS(f"\n✅ Successfully uploaded {len(uploaded_images)} images to Cloudinary!"))
+        if not options['no_update']:
+            self.update_casestudies(manifest)
+        if failed:
+            raise CommandError(
+                f'{len(failed)} image(s) failed to upload; run again to retry: '
+                + ', '.join(sorted(failed))
+            )
+        self.stdout.write(self.style.SUCCESS('✅ Images are up to date.'))
+
+    def get_uploader(self, options):
+        if options['uploader'] == 'local':
+            return LocalUploader(options['local_dir'])
+        config = cloudinary.config()
+        if not (config.cloud_name and config.api_key and config.api_secret):
+            raise CommandError('❌ Missing Cloudinary credentials in environment variables!')
+        return CloudinaryUploader()
+
+    def update_casestudies(self, manifest):
+        """Point each case study at the uploaded copy of its image."""
+        public_ids = {}
+        for entry in manifest.entries.values():
+            for name in entry['files']:
+                stem = os.path.splitext(canonical_name(name))[0]
+                public_ids.setdefault(slugify(stem), entry['public_id'])
+
+        changed = 0
+        for casestudy in Casestudy.objects.order_by('pk'):
+            public_id = match_image(casestudy, public_ids)
+            if public_id is None:
+                self.stdout.write(self.style.WARNING(f"⚠️ No image found for '{casestudy.title}'"))
+                continue
+            if image_key(casestudy.casestudyimage) == public_id:
+                continue
+            # A normal save: invalidates the caches and schedules the
+            # placeholder refresh (casestudy/signals.py)
+            casestudy.casestudyimage = public_id
+            casestudy.save(update_fields=['casestudyimage', 'updated_on'])
+            changed += 1
+            self.stdout.write(self.style.SUCCESS(f'✅ Updated {casestudy.title} -> {public_id}'))
+        if changed and not wait_for_refreshes(timeout=120):
+            self.stdout.write(self.style.WARNING(
+                'Some placeholders are still being computed; '
+                'run generate_placeholders to finish them.'
+            ))
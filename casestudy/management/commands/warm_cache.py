@@ -0,0 +1,108 @@
+"""
+Management command to pre-render the public pages into the cache.
+
+After a deploy, or whenever the cache file is new, the first visitor of
+every page pays for rendering it and for filling the fragment caches
+behind it. This command requests every list page (following the cursor
+links from the home page) and every case study detail page as an
+anonymous visitor, through the full middleware stack, so each lands in
+the anonymous page cache (``casestudy/page_cache.py``) under the same
+key a browser's request will use. It then writes the ``WARMUP_MARKER``
+file that ``/readyz`` waits for.
+
+``gunicorn.conf.py`` runs it in the background when the server starts;
+it can also be run by hand at any time, pages already cached are left
+as they are.
+"""
+
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client as TestClient, override_settings
+from django.urls import reverse
+
+from casestudy.models import Casestudy
+from casestudy.pagination import CursorPaginator
+from casestudy.views import CasestudyList
+from coreflowepc.warmup import mark_warm
+
+
+class Command(BaseCommand):
+    """
+    Render list and detail pages into the anonymous page cache.
+
+    Usage: python manage.py warm_cache [--list-pages N] [--details N]
+    """
+    help = 'Pre-render the list pages and case study details into the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--list-pages', type=int, default=None,
+            help='Warm at most this many list pages (default: all)',
+        )
+        parser.add_argument(
+            '--details', type=int, default=None,
+            help='Warm at most this many case study pages (default: all)',
+        )
+
+    def list_paths(self, limit):
+        """The home page and the pages its NEXT links lead to."""
+        paginator = CursorPaginator(
+            CasestudyList.queryset, CasestudyList.paginate_by,
+            ordering=CasestudyList.cursor_ordering,
+        )
+        home = reverse('home')
+        cursor = None
+        pages = 0
+        while limit is None or pages < limit:
+            # Same URL as the template's href="?cursor=..." links
+            yield f'{home}?{CasestudyList.cursor_kwarg}={cursor}' if cursor else home
+            pages += 1
+            cursor = paginator.page(cursor).next_cursor
+            if cursor is None:
+                break
+
+    def detail_paths(self, limit):
+        slugs = Casestudy.objects.order_by('pk').values_list('slug', flat=True)
+        if limit is not None:
+            slugs = slugs[:limit]
+        for slug in slugs.iterator():
+            yield reverse('casestudy_detail', args=[slug])
+
+    def handle(self, *args, **options):
+        """Execute the command."""
+        started = time.monotonic()
+        client = TestClient(raise_request_exception=False)
+        states = Counter()
+        failed = []
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for paths in (self.list_paths(options['list_pages']),
+                          self.detail_paths(options['details'])):
+                for path in paths:
+                    # A first-time visitor: no cookies from earlier pages
+                    client.cookies.clear()
+                    response = client.get(path)
+                    if response.status_code != 200:
+                        failed.append(f'{path} ({response.status_code})')
+                        continue
+                    # MISS: rendered now, HIT/STALE: already cached
+                    states[response.get('X-Page-Cache', 'uncached')] += 1
+
+        mark_warm()
+        message = (
+            f'Warmed {sum(states.values())} pages in '
+            f'{time.monotonic() - started:.1f}s '
+            f'({states["MISS"]} rendered, '
+            f'{states["HIT"] + states["STALE"]} already cached).'
+        )
+        if states['uncached']:
+            self.stdout.write(self.style.WARNING(
+                f'{states["uncached"]} pages were not cacheable.'
+            ))
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'{len(failed)} pages failed: ' + ', '.join(failed[:10])
+            ))
+        self.stdout.write(self.style.SUCCESS(message))
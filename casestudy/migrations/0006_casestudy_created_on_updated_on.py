@@ -0,0 +1,25 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casestudy', '0005_alter_casestudy_casestudyimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='casestudy',
+            name='created_on',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='casestudy',
+            name='updated_on',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.23 on 2026-10-18 09:30
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_comment_counts(apps, schema_editor):
+    Casestudy = apps.get_model('casestudy', 'Casestudy')
+    Comment = apps.get_model('casestudy', 'Comment')
+    counts = {}
+    rows = Comment.objects.order_by().values(
+        'casestudy', 'approved'
+    ).annotate(n=Count('id'))
+    for row in rows:
+        approved, pending = counts.get(row['casestudy'], (0, 0))
+        if row['approved']:
+            approved += row['n']
+        else:
+            pending += row['n']
+        counts[row['casestudy']] = (approved, pending)
+    for casestudy_id, (approved, pending) in counts.items():
+        Casestudy.objects.filter(pk=casestudy_id).update(
+            approved_comment_count=approved,
+            pending_comment_count=pending,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casestudy', '0006_casestudy_created_on_updated_on'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='casestudy',
+            name='approved_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='casestudy',
+            name='pending_comment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(
+            backfill_comment_counts, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:00
+
+import html
+
+from django.db import migrations
+from django.db.utils import OperationalError
+from django.utils.html import strip_tags
+
+# Frozen copies of casestudy.search as of this migration; later changes
+# to that module must not change what this migration does.
+SQLITE_TABLE = 'casestudy_search'
+POSTGRES_TABLE = 'casestudy_searchindex'
+POSTGRES_DOCUMENT_SQL = (
+    "setweight(to_tsvector('english', %s), 'A') || "
+    "setweight(to_tsvector('english', %s), 'B') || "
+    "setweight(to_tsvector('english', %s), 'C')"
+)
+
+
+def document_fields(casestudy):
+    """Return the (title, excerpt, description) text to index."""
+    description = html.unescape(strip_tags(casestudy.description or ''))
+    return (
+        casestudy.title or '',
+        casestudy.excerpt or '',
+        ' '.join(description.split()),
+    )
+
+
+def create_search_index(apps, schema_editor):
+    """Create the vendor-specific full-text index and fill it."""
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {SQLITE_TABLE} USING '
+                "fts5(title, excerpt, description, tokenize='porter unicode61')"
+            )
+        except OperationalError:
+            # SQLite built without FTS5: search falls back to icontains
+            return
+        insert = (
+            f'INSERT INTO {SQLITE_TABLE} (rowid, title, excerpt, description)'
+            ' VALUES (%s, %s, %s, %s)'
+        )
+    elif connection.vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE TABLE IF NOT EXISTS {POSTGRES_TABLE} ('
+            ' casestudy_id bigint PRIMARY KEY REFERENCES casestudy_casestudy (id)'
+            ' ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,'
+            ' document tsvector NOT NULL)'
+        )
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {POSTGRES_TABLE}_document '
+            f'ON {POSTGRES_TABLE} USING gin (document)'
+        )
+        insert = (
+            f'INSERT INTO {POSTGRES_TABLE} (casestudy_id, document) '
+            f'VALUES (%s, {POSTGRES_DOCUMENT_SQL})'
+        )
+    else:
+        return
+
+    Casestudy = apps.get_model('casestudy', 'Casestudy')
+    rows = [
+        (casestudy.pk, *document_fields(casestudy))
+        for casestudy in Casestudy.objects.only(
+            'id', 'title', 'excerpt', 'description'
+        ).iterator()
+    ]
+    if rows:
+        with connection.cursor() as cursor:
+            cursor.executemany(insert, rows)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_TABLE}')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {POSTGRES_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casestudy', '0007_casestudy_comment_counts'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
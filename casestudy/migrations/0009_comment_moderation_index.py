@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casestudy', '0008_casestudy_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['approved', 'created_on'], name='comment_approved_created_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casestudy', '0009_comment_moderation_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['casestudy', 'approved', 'created_on'], name='comment_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.23 on 2026-10-18 08:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casestudy', '0010_comment_thread_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='casestudy',
+            name='image_color',
+            field=models.CharField(blank=True, editable=False, max_length=7),
+        ),
+        migrations.AddField(
+            model_name='casestudy',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='casestudy',
+            name='image_placeholder_for',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
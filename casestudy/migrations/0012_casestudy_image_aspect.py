@@ -0,0 +1,18 @@
+# Generated by Django 4.2.23 on 2026-10-18 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('casestudy', '0011_casestudy_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='casestudy',
+            name='image_aspect',
+            field=models.CharField(blank=True, editable=False, max_length=15),
+        ),
+    ]
@@ -1,8 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
 from cloudinary.models import CloudinaryField
 import os
 
+from .caching import bump_generation
+
 
 class Client(models.Model):
     client = models.CharField(max_length=100, unique=True)
@@ -41,6 +45,25 @@ class Casestudy(models.Model):
     )
     # Cloudinary image field
     casestudyimage = CloudinaryField('image', default='placeholder')
+    created_on = models.DateTimeField(auto_now_add=True)
+    updated_on = models.DateTimeField(auto_now=True)
+    # Denormalized comment counters, kept in step by casestudy/signals.py
+    # and CommentQuerySet.set_approved(); see reconcile_comment_counts
+    approved_comment_count = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    pending_comment_count = models.PositiveIntegerField(
+        default=0, editable=False
+    )
+    # Inline low-quality placeholder and dominant colour of casestudyimage,
+    # kept current by casestudy/signals.py; see casestudy/placeholders.py
+    image_placeholder = models.TextField(blank=True, editable=False)
+    image_color = models.CharField(max_length=7, blank=True, editable=False)
+    image_placeholder_for = models.CharField(
+        max_length=255, blank=True, editable=False
+    )
+    # "width:height" of the image, so templates can reserve its box
+    image_aspect = models.CharField(max_length=15, blank=True, editable=False)
 
     class Meta:
         ordering = ['title']  # Order by title alphabetically
@@ -50,6 +73,64 @@ class Casestudy(models.Model):
         return self.title
 
 
+def adjust_comment_counts(casestudy_id, approved=0, pending=0):
+    """Apply deltas to a case study's denormalized comment counters."""
+    changes = {}
+    if approved:
+        changes['approved_comment_count'] = Greatest(
+            F('approved_comment_count') + approved, 0
+        )
+    if pending:
+        changes['pending_comment_count'] = Greatest(
+            F('pending_comment_count') + pending, 0
+        )
+    if changes:
+        Casestudy.objects.filter(pk=casestudy_id).update(**changes)
+
+
+class CommentQuerySet(models.QuerySet):
+
+    def set_approved(self, approved, batch_size=1000):
+        """
+        Bulk approve or disapprove comments, keeping counters accurate.
+
+        Only comments whose state actually changes are updated. They are
+        processed in primary-key batches of ``batch_size``, each in its own
+        short transaction, so a selection of hundreds of thousands of
+        comments neither holds a long write lock nor builds one huge
+        statement. Returns the number of comments changed.
+        """
+        changing = self.exclude(approved=approved).order_by('pk')
+        sign = 1 if approved else -1
+        updated = 0
+        last_pk = None
+        while True:
+            batch = changing if last_pk is None else changing.filter(
+                pk__gt=last_pk
+            )
+            pks = list(batch.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            last_pk = pks[-1]
+            with transaction.atomic():
+                rows = self.model.objects.filter(pk__in=pks).exclude(
+                    approved=approved
+                )
+                deltas = list(
+                    rows.order_by().values('casestudy').annotate(n=Count('id'))
+                )
+                updated += rows.update(approved=approved)
+                for row in deltas:
+                    adjust_comment_counts(
+                        row['casestudy'], approved=sign * row['n'],
+                        pending=-sign * row['n']
+                    )
+        if updated:
+            # Public comment lists and counts changed
+            bump_generation()
+        return updated
+
+
 class Comment(models.Model):
     casestudy = models.ForeignKey(
         Casestudy, on_delete=models.CASCADE, related_name="comments"
@@ -61,8 +142,32 @@ class Comment(models.Model):
     approved = models.BooleanField(default=False)
     created_on = models.DateTimeField(auto_now_add=True)
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
         ordering = ["created_on"]
+        indexes = [
+            # Serves the moderation queue: approved=False ORDER BY created_on
+            models.Index(
+                fields=['approved', 'created_on'],
+                name='comment_approved_created_idx',
+            ),
+            # Serves a case study's public thread, newest first
+            models.Index(
+                fields=['casestudy', 'approved', 'created_on'],
+                name='comment_thread_idx',
+            ),
+        ]
 
     def __str__(self):
         return f"Comment {self.content} by {self.author}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored state so saves can adjust the counters
+        instance._counted_state = (
+            instance.__dict__.get('casestudy_id'),
+            instance.__dict__.get('approved'),
+        )
+        return instance
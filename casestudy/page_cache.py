@@ -0,0 +1,328 @@
+"""
+Full-page cache for anonymous visitors.
+
+Crawlers and anonymous visitors all see the same HTML, so there is no
+reason to hit the database and render templates for every one of them.
+``anonymous_page_cache`` stores the rendered page under a versioned key
+(see ``casestudy/caching.py``) and serves it with a strong ``ETag`` and a
+``Last-Modified`` header:
+
+- a matching ``If-None-Match``/``If-Modified-Since`` gets a 304 straight
+  from the cache entry, without touching the ORM;
+- an entry older than ``ANONYMOUS_PAGE_CACHE_FRESH`` seconds is still
+  served, but re-rendered in a background thread (stale-while-revalidate)
+  for up to ``ANONYMOUS_PAGE_CACHE_STALE`` seconds;
+- content edits bump the cache generation, so they show up immediately;
+- ``Last-Modified`` is the later of the view's own value and the time the
+  cached bytes were first rendered, so it moves whenever the page does
+  (an edited comment, say, even though no row date changed);
+- concurrent cold misses on a page render it once: the first request
+  takes a short render lock, the others wait for its entry. The view
+  runs outside any cache lock, so it can use ``get_or_set`` itself.
+
+Requests carrying a session or messages cookie consult the session before
+using the cache, and responses that set cookies are never stored, so
+per-user content (messages, CSRF tokens) cannot leak into the cache.
+
+Async views get an async wrapper that shares the same entries: cache
+access goes through the cache's async API, stale pages are re-rendered
+in a background task, and cold misses take the same render lock, the
+waiting requests polling with ``asyncio.sleep`` so the event loop keeps
+serving others.
+"""
+
+import asyncio
+import contextvars
+import copy
+import hashlib
+import logging
+import threading
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpResponse
+from django.utils.cache import (
+    get_conditional_response, patch_cache_control, patch_vary_headers,
+)
+from django.utils.http import http_date, parse_http_date_safe
+
+from .caching import amake_key, make_key
+
+logger = logging.getLogger(__name__)
+
+
+# How long a cold miss may hold the render lock, and how long the other
+# requests for the page wait for its entry before rendering it themselves
+RENDER_LOCK_TIMEOUT = 30
+RENDER_WAIT = 5
+
+
+def _settings():
+    fresh = getattr(settings, 'ANONYMOUS_PAGE_CACHE_FRESH', 60)
+    stale = getattr(settings, 'ANONYMOUS_PAGE_CACHE_STALE', 60 * 60 * 24)
+    return fresh, stale
+
+
+def _is_cacheable_request(request):
+    """Return True for anonymous GET/HEAD requests with no pending messages."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    cookies = request.COOKIES
+    if (settings.SESSION_COOKIE_NAME not in cookies
+            and 'messages' not in cookies):
+        # No session at all: anonymous, and nothing to look up
+        return True
+    return not request.user.is_authenticated and not len(
+        get_messages(request)
+    )
+
+
+def _page_digest(request):
+    return hashlib.md5(request.get_full_path().encode()).hexdigest()
+
+
+def _page_key(request):
+    return make_key('page', _page_digest(request))
+
+
+def _make_entry(response, fresh, previous=None):
+    """
+    Turn a rendered response into a cache entry, or None if unsafe.
+
+    ``previous`` is the entry being replaced, if any: unchanged content
+    keeps its ``last_modified``, anything else is new as of now.
+    """
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return None
+    if 'private' in response.get('Cache-Control', ''):
+        return None
+    content = response.content
+    etag = '"%s"' % hashlib.sha1(content).hexdigest()
+    if previous is not None and previous['etag'] == etag:
+        rendered_at = previous['last_modified']
+    else:
+        rendered_at = int(time.time())
+    return {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'etag': etag,
+        'last_modified': max(
+            parse_http_date_safe(response.get('Last-Modified', '')) or 0,
+            rendered_at or 0,
+        ) or None,
+        'fresh_until': time.time() + fresh,
+    }
+
+
+def _response_from_entry(request, entry, state):
+    response = HttpResponse(entry['content'],
+                            content_type=entry['content_type'])
+    _add_validators(response, entry)
+    response['X-Page-Cache'] = state
+    return get_conditional_response(
+        request,
+        etag=entry['etag'],
+        last_modified=entry['last_modified'],
+        response=response,
+    )
+
+
+def _add_validators(response, entry):
+    response['ETag'] = entry['etag']
+    if entry['last_modified']:
+        response['Last-Modified'] = http_date(entry['last_modified'])
+    patch_cache_control(response, max_age=0, must_revalidate=True)
+    patch_vary_headers(response, ('Cookie',))
+
+
+def _wait_for_entry(key):
+    """Poll for the entry another request is rendering, or None."""
+    deadline = time.monotonic() + RENDER_WAIT
+    delay = 0.01
+    while time.monotonic() < deadline:
+        time.sleep(delay)
+        delay = min(delay * 2, 0.2)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+        if not cache.has_key(key + ':rendering'):
+            return cache.get(key)
+    return None
+
+
+async def _await_entry(key):
+    """Async version of :func:`_wait_for_entry`."""
+    deadline = time.monotonic() + RENDER_WAIT
+    delay = 0.01
+    while time.monotonic() < deadline:
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 0.2)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return entry
+        if not await cache.ahas_key(key + ':rendering'):
+            return await cache.aget(key)
+    return None
+
+
+def _render(view_func, request, args, kwargs):
+    response = view_func(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        response = response.render()
+    return response
+
+
+def _revalidate(view_func, request, args, kwargs, key, lock_key, previous):
+    """Re-render a stale page in the background and store the result."""
+    fresh, stale = _settings()
+    try:
+        response = _render(view_func, request, args, kwargs)
+        entry = _make_entry(response, fresh, previous)
+        if entry is not None:
+            cache.set(key, entry, fresh + stale)
+    except Exception:
+        logger.exception('Background revalidation of %s failed',
+                         request.get_full_path())
+    finally:
+        cache.delete(lock_key)
+        connections.close_all()
+
+
+def anonymous_page_cache(view_func):
+    """Serve anonymous GET requests for ``view_func`` from the page cache."""
+    if iscoroutinefunction(view_func):
+        return _async_page_cache(view_func)
+
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if not _is_cacheable_request(request):
+            return view_func(request, *args, **kwargs)
+
+        fresh, stale = _settings()
+        key = _page_key(request)
+        entry = cache.get(key)
+        if entry is not None:
+            state = 'HIT'
+            if entry['fresh_until'] <= time.time():
+                state = 'STALE'
+                lock_key = key + ':revalidating'
+                if cache.add(lock_key, 1, 30):
+                    threading.Thread(
+                        target=_revalidate,
+                        args=(view_func, copy.copy(request), args, kwargs,
+                              key, lock_key, entry),
+                        daemon=True,
+                    ).start()
+            return _response_from_entry(request, entry, state)
+
+        # Cold miss: concurrent requests for the same page render it once
+        lock_key = key + ':rendering'
+        leader = cache.add(lock_key, 1, RENDER_LOCK_TIMEOUT)
+        if not leader:
+            entry = _wait_for_entry(key)
+            if entry is not None:
+                return _response_from_entry(request, entry, 'HIT')
+            # The first render failed, was not cacheable or is too slow
+        try:
+            response = _render(view_func, request, args, kwargs)
+            entry = _make_entry(response, fresh)
+            if entry is not None:
+                cache.set(key, entry, fresh + stale)
+        finally:
+            if leader:
+                cache.delete(lock_key)
+        if entry is not None:
+            _add_validators(response, entry)
+            response['X-Page-Cache'] = 'MISS'
+        return response
+
+    return _wrapped_view
+
+
+# Background revalidation tasks, referenced until done so they are not
+# garbage collected mid-flight
+_tasks = set()
+
+
+async def _arender(view_func, request, args, kwargs):
+    response = await view_func(request, *args, **kwargs)
+    if hasattr(response, 'render') and callable(response.render):
+        # Templates may still touch the ORM (lazy relations, the user)
+        response = await sync_to_async(response.render)()
+    return response
+
+
+async def _arevalidate(view_func, request, args, kwargs, key, lock_key, previous):
+    """Async version of :func:`_revalidate`, run as a background task."""
+    fresh, stale = _settings()
+    try:
+        response = await _arender(view_func, request, args, kwargs)
+        entry = _make_entry(response, fresh, previous)
+        if entry is not None:
+            await cache.aset(key, entry, fresh + stale)
+    except Exception:
+        logger.exception('Background revalidation of %s failed',
+                         request.get_full_path())
+    finally:
+        await cache.adelete(lock_key)
+        await sync_to_async(connections.close_all)()
+
+
+def _async_page_cache(view_func):
+    """:func:`anonymous_page_cache` for ``async def`` views."""
+
+    @wraps(view_func)
+    async def _wrapped_view(request, *args, **kwargs):
+        cookies = request.COOKIES
+        cacheable = request.method in ('GET', 'HEAD') and (
+            (settings.SESSION_COOKIE_NAME not in cookies and 'messages' not in cookies)
+            # Resolving the user may load the session and query the database
+            or await sync_to_async(_is_cacheable_request)(request)
+        )
+        if not cacheable:
+            return await view_func(request, *args, **kwargs)
+
+        fresh, stale = _settings()
+        key = await amake_key('page', _page_digest(request))
+        entry = await cache.aget(key)
+        if entry is not None:
+            state = 'HIT'
+            if entry['fresh_until'] <= time.time():
+                state = 'STALE'
+                lock_key = key + ':revalidating'
+                if await cache.aadd(lock_key, 1, 30):
+                    # A fresh context: the request's own sync thread and
+                    # database connections go away when it finishes
+                    task = asyncio.create_task(_arevalidate(
+                        view_func, copy.copy(request), args, kwargs,
+                        key, lock_key, entry,
+                    ), context=contextvars.Context())
+                    _tasks.add(task)
+                    task.add_done_callback(_tasks.discard)
+            return _response_from_entry(request, entry, state)
+
+        lock_key = key + ':rendering'
+        leader = await cache.aadd(lock_key, 1, RENDER_LOCK_TIMEOUT)
+        if not leader:
+            entry = await _await_entry(key)
+            if entry is not None:
+                return _response_from_entry(request, entry, 'HIT')
+        try:
+            response = await _arender(view_func, request, args, kwargs)
+            entry = _make_entry(response, fresh)
+            if entry is not None:
+                await cache.aset(key, entry, fresh + stale)
+        finally:
+            if leader:
+                await cache.adelete(lock_key)
+        if entry is not None:
+            _add_validators(response, entry)
+            response['X-Page-Cache'] = 'MISS'
+        return response
+
+    return _wrapped_view
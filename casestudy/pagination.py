@@ -0,0 +1,230 @@
+"""
+Keyset (cursor) pagination for the casestudy application.
+
+Offset pagination costs a ``COUNT(*)`` plus an ``OFFSET`` scan that grows
+with the page number. Keyset pagination instead remembers the sort key of
+the last row shown and asks the database for the rows that come after it,
+so every page costs the same as the first one.
+
+Cursors are opaque, URL-safe tokens that encode the direction of travel
+and the sort key of the boundary row.
+
+``CappedCountPaginator`` is for offset pagination that has to stay (the
+admin changelist): it stops counting after ``max_count`` rows.
+"""
+
+import base64
+import binascii
+import datetime
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from .caching import make_key
+
+
+class InvalidCursor(InvalidPage):
+    """Raised when a cursor token cannot be decoded."""
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """JSON encoder that keeps full microsecond precision on datetimes."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(direction, key):
+    """Encode a direction (``'n'`` or ``'p'``) and sort key as a token."""
+    payload = json.dumps(
+        [direction, list(key)], cls=CursorEncoder, separators=(',', ':')
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by :func:`encode_cursor`."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        direction, key = json.loads(base64.urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+        raise InvalidCursor('That cursor is not valid')
+    if direction not in ('n', 'p') or not isinstance(key, list):
+        raise InvalidCursor('That cursor is not valid')
+    return direction, key
+
+
+class CursorPage:
+    """
+    A single page of results produced by :class:`CursorPaginator`.
+
+    Exposes the same ``has_next``/``has_previous`` interface as Django's
+    ``Page`` so templates can treat both alike, plus the opaque
+    ``next_cursor``/``previous_cursor`` tokens used to build links.
+    """
+
+    def __init__(self, object_list, paginator, cursor, next_cursor,
+                 previous_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage {self.cursor or "first"}>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Paginate a queryset by keyset on ``ordering`` instead of by offset.
+
+    ``ordering`` must end in a unique column (normally ``id``) so that every
+    row has a distinct key. Fields may be prefixed with ``-`` for descending
+    order, but all fields must share the same direction.
+
+    ``count`` is an approximate total that is only computed when accessed
+    and is then kept in the cache for ``count_timeout`` seconds (or until
+    the content generation changes), so pages that do not display a total
+    never pay for the ``COUNT(*)``.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('title', 'id'),
+                 count_timeout=300):
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+        self.fields = [name.lstrip('-') for name in self.ordering]
+        descending = {name.startswith('-') for name in self.ordering}
+        if len(descending) != 1:
+            raise ValueError('Cursor ordering fields must share a direction')
+        self.descending = descending.pop()
+        self.queryset = queryset.order_by(*self.ordering)
+        self.count_timeout = count_timeout
+
+    @property
+    def count(self):
+        """Approximate number of rows, cached between requests."""
+        try:
+            sql, params = self.queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+        digest = hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        return cache.get_or_set(
+            make_key('cursor_count', digest), self.queryset.count,
+            self.count_timeout
+        )
+
+    def _key(self, obj):
+        """Return the sort key of ``obj`` (a model instance or a dict)."""
+        if isinstance(obj, dict):
+            return [obj[name] for name in self.fields]
+        return [getattr(obj, name) for name in self.fields]
+
+    def _parse_key(self, key):
+        """Convert a decoded JSON key back into model field values."""
+        if len(key) != len(self.fields):
+            raise InvalidCursor('That cursor is not valid')
+        model = self.queryset.model
+        try:
+            return [
+                model._meta.get_field(name).to_python(value)
+                for name, value in zip(self.fields, key)
+            ]
+        except Exception:
+            raise InvalidCursor('That cursor is not valid')
+
+    def _seek(self, key, forward):
+        """Build the filter selecting rows strictly after/before ``key``."""
+        after = forward != self.descending
+        lookup = 'gt' if after else 'lt'
+        condition = Q()
+        for index, name in enumerate(self.fields):
+            step = Q(**{f'{name}__{lookup}': key[index]})
+            for prior, value in zip(self.fields[:index], key[:index]):
+                step &= Q(**{prior: value})
+            condition |= step
+        return condition
+
+    def page(self, cursor=None):
+        """Return the :class:`CursorPage` identified by ``cursor``."""
+        queryset, forward = self._page_queryset(cursor)
+        return self._make_page(list(queryset), cursor, forward)
+
+    async def apage(self, cursor=None):
+        """Async version of :meth:`page`, fetching through the async ORM."""
+        queryset, forward = self._page_queryset(cursor)
+        return self._make_page([row async for row in queryset], cursor, forward)
+
+    def _page_queryset(self, cursor):
+        """Return the unevaluated query for one page, plus its direction."""
+        queryset = self.queryset
+        forward = True
+        if cursor:
+            direction, key = decode_cursor(cursor)
+            forward = direction == 'n'
+            queryset = queryset.filter(self._seek(self._parse_key(key), forward))
+        if not forward:
+            queryset = queryset.reverse()
+        # One extra row tells whether there is a next page
+        return queryset[:self.per_page + 1], forward
+
+    def _make_page(self, rows, cursor, forward):
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        next_cursor = previous_cursor = None
+        if rows:
+            if has_more or not forward:
+                next_cursor = encode_cursor('n', self._key(rows[-1]))
+            if cursor and (has_more or forward):
+                previous_cursor = encode_cursor('p', self._key(rows[0]))
+        return CursorPage(rows, self, cursor or '', next_cursor,
+                          previous_cursor)
+
+
+class CappedCountPaginator(Paginator):
+    """
+    Offset paginator whose count never scans more than ``max_count`` rows.
+
+    ``COUNT(*)`` over a large filtered table is a full index scan on every
+    page view; counting a ``LIMIT``-ed subquery bounds that cost. Past the
+    cap only the first ``max_count`` rows are reachable, which suits a
+    work queue processed from the front.
+    """
+    max_count = 10000
+    truncated = False
+
+    @cached_property
+    def count(self):
+        capped = self.object_list.order_by().values('pk')[:self.max_count + 1]
+        count = capped.count()
+        self.truncated = count > self.max_count
+        return min(count, self.max_count)
@@ -0,0 +1,199 @@
+"""
+Low-quality image placeholders (LQIP) for case study images.
+
+Each case study stores a tiny blurred copy of its image as an inline
+``data:`` URI (WebP when Pillow can encode it, else PNG; a few hundred
+bytes) plus the image's dominant colour and aspect ratio (which
+``{% responsive_image %}`` turns into ``width``/``height``). The cards paint the colour and
+the placeholder straight from the HTML, with no extra request, while the
+full image loads on top.
+
+Placeholders are computed on a small background thread pool once a save
+that changed the image has committed (``casestudy/signals.py``), so saving
+never waits on the image fetch, and in bulk by ``python manage.py
+generate_placeholders``, which also catches up on any refresh a restart
+interrupted.
+``image_placeholder_for`` records the image each placeholder was made
+from, so unchanged images are never fetched again.
+"""
+
+import base64
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.request import urlopen
+
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+PLACEHOLDER_SIZE = 16     # longest side of the inline placeholder, px
+SOURCE_WIDTH = 64         # width fetched from Cloudinary to compute it
+FETCH_TIMEOUT = 5
+REFRESH_WORKERS = 2       # background threads refreshing after saves
+
+
+def image_key(image):
+    """The stored reference of an image, '' when there is none."""
+    key = str(image or '')
+    return '' if key == 'placeholder' else key
+
+
+def fetch_image(image):
+    """Return the bytes of a small rendition of ``image``."""
+    if hasattr(image, 'build_url'):
+        # Let Cloudinary downscale: a 64px PNG instead of the original
+        url = image.build_url(
+            width=SOURCE_WIDTH, crop='limit', format='png', secure=True,
+        )
+        with urlopen(url, timeout=FETCH_TIMEOUT) as response:
+            return response.read()
+    with image.open('rb') as f:
+        return f.read()
+
+
+def compute_placeholder(data):
+    """
+    Return ``(data URI, '#rrggbb' dominant colour, 'width:height')`` for
+    image bytes.
+    """
+    from PIL import Image, ImageFilter, ImageOps, features
+
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image).convert('RGB')
+    # Cloudinary's c_limit rendition keeps the original's proportions
+    aspect = '%d:%d' % image.size
+
+    # Dominant colour: the most common of a 5-colour palette
+    palette = image.resize((32, 32)).quantize(5)
+    _, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    color = f'#{red:02x}{green:02x}{blue:02x}'
+
+    image.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE), Image.LANCZOS)
+    image = image.filter(ImageFilter.GaussianBlur(0.6))
+    buffer = io.BytesIO()
+    if features.check('webp'):
+        image.save(buffer, 'WEBP', quality=30)
+        mime = 'image/webp'
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+        mime = 'image/png'
+    encoded = base64.b64encode(buffer.getvalue()).decode('ascii')
+    return f'data:{mime};base64,{encoded}', color, aspect
+
+
+def needs_placeholder(casestudy):
+    """Return True if the stored placeholder does not match the image."""
+    key = image_key(casestudy.casestudyimage)
+    return key != casestudy.image_placeholder_for or bool(key and not casestudy.image_aspect)
+
+
+def placeholder_fields(casestudy, force=False):
+    """
+    Return the placeholder fields for ``casestudy`` if they need to change.
+
+    Returns a dict of field values, or None when the stored placeholder
+    already matches the image (or it could not be computed; the card then
+    just renders without one).
+    """
+    if not force and not needs_placeholder(casestudy):
+        return None
+    key = image_key(casestudy.casestudyimage)
+    if not key:
+        return {
+            'image_placeholder': '', 'image_color': '',
+            'image_placeholder_for': '', 'image_aspect': '',
+        }
+    # A just-assigned public id is still a str until reloaded
+    image = casestudy._meta.get_field('casestudyimage').to_python(
+        casestudy.casestudyimage
+    )
+    try:
+        placeholder, color, aspect = compute_placeholder(fetch_image(image))
+    except Exception:
+        logger.exception('Could not compute the placeholder of %s', key)
+        return None
+    return {
+        'image_placeholder': placeholder,
+        'image_color': color,
+        'image_placeholder_for': key,
+        'image_aspect': aspect,
+    }
+
+
+def refresh_placeholder(pk):
+    """Recompute and store the placeholder of case study ``pk`` if stale."""
+    from .caching import bump_generation
+    from .models import Casestudy
+
+    casestudy = Casestudy.objects.filter(pk=pk).first()
+    if casestudy is None:
+        return
+    fields = placeholder_fields(casestudy)
+    if not fields:
+        return
+    with transaction.atomic():
+        current = Casestudy.objects.filter(pk=pk).values_list(
+            'casestudyimage', flat=True
+        ).first()
+        # The image changed again meanwhile: that save refreshes it
+        if image_key(current) != fields['image_placeholder_for']:
+            return
+        Casestudy.objects.filter(pk=pk).update(**fields)
+    bump_generation()
+
+
+_executor = None
+_lock = threading.Lock()
+# Case studies queued for a refresh that hasn't started yet
+_pending = set()
+# Refreshes queued or running, for wait_for_refreshes()
+_futures = set()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=REFRESH_WORKERS, thread_name_prefix='placeholder',
+        )
+    return _executor
+
+
+def _run_refresh(pk):
+    with _lock:
+        _pending.discard(pk)
+    try:
+        refresh_placeholder(pk)
+    except Exception:
+        logger.exception('Could not refresh the placeholder of case study %s', pk)
+    finally:
+        connections.close_all()
+
+
+def refresh_placeholder_later(pk):
+    """
+    Queue :func:`refresh_placeholder` on a small pool of background threads.
+
+    A case study already waiting in the queue isn't queued again: that
+    refresh will read its latest image. A bulk edit therefore costs one
+    refresh per case study and never more than ``REFRESH_WORKERS`` threads.
+    """
+    with _lock:
+        if pk in _pending:
+            return
+        _pending.add(pk)
+        future = _get_executor().submit(_run_refresh, pk)
+        _futures.add(future)
+    future.add_done_callback(_futures.discard)
+
+
+def wait_for_refreshes(timeout=None):
+    """
+    Wait for the background refreshes to finish, e.g. before a management
+    command exits. Returns False if some are still running at ``timeout``.
+    """
+    _, not_done = wait(list(_futures), timeout=timeout)
+    return not not_done
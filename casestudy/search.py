@@ -0,0 +1,279 @@
+"""
+Full-text search and faceting for case studies.
+
+One interface, three backends chosen by database vendor:
+
+- SQLite: an FTS5 virtual table ``casestudy_search`` keyed by rowid;
+- PostgreSQL: a ``casestudy_searchindex`` table holding a weighted
+  ``tsvector`` per case study with a GIN index;
+- anything else (or SQLite built without FTS5): ``icontains`` matching.
+
+Titles, excerpts and HTML-stripped descriptions are indexed. The index is
+kept in sync by the ``post_save``/``post_delete`` handlers in
+``casestudy/signals.py``, created by migration ``0008`` and can be rebuilt
+with ``manage.py rebuild_search_index``.
+
+Facet counts by industry, location and client are computed in a single
+grouped query and cached under a versioned key.
+"""
+
+import hashlib
+import html
+import re
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.expressions import RawSQL
+from django.utils.html import strip_tags
+
+from .caching import amake_key, fragment_timeout, make_key
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def document_fields(casestudy):
+    """Return the (title, excerpt, description) text to index."""
+    description = html.unescape(strip_tags(casestudy.description or ''))
+    return (
+        casestudy.title or '',
+        casestudy.excerpt or '',
+        ' '.join(description.split()),
+    )
+
+
+class LikeBackend:
+    """Fallback backend: no index, ``icontains`` on every field."""
+
+    def available(self):
+        return True
+
+    def filter(self, queryset, query):
+        condition = Q()
+        for token in _TOKEN_RE.findall(query):
+            condition &= (
+                Q(title__icontains=token)
+                | Q(excerpt__icontains=token)
+                | Q(description__icontains=token)
+            )
+        return queryset.filter(condition)
+
+    def index(self, casestudies):
+        pass
+
+    def remove(self, ids):
+        pass
+
+    def clear(self):
+        pass
+
+
+class SQLiteFTSBackend(LikeBackend):
+    """SQLite FTS5 backend with Porter stemming and prefix matching."""
+
+    table = 'casestudy_search'
+
+    def available(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [self.table]
+            )
+            return cursor.fetchone() is not None
+
+    def filter(self, queryset, query):
+        tokens = _TOKEN_RE.findall(query)
+        if not tokens:
+            return queryset
+        # Quote every token so user input can't use FTS5 query syntax
+        match = ' '.join('"%s"*' % token for token in tokens)
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s',
+            [match]
+        ))
+
+    def index(self, casestudies):
+        rows = [(c.pk, *document_fields(c)) for c in casestudies]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s',
+                [(row[0],) for row in rows]
+            )
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, title, excerpt, description)'
+                ' VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {self.table} WHERE rowid = %s',
+                [(pk,) for pk in ids]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+
+class PostgresBackend(LikeBackend):
+    """PostgreSQL backend: weighted ``tsvector`` column with a GIN index."""
+
+    table = 'casestudy_searchindex'
+    document_sql = (
+        "setweight(to_tsvector('english', %s), 'A') || "
+        "setweight(to_tsvector('english', %s), 'B') || "
+        "setweight(to_tsvector('english', %s), 'C')"
+    )
+
+    def available(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT to_regclass(%s)', [self.table])
+            return cursor.fetchone()[0] is not None
+
+    def filter(self, queryset, query):
+        if not _TOKEN_RE.search(query):
+            return queryset
+        return queryset.filter(id__in=RawSQL(
+            f'SELECT casestudy_id FROM {self.table} '
+            "WHERE document @@ plainto_tsquery('english', %s)",
+            [query]
+        ))
+
+    def index(self, casestudies):
+        rows = [(c.pk, *document_fields(c)) for c in casestudies]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (casestudy_id, document) '
+                f'VALUES (%s, {self.document_sql}) '
+                'ON CONFLICT (casestudy_id) DO UPDATE '
+                'SET document = EXCLUDED.document', rows
+            )
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE casestudy_id = ANY(%s)',
+                [list(ids)]
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {self.table}')
+
+
+_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresBackend,
+}
+_backend = None
+
+
+def get_backend():
+    """Return the search backend for the default database."""
+    global _backend
+    if _backend is None:
+        backend = _BACKENDS.get(connection.vendor, LikeBackend)()
+        if not backend.available():
+            # e.g. migrations not applied yet, or SQLite without FTS5
+            return LikeBackend()
+        _backend = backend
+    return _backend
+
+
+def search(queryset, query):
+    """Restrict a Casestudy queryset to rows matching ``query``."""
+    query = (query or '').strip()
+    if not query:
+        return queryset
+    return get_backend().filter(queryset, query)
+
+
+def index_casestudies(casestudies):
+    """Add or refresh case studies in the search index."""
+    get_backend().index(casestudies)
+
+
+def remove_casestudies(ids):
+    """Drop case studies from the search index."""
+    get_backend().remove(ids)
+
+
+FACETS = (
+    ('industry', 'industry__industry'),
+    ('location', 'location__location'),
+    ('client', 'client__client'),
+)
+
+
+def _facet_query(queryset):
+    """Return ``(cache digest, grouped rows query)``, or None if empty."""
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return None
+    digest = hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+    fields = []
+    for name, label in FACETS:
+        fields += [f'{name}_id', label]
+    return digest, queryset.order_by().values(*fields).annotate(n=Count('id'))
+
+
+def _fold_facets(rows):
+    """Fold grouped rows into per-facet lists sorted by name."""
+    facets = {name: {} for name, _ in FACETS}
+    for row in rows:
+        for name, label in FACETS:
+            key = (row[f'{name}_id'], row[label])
+            facets[name][key] = facets[name].get(key, 0) + row['n']
+    return {
+        name: sorted(
+            ((pk, label, n) for (pk, label), n in counts.items()),
+            key=lambda facet: facet[1]
+        )
+        for name, counts in facets.items()
+    }
+
+
+def facet_counts(queryset):
+    """
+    Count ``queryset`` rows per industry, location and client.
+
+    Runs one grouped query over the three foreign keys and folds the rows
+    into per-facet ``[(id, name, count), ...]`` lists sorted by name. The
+    result is cached under a versioned key, so edits invalidate it.
+    """
+    query = _facet_query(queryset)
+    if query is None:
+        return {name: [] for name, _ in FACETS}
+    digest, rows = query
+    return cache.get_or_set(
+        make_key('facets', digest), lambda: _fold_facets(rows), fragment_timeout()
+    )
+
+
+async def afacet_counts(queryset):
+    """
+    Async version of :func:`facet_counts`.
+
+    Reads the same cache entry. A miss goes through the sync
+    ``get_or_set`` in a worker thread, so concurrent misses still run the
+    grouped query once.
+    """
+    query = _facet_query(queryset)
+    if query is None:
+        return {name: [] for name, _ in FACETS}
+    digest, rows = query
+    key = await amake_key('facets', digest)
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = await sync_to_async(cache.get_or_set)(
+            key, lambda: _fold_facets(rows), fragment_timeout()
+        )
+    return facets
@@ -0,0 +1,120 @@
+"""
+Signal handlers for the casestudy application.
+
+Connected in ``CasestudyConfig.ready()``.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .caching import bump_generation
+from .placeholders import needs_placeholder, refresh_placeholder_later
+from .search import index_casestudies, remove_casestudies
+from .models import (
+    Casestudy, Client, Comment, Industry, Location, adjust_comment_counts,
+)
+
+
+@receiver(post_save, sender=Casestudy)
+def refresh_image_placeholder(sender, instance, raw=False, **kwargs):
+    """Recompute the inline placeholder, after commit, when the image changed."""
+    if raw or not needs_placeholder(instance):
+        return
+    # Fetching the image is a network round trip: neither the request nor
+    # its transaction should wait for it
+    pk = instance.pk
+    transaction.on_commit(lambda: refresh_placeholder_later(pk))
+
+
+@receiver(post_save, sender=Casestudy)
+@receiver(post_delete, sender=Casestudy)
+@receiver(post_save, sender=Client)
+@receiver(post_delete, sender=Client)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(post_save, sender=Industry)
+@receiver(post_delete, sender=Industry)
+def invalidate_casestudy_cache(sender, **kwargs):
+    """Orphan every versioned cache key when listing content changes."""
+    bump_generation()
+
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def note_username_change(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Remember whether this save renames the user (e.g. not a login)."""
+    instance._renamed = False
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and sender.USERNAME_FIELD not in update_fields:
+        return
+    stored = sender._default_manager.filter(pk=instance.pk).values_list(
+        sender.USERNAME_FIELD, flat=True
+    ).first()
+    instance._renamed = stored is not None and stored != instance.get_username()
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_renamed_author(sender, instance, raw=False, **kwargs):
+    """Comments are shown, and served by the API, with their author's name."""
+    if not raw and getattr(instance, '_renamed', False):
+        instance._renamed = False
+        bump_generation()
+
+
+@receiver(post_save, sender=Casestudy)
+def index_saved_casestudy(sender, instance, raw=False, **kwargs):
+    """Keep the full-text search index in sync with a saved case study."""
+    if not raw:
+        index_casestudies([instance])
+
+
+@receiver(post_delete, sender=Casestudy)
+def unindex_deleted_casestudy(sender, instance, **kwargs):
+    """Drop a deleted case study from the full-text search index."""
+    remove_casestudies([instance.pk])
+
+
+def _count_comment(state, sign):
+    """Add ``sign`` to the counter matching a (casestudy_id, approved) state."""
+    casestudy_id, approved = state
+    if approved:
+        adjust_comment_counts(casestudy_id, approved=sign)
+    else:
+        adjust_comment_counts(casestudy_id, pending=sign)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, raw=False, **kwargs):
+    """Keep Casestudy comment counters in step with a saved comment."""
+    if raw:
+        return
+    new_state = (instance.casestudy_id, instance.approved)
+    old_state = None if created else getattr(instance, '_counted_state', None)
+    was_approved = False if created else (old_state or (None, None))[1]
+    # Public before or after this save (or maybe before): its text or its
+    # visibility may have changed, even if the counters did not
+    if instance.approved or was_approved is not False:
+        bump_generation()
+
+    if not created and (old_state is None or None in old_state):
+        # Unknown previous state: leave it to reconcile_comment_counts
+        return
+    if old_state == new_state:
+        return
+    if old_state is not None:
+        _count_comment(old_state, -1)
+    _count_comment(new_state, 1)
+    instance._counted_state = new_state
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, **kwargs):
+    """Keep Casestudy comment counters in step with a deleted comment."""
+    state = getattr(instance, '_counted_state', None)
+    if state is None or None in state:
+        state = (instance.casestudy_id, instance.approved)
+    _count_comment(state, -1)
+    if state[1]:
+        bump_generation()
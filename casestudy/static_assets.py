@@ -0,0 +1,252 @@
+"""
+Static asset optimization used by ``optimize_static``.
+
+The ``static/`` source tree has accumulated files that should never reach
+``collectstatic``:
+
+- hashed copies such as ``logo.fd1ab12d4396.png``, left over from an old
+  collectstatic run (collectstatic hashes them a second time);
+- byte-identical duplicates under different names;
+- screenshots that only the README uses.
+
+``optimize_static`` recompresses images losslessly in place and writes
+``EXCLUDE_MANIFEST`` into the static directory, listing the files no
+template, stylesheet, script or Python module refers to.
+``ServedSetFinder`` leaves those out of ``collectstatic``, so they stay in
+the repository (``upload_cloudinary`` still reads its originals from
+``static/images``) but never reach ``STATIC_ROOT`` or the wire.
+
+Precompressed ``.gz``/``.br`` siblings are written by WhiteNoise's
+``CompressedManifestStaticFilesStorage`` during collectstatic; it emits
+Brotli whenever the ``Brotli`` package is installed.
+"""
+
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+import subprocess
+import tempfile
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.staticfiles.finders import FileSystemFinder
+from django.contrib.staticfiles.utils import get_files
+
+from .image_upload import canonical_name, file_digest
+
+EXCLUDE_MANIFEST = '.optimize-static.json'
+TEXT_EXTENSIONS = ('.html', '.txt', '.py', '.css', '.js')
+RECOMPRESS_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+# Referenced from the database, not from source: collectmedia's copies
+ALWAYS_SERVED = ('uploads/',)
+# Ignore savings below this fraction; not worth a changed file in git
+MIN_SAVING = 0.01
+
+
+def manifest_path(root):
+    return os.path.join(root, EXCLUDE_MANIFEST)
+
+
+def load_manifest(root):
+    try:
+        with open(manifest_path(root), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {'optimized': {}, 'excluded': []}
+
+
+def save_manifest(root, manifest):
+    fd, tmp = tempfile.mkstemp(dir=root, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, manifest_path(root))
+
+
+def list_assets(root):
+    """Yield paths relative to ``root``, with forward slashes, skipping dotfiles."""
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if not name.startswith('.'):
+                path = os.path.join(directory, name)
+                yield os.path.relpath(path, root).replace(os.sep, '/')
+
+
+# Recompression ------------------------------------------------------------
+
+def _pixels(data):
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    return image.mode, image.size, image.tobytes()
+
+
+def _recompress_png(data):
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    options = {'optimize': True}
+    for key in ('icc_profile', 'transparency', 'dpi', 'gamma'):
+        if key in image.info:
+            options[key] = image.info[key]
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', **options)
+    return buffer.getvalue()
+
+
+def _recompress_webp(data):
+    # Only lossless WebP ('VP8L' chunk) can be re-encoded without loss
+    if data[12:16] != b'VP8L':
+        return None
+    from PIL import Image
+    image = Image.open(io.BytesIO(data))
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', lossless=True, quality=100, method=6)
+    return buffer.getvalue()
+
+
+def _recompress_jpeg(data):
+    # Pillow can only re-encode JPEG lossily; use jpegtran when present
+    jpegtran = shutil.which('jpegtran')
+    if not jpegtran:
+        return None
+    result = subprocess.run(
+        [jpegtran, '-copy', 'icc', '-optimize', '-progressive'],
+        input=data, capture_output=True, check=True,
+    )
+    return result.stdout
+
+
+def recompress(path):
+    """
+    Losslessly recompress the image at ``path`` in place.
+
+    The new encoding is kept only if it decodes to identical pixels and is
+    at least ``MIN_SAVING`` smaller. Returns the number of bytes saved.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    extension = os.path.splitext(path)[1].lower()
+    encoder = {
+        '.png': _recompress_png,
+        '.webp': _recompress_webp,
+        '.jpg': _recompress_jpeg,
+        '.jpeg': _recompress_jpeg,
+    }[extension]
+    optimized = encoder(data)
+    if not optimized or len(optimized) > len(data) * (1 - MIN_SAVING):
+        return 0
+    # JPEG decoders may differ in rounding, but jpegtran is lossless by design
+    if extension != '.jpg' and extension != '.jpeg':
+        if _pixels(optimized) != _pixels(data):
+            return 0
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(optimized)
+    shutil.copymode(path, tmp)
+    os.replace(tmp, path)
+    return len(data) - len(optimized)
+
+
+# Served set ---------------------------------------------------------------
+
+def reference_roots():
+    """Directories whose source files can refer to static assets."""
+    roots = []
+    for template in settings.TEMPLATES:
+        roots.extend(str(d) for d in template.get('DIRS', []))
+    base_dir = os.path.abspath(settings.BASE_DIR)
+    for config in apps.get_app_configs():
+        # Project apps only; installed packages ship their own assets
+        if os.path.abspath(config.path).startswith(base_dir + os.sep):
+            roots.append(config.path)
+    return sorted(set(roots))
+
+
+def referenced_text(static_root):
+    """Concatenated text of every file that could refer to an asset."""
+    chunks = []
+    paths = []
+    for root in reference_roots():
+        for directory, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if d not in ('migrations', '__pycache__')]
+            paths.extend(
+                os.path.join(directory, name) for name in files
+                if name.endswith(TEXT_EXTENSIONS)
+            )
+    # Stylesheets and scripts refer to images through url(...)
+    paths.extend(
+        os.path.join(static_root, name) for name in list_assets(static_root)
+        if name.endswith(('.css', '.js'))
+    )
+    for path in paths:
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            chunks.append(f.read())
+    return '\n'.join(chunks)
+
+
+def is_referenced(name, text):
+    basename = posixpath.basename(name)
+    pattern = r'(?<![\w.-])' + re.escape(basename) + r'(?![\w.-])'
+    return re.search(pattern, text) is not None
+
+
+def plan_exclusions(static_root, keep=ALWAYS_SERVED):
+    """
+    Return ``{name: reason}`` for every asset to leave out of collectstatic.
+
+    Reasons are ``'hashed copy'``, ``'duplicate of <name>'`` and
+    ``'unreferenced'``. Hashed copies go whenever the original is present
+    ({% static %} would hash them a second time); otherwise referenced
+    files and files matching a ``keep`` prefix are always served.
+    """
+    text = referenced_text(static_root)
+    names = [
+        name for name in list_assets(static_root)
+        if not name.startswith(tuple(keep))
+    ]
+    present = set(names)
+    referenced = {name for name in names if is_referenced(name, text)}
+    excluded = {}
+
+    by_digest = {}
+    for name in names:
+        directory, basename = posixpath.split(name)
+        canonical = posixpath.join(directory, canonical_name(basename))
+        if canonical != name and canonical in present:
+            excluded[name] = 'hashed copy'
+            continue
+        digest = file_digest(os.path.join(static_root, name))
+        by_digest.setdefault(digest, []).append(name)
+
+    for group in by_digest.values():
+        # Keep a referenced copy if there is one, else the first by name
+        group.sort(key=lambda name: (name not in referenced, name))
+        keeper = group[0]
+        for name in group[1:]:
+            if name not in referenced:
+                excluded[name] = f'duplicate of {keeper}'
+        if keeper not in referenced:
+            excluded[keeper] = 'unreferenced'
+    return excluded
+
+
+class ServedSetFinder(FileSystemFinder):
+    """
+    ``FileSystemFinder`` that leaves out what ``optimize_static`` excluded.
+
+    Only ``list()`` (used by collectstatic) filters; ``find()`` still
+    resolves every file, so nothing 404s in development.
+    """
+
+    def list(self, ignore_patterns):
+        for prefix, root in self.locations:
+            if not os.path.isdir(root):
+                continue
+            storage = self.storages[root]
+            excluded = set(load_manifest(root)['excluded'])
+            for path in get_files(storage, ignore_patterns):
+                if path.replace(os.sep, '/') not in excluded:
+                    yield path, storage
@@ -0,0 +1,56 @@
+"""
+Critical CSS template tag.
+
+    {% load critical_css %}
+    <head>
+        ...
+        {% critical_css %}
+    </head>
+
+Inlines the critical CSS built for the template being rendered (see
+``casestudy/critical_css.py``) and loads every stylesheet it covers with
+``rel=preload``, switching to ``rel=stylesheet`` once loaded; a
+``<noscript>`` fallback keeps them working without JavaScript.
+Stylesheets the build did not cover, or every stylesheet when there is
+no build for the template, are linked as usual.
+"""
+
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+from django.utils.safestring import mark_safe
+
+from casestudy.critical_css import STYLESHEETS, is_remote, load
+
+register = template.Library()
+
+
+def _attributes(attrs):
+    return format_html_join('', ' {}="{}"', attrs.items())
+
+
+@register.simple_tag(takes_context=True)
+def critical_css(context):
+    """Inline critical CSS and load the full stylesheets without blocking."""
+    template_name = getattr(context.template, 'name', None) or ''
+    css, covered = load(template_name)
+    parts = []
+    if css:
+        # Closing tags cannot appear in valid CSS; guard the <style> anyway
+        parts.append(format_html(
+            '<style>{}</style>', mark_safe(css.replace('</', '<\\/'))
+        ))
+    for href, attrs, extract in STYLESHEETS:
+        url = href if is_remote(href) else static(href)
+        if not extract or (css and href in covered):
+            parts.append(format_html(
+                '<link rel="preload" href="{}" as="style"{} '
+                'onload="this.onload=null;this.rel=\'stylesheet\'">'
+                '<noscript><link rel="stylesheet" href="{}"{}></noscript>',
+                url, _attributes(attrs), url, _attributes(attrs),
+            ))
+        else:
+            parts.append(format_html(
+                '<link rel="stylesheet" href="{}"{}>', url, _attributes(attrs)
+            ))
+    return mark_safe('\n'.join(parts))
@@ -0,0 +1,133 @@
+"""
+Responsive image template tags.
+
+    {% load responsive_images %}
+    {% responsive_image casestudy.casestudyimage alt=casestudy.title ratio="4:3" sizes="(max-width: 576px) 90vw, 400px" priority=forloop.first class="img-fluid" %}
+    {% responsive_image casestudy.casestudyimage alt=casestudy.title aspect=casestudy.image_aspect sizes="100vw" %}
+    <div style="background-image: url('{% image_url casestudy.casestudyimage 800 %}')">
+
+``responsive_image`` emits an ``<img>`` with ``srcset`` at
+``SRCSET_WIDTHS``, ``sizes`` and intrinsic ``width``/``height``:
+
+- Cloudinary images get URL transformations (``w_…``, ``f_auto``,
+  ``q_auto``), so Cloudinary negotiates AVIF/WebP per browser. With a
+  ``ratio`` they are cropped to it; otherwise they keep their own
+  proportions, given as ``aspect`` (``Casestudy.image_aspect``), so the
+  browser can still reserve their box before they load;
+- other files are served as they are;
+- empty images and Cloudinary's ``placeholder`` fall back to a static
+  default image.
+
+``priority=True`` marks the LCP image: eager loading, high fetch priority.
+``placeholder``/``color`` (``Casestudy.image_placeholder``/``image_color``)
+paint an inline blurred preview behind the image until it loads.
+"""
+
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+register = template.Library()
+
+DEFAULT_IMAGE = 'images/default.png'
+SRC_WIDTH = 400
+SRCSET_WIDTHS = (320, 400, 600, 800, 1200)
+
+
+def _is_empty(image):
+    return not image or str(image) == 'placeholder'
+
+
+def _parse_ratio(ratio):
+    if not ratio:
+        return None
+    width, _, height = str(ratio).partition(':')
+    return int(width), int(height or 1)
+
+
+def _cloudinary_url(image, width, ratio=None):
+    options = {
+        'width': width, 'fetch_format': 'auto', 'quality': 'auto',
+        'secure': True,
+    }
+    if ratio:
+        options.update(height=round(width * ratio[1] / ratio[0]), crop='fill')
+    else:
+        options['crop'] = 'limit'
+    return image.build_url(**options)
+
+
+def _placeholder_style(placeholder, color, style=None):
+    """Inline ``style`` that shows the placeholder until the image covers it."""
+    rules = []
+    if color:
+        rules.append(f'background-color: {color}')
+    if placeholder:
+        rules.append(
+            f"background-image: url('{placeholder}'); background-size: cover"
+        )
+    if style:
+        rules.append(style.rstrip('; '))
+    return '; '.join(rules) + ';' if rules else None
+
+
+def _attributes(pairs):
+    return format_html_join(
+        ' ', '{}="{}"', ((name, value) for name, value in pairs if value is not None)
+    )
+
+
+@register.simple_tag
+def image_url(image, width=800, default=DEFAULT_IMAGE):
+    """URL of ``image`` scaled to about ``width`` px, e.g. for CSS backgrounds."""
+    if _is_empty(image):
+        return static(default)
+    if hasattr(image, 'build_url'):
+        return _cloudinary_url(image, int(width))
+    return image.url
+
+
+@register.simple_tag
+def responsive_image(image, alt='', sizes='100vw', ratio=None, priority=False,
+                     default=DEFAULT_IMAGE, width=None, height=None,
+                     placeholder=None, color=None, aspect=None, **attrs):
+    """Render ``image`` with srcset/sizes and intrinsic dimensions."""
+    ratio = _parse_ratio(ratio)
+    # The box to reserve: the crop if there is one, else the image's own
+    box = ratio or _parse_ratio(aspect)
+    if not _is_empty(image):
+        attrs['style'] = _placeholder_style(placeholder, color, attrs.get('style'))
+    common = [
+        ('alt', alt),
+        *attrs.items(),
+        ('loading', 'eager' if priority else 'lazy'),
+        ('fetchpriority', 'high' if priority else 'low'),
+        ('decoding', 'async'),
+    ]
+
+    if _is_empty(image):
+        if width and ratio and not height:
+            height = round(int(width) * ratio[1] / ratio[0])
+        return format_html('<img src="{}" {}>', static(default), _attributes(
+            [('width', width), ('height', height)] + common
+        ))
+
+    if box and not height:
+        width = width or SRC_WIDTH
+        height = round(int(width) * box[1] / box[0])
+
+    if hasattr(image, 'build_url'):
+        srcset = ', '.join(
+            f'{_cloudinary_url(image, w, ratio)} {w}w' for w in SRCSET_WIDTHS
+        )
+        return format_html('<img {}>', _attributes([
+            ('src', _cloudinary_url(image, SRC_WIDTH, ratio)),
+            ('srcset', srcset),
+            ('sizes', sizes),
+            ('width', width),
+            ('height', height),
+        ] + common))
+
+    return format_html('<img {}>', _attributes([
+        ('src', image.url), ('width', width), ('height', height),
+    ] + common))
@@ -1,3 +1,1664 @@
-from django.test import TestCase
+import asyncio
+import csv
+import io
+import json
+import os
+import re
+import runpy
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core import signing
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection, connections
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import (
+    AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils.http import http_date
+
+from coreflowepc import sessions
+from coreflowepc.cache import TieredCache
+from coreflowepc.middleware import QueryBudgetExceeded, query_budget
+from coreflowepc.warmup import clear_warm, mark_warm, warm_process, warmed_at
+
+from . import critical_css
+from .benchmark import Fixture
+from .caching import get_generation
+from .management.commands.load_case_study_data import iter_json_array
+from .models import Casestudy, Client, Comment, Industry, Location
+from .page_cache import _make_entry, anonymous_page_cache
+from .pagination import CappedCountPaginator, CursorPaginator, InvalidCursor
+from .placeholders import (
+    compute_placeholder, placeholder_fields, refresh_placeholder, refresh_placeholder_later,
+    wait_for_refreshes,
+)
+from .search import afacet_counts, facet_counts, search
+from .static_assets import EXCLUDE_MANIFEST, ServedSetFinder, load_manifest
+from .views import AsyncCasestudyList, casestudy_detail_async
+
+
+def make_tiered_cache(directory, **options):
+    options.setdefault('SYNC_INTERVAL', 0)
+    options.setdefault('LEASE_TIMEOUT', 5)
+    return TieredCache(os.path.join(directory, 'cache.sqlite3'), {'OPTIONS': options})
+
+
+class IsolatedCacheMixin:
+    """Give the test class its own TieredCache file, emptied per test."""
+
+    @classmethod
+    def setUpClass(cls):
+        directory = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(directory.cleanup)
+        override = override_settings(CACHES={'default': {
+            'BACKEND': 'coreflowepc.cache.TieredCache',
+            'LOCATION': os.path.join(directory.name, 'cache.sqlite3'),
+            'OPTIONS': {'SYNC_INTERVAL': 0, 'LEASE_TIMEOUT': 5},
+        }})
+        override.enable()
+        cls.addClassCleanup(override.disable)
+        super().setUpClass()
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+
+@override_settings(
+    # No collectstatic manifest in the test environment
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class CasestudyTestCase(IsolatedCacheMixin, TestCase):
+    """A few case studies, a commenter and a private cache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_ = Client.objects.create(client='Acme')
+        cls.location = Location.objects.create(location='London')
+        cls.industry = Industry.objects.create(industry='Energy')
+        cls.casestudies = [
+            Casestudy.objects.create(
+                title=f'Study {n:02d}', slug=f'study-{n:02d}',
+                client=cls.client_, location=cls.location, industry=cls.industry,
+                description=f'<p>Heat pump retrofit number {n}</p>',
+                excerpt=f'Retrofit {n}',
+            )
+            for n in range(10)
+        ]
+        cls.user = User.objects.create_user('commenter', password='secret-pass')
+
+    def comment(self, casestudy=None, approved=True, content='Great work'):
+        return Comment.objects.create(
+            casestudy=casestudy or self.casestudies[0], author=self.user,
+            content=content, approved=approved,
+        )
+
+
+def run_with_timeout(target, seconds=10):
+    """Run ``target`` in a thread; return its result, or fail if it hangs."""
+    result = {}
+
+    def runner():
+        result['value'] = target()
+
+    thread = threading.Thread(target=runner, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    if thread.is_alive():
+        raise AssertionError(f'{target!r} did not finish in {seconds}s')
+    return result['value']
+
+
+class TieredCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.cache = make_tiered_cache(self.directory)
+
+    def test_invalidation_reaches_other_processes(self):
+        other = make_tiered_cache(self.directory)
+        self.cache.set('key', 'old')
+        self.assertEqual(other.get('key'), 'old')
+        self.cache.set('key', 'new')
+        self.assertEqual(other.get('key'), 'new')
+        self.cache.delete('key')
+        self.assertIsNone(other.get('key'))
+
+    def test_incr_is_shared(self):
+        other = make_tiered_cache(self.directory)
+        self.cache.set('counter', 1)
+        other.incr('counter')
+        self.assertEqual(self.cache.incr('counter'), 3)
+
+    def test_nested_get_or_set_does_not_deadlock(self):
+        cache = self.cache
+
+        def outer():
+            return cache.get_or_set('outer', lambda: [
+                cache.get_or_set(f'inner{i}', lambda i=i: i) for i in range(200)
+            ])
+
+        self.assertEqual(run_with_timeout(outer), list(range(200)))
+
+    def test_get_or_set_reentering_its_own_key(self):
+        cache = self.cache
+
+        def outer():
+            return cache.get_or_set('key', lambda: cache.get_or_set('key', 'inner'))
+
+        self.assertEqual(run_with_timeout(outer), 'inner')
+
+    def test_get_or_set_coalesces_concurrent_misses(self):
+        calls = []
+        results = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        def worker():
+            results.append(self.cache.get_or_set('key', compute))
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['value'] * 8)
+
+    def test_get_or_set_recovers_from_a_failed_leader(self):
+        with self.assertRaises(RuntimeError):
+            self.cache.get_or_set('key', self._fail)
+        self.assertEqual(self.cache.get_or_set('key', 'value'), 'value')
+
+    def _fail(self):
+        raise RuntimeError('boom')
+
+    def test_l1_serves_repeat_reads(self):
+        self.cache.set('key', 'value')
+        other = make_tiered_cache(self.directory)
+        self.assertEqual(other.get('key'), 'value')
+        self.assertEqual(other.get('key'), 'value')
+        self.assertIsNone(other.get('missing'))
+        stats = other.stats()
+        self.assertEqual((stats['l1_hits'], stats['l2_hits'], stats['misses']), (1, 1, 1))
+
+    def test_l1_is_stale_for_at_most_the_sync_interval(self):
+        other = make_tiered_cache(self.directory, SYNC_INTERVAL=60)
+        self.cache.set('key', 'old')
+        self.assertEqual(other.get('key'), 'old')
+        self.cache.set('key', 'new')
+        self.assertEqual(other.get('key'), 'old')
+        other._synced_at = 0  # the interval has passed
+        self.assertEqual(other.get('key'), 'new')
+
+    def test_add(self):
+        other = make_tiered_cache(self.directory)
+        self.assertTrue(self.cache.add('key', 'first'))
+        self.assertFalse(other.add('key', 'second'))
+        self.assertEqual(other.get('key'), 'first')
+        # Stored in this process's L1 as well, like set()
+        self.assertEqual(self.cache.get('key'), 'first')
+        self.assertEqual(self.cache.stats()['l1_hits'], 1)
+
+    def test_add_replaces_an_expired_entry_everywhere(self):
+        other = make_tiered_cache(self.directory)
+        self.cache.set('key', 'old', timeout=60)
+        self.assertEqual(other.get('key'), 'old')
+        with mock.patch('coreflowepc.cache.time.time', return_value=time.time() + 120):
+            self.assertTrue(self.cache.add('key', 'new', timeout=None))
+            self.assertEqual(other.get('key'), 'new')
+
+    def test_get_or_set_waits_for_another_processes_lease(self):
+        other = make_tiered_cache(self.directory)
+        made_key = self.cache.make_and_validate_key('key')
+        self.assertTrue(other._acquire_lease(made_key))
+
+        def finish_elsewhere():
+            time.sleep(0.1)
+            other.set('key', 'theirs')
+            other._release_lease(made_key)
+
+        thread = threading.Thread(target=finish_elsewhere)
+        thread.start()
+        compute = mock.Mock(return_value='ours')
+        self.assertEqual(run_with_timeout(lambda: self.cache.get_or_set('key', compute)), 'theirs')
+        thread.join()
+        compute.assert_not_called()
+
+    def test_get_or_set_takes_over_an_abandoned_lease(self):
+        cache = make_tiered_cache(self.directory, LEASE_TIMEOUT=0.2)
+        other = make_tiered_cache(self.directory, LEASE_TIMEOUT=0.2)
+        self.assertTrue(other._acquire_lease(cache.make_and_validate_key('key')))
+        self.assertEqual(run_with_timeout(lambda: cache.get_or_set('key', 'ours')), 'ours')
+        self.assertEqual(other.get('key'), 'ours')
+
+
+class PageCacheTests(IsolatedCacheMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.factory = RequestFactory()
+        self.calls = []
+
+    def page_view(self, delay=0):
+        @anonymous_page_cache
+        def view(request):
+            self.calls.append(1)
+            time.sleep(delay)
+            response = HttpResponse(f'page {len(self.calls)}')
+            response['Last-Modified'] = http_date(1_000_000)
+            return response
+        return view
+
+    def test_miss_then_hit_then_304(self):
+        view = self.page_view()
+        first = view(self.factory.get('/page/'))
+        self.assertEqual(first['X-Page-Cache'], 'MISS')
+        second = view(self.factory.get('/page/'))
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        conditional = view(self.factory.get('/page/', HTTP_IF_NONE_MATCH=first['ETag']))
+        self.assertEqual(conditional.status_code, 304)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_if_modified_since(self):
+        view = self.page_view()
+        first = view(self.factory.get('/page/'))
+        conditional = view(self.factory.get(
+            '/page/', HTTP_IF_MODIFIED_SINCE=first['Last-Modified'],
+        ))
+        self.assertEqual(conditional.status_code, 304)
+        self.assertEqual(conditional['ETag'], first['ETag'])
+        self.assertEqual(len(self.calls), 1)
+
+    @override_settings(ANONYMOUS_PAGE_CACHE_FRESH=0)
+    def test_stale_page_is_served_while_it_revalidates_once(self):
+        view = self.page_view()
+        first = view(self.factory.get('/page/'))
+        with mock.patch('casestudy.page_cache.threading.Thread') as thread:
+            stale = view(self.factory.get('/page/'))
+            again = view(self.factory.get('/page/', HTTP_IF_NONE_MATCH=first['ETag']))
+            self.assertEqual((stale['X-Page-Cache'], stale.content), ('STALE', b'page 1'))
+            self.assertEqual(again.status_code, 304)
+            # The second stale hit found the revalidation lock taken
+            thread.assert_called_once()
+            options = thread.call_args.kwargs
+            options['target'](*options['args'])
+            self.assertEqual(len(self.calls), 2)
+
+            revalidated = view(self.factory.get('/page/'))
+            self.assertEqual(revalidated.content, b'page 2')
+            self.assertNotEqual(revalidated['ETag'], first['ETag'])
+
+    def test_uncacheable_responses_and_requests(self):
+        @anonymous_page_cache
+        def view(request):
+            self.calls.append(1)
+            response = HttpResponse('with a cookie')
+            response.set_cookie('seen', '1')
+            return response
+
+        for _ in range(2):
+            self.assertNotIn('X-Page-Cache', view(self.factory.get('/cookie/')))
+        page = self.page_view()
+        self.assertNotIn('X-Page-Cache', page(self.factory.post('/page/')))
+        self.assertEqual(len(self.calls), 3)
+
+    def test_concurrent_cold_misses_render_once(self):
+        view = self.page_view(delay=0.3)
+        responses = []
+        threads = [
+            threading.Thread(target=lambda: responses.append(view(self.factory.get('/page/'))))
+            for _ in range(6)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual({r.content for r in responses}, {b'page 1'})
+
+    async def test_concurrent_async_cold_misses_render_once(self):
+        @anonymous_page_cache
+        async def view(request):
+            self.calls.append(1)
+            await asyncio.sleep(0.3)
+            return HttpResponse('async page')
+
+        factory = AsyncRequestFactory()
+        responses = await asyncio.gather(*(view(factory.get('/async/')) for _ in range(6)))
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual({r.content for r in responses}, {b'async page'})
+        self.assertEqual(sorted(r['X-Page-Cache'] for r in responses), ['HIT'] * 5 + ['MISS'])
+
+    def test_view_may_use_get_or_set(self):
+        @anonymous_page_cache
+        def view(request):
+            values = [cache.get_or_set(f'fragment{i}', i) for i in range(200)]
+            return HttpResponse(str(sum(values)))
+
+        response = run_with_timeout(lambda: view(self.factory.get('/nested/')))
+        self.assertEqual(response.content, str(sum(range(200))).encode())
+
+    def test_last_modified_moves_with_the_content(self):
+        old = HttpResponse('old')
+        old['Last-Modified'] = http_date(1_000_000)
+        previous = _make_entry(old, 60)
+        previous['last_modified'] = 2_000_000
+
+        unchanged = HttpResponse('old')
+        unchanged['Last-Modified'] = http_date(1_000_000)
+        self.assertEqual(_make_entry(unchanged, 60, previous)['last_modified'], 2_000_000)
+
+        # Same row dates (an edited comment has none), different bytes
+        changed = HttpResponse('new')
+        changed['Last-Modified'] = http_date(1_000_000)
+        entry = _make_entry(changed, 60, previous)
+        self.assertGreaterEqual(entry['last_modified'], int(time.time()) - 1)
+
+
+class CommentCounterTests(CasestudyTestCase):
+
+    def counts(self, casestudy=None):
+        casestudy = casestudy or self.casestudies[0]
+        casestudy.refresh_from_db()
+        return casestudy.approved_comment_count, casestudy.pending_comment_count
+
+    def test_counters_follow_saves_and_deletes(self):
+        pending = self.comment(approved=False)
+        approved = self.comment()
+        self.assertEqual(self.counts(), (1, 1))
+        pending = Comment.objects.get(pk=pending.pk)
+        pending.approved = True
+        pending.save()
+        self.assertEqual(self.counts(), (2, 0))
+        Comment.objects.get(pk=approved.pk).delete()
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_bulk_approval(self):
+        for _ in range(3):
+            self.comment(approved=False)
+        self.assertEqual(Comment.objects.all().set_approved(True, batch_size=2), 3)
+        self.assertEqual(self.counts(), (3, 0))
+
+    def test_editing_an_approved_comment_invalidates(self):
+        comment = Comment.objects.get(pk=self.comment(content='First text').pk)
+        before = get_generation()
+        comment.content = 'Corrected text'
+        comment.save()
+        self.assertNotEqual(get_generation(), before)
+        self.assertEqual(self.counts(), (1, 0))
+
+    def test_saving_a_pending_comment_does_not_invalidate(self):
+        comment = Comment.objects.get(pk=self.comment(approved=False).pk)
+        before = get_generation()
+        comment.content = 'Still pending'
+        comment.save()
+        self.assertEqual(get_generation(), before)
+
+    def test_cached_page_shows_an_edited_comment(self):
+        comment = Comment.objects.get(pk=self.comment(content='First text').pk)
+        url = reverse('casestudy_detail', args=[self.casestudies[0].slug])
+        self.assertContains(self.client.get(url), 'First text')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'HIT')
+        comment.content = 'Corrected text'
+        comment.save()
+        response = self.client.get(url)
+        self.assertContains(response, 'Corrected text')
+        self.assertNotContains(response, 'First text')
+
+
+class ApiTests(CasestudyTestCase):
+
+    def test_sparse_fieldset(self):
+        response = self.client.get(
+            reverse('api_casestudy_item', args=[self.casestudies[0].slug]),
+            {'fields': 'slug,title'},
+        )
+        self.assertEqual(response.json()['slug'], self.casestudies[0].slug)
+        self.assertEqual(set(response.json()), {'slug', 'title', 'comments_url'})
+
+    def test_unknown_field_is_a_400(self):
+        response = self.client.get(reverse('api_casestudy_list'), {'fields': 'password'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_author_rename_changes_the_etag(self):
+        url = reverse('api_casestudy_comments', args=[self.casestudies[0].slug])
+        self.comment()
+        etag = self.client.get(url)['ETag']
+
+        # A login only touches last_login
+        self.client.force_login(self.user)
+        self.client.logout()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['author'], 'renamed')
+
+    def test_etag_revalidation(self):
+        url = reverse('api_casestudy_comments', args=[self.casestudies[0].slug])
+        comment = Comment.objects.get(pk=self.comment(content='First text').pk)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        comment.content = 'Corrected text'
+        comment.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Corrected text')
+
+
+def png_bytes(width, height):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (width, height), (200, 40, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class ResponsiveImageTests(SimpleTestCase):
+
+    def render(self, tag, **context):
+        return Template('{% load responsive_images %}' + tag).render(Context(context))
+
+    def image(self):
+        return Casestudy._meta.get_field('casestudyimage').to_python('sample.jpg')
+
+    def test_aspect_reserves_the_box_without_cropping(self):
+        html = self.render(
+            '{% responsive_image image alt="x" aspect=aspect %}',
+            image=self.image(), aspect='64:48',
+        )
+        self.assertIn('width="400"', html)
+        self.assertIn('height="300"', html)
+        self.assertIn('c_limit', html)
+        self.assertNotIn('c_fill', html)
+
+    def test_ratio_crops(self):
+        html = self.render(
+            '{% responsive_image image alt="x" ratio="16:9" width=800 %}',
+            image=self.image(),
+        )
+        self.assertIn('height="450"', html)
+        self.assertIn('c_fill', html)
+
+    def test_placeholder_image_falls_back_to_static(self):
+        html = self.render('{% responsive_image image alt="x" %}', image='placeholder')
+        self.assertIn('/static/images/default', html)
+
+
+class PlaceholderTests(SimpleTestCase):
+
+    def test_compute_placeholder(self):
+        uri, color, aspect = compute_placeholder(png_bytes(64, 48))
+        self.assertTrue(uri.startswith('data:image/'))
+        self.assertEqual(color, '#c82828')
+        self.assertEqual(aspect, '64:48')
+
+    def test_missing_aspect_is_computed_for_an_unchanged_image(self):
+        casestudy = Casestudy(
+            casestudyimage='sample.jpg', image_placeholder_for='sample.jpg',
+        )
+        with mock.patch('casestudy.placeholders.fetch_image', return_value=png_bytes(64, 40)):
+            fields = placeholder_fields(casestudy)
+        self.assertEqual(fields['image_aspect'], '64:40')
+        casestudy.image_aspect = fields['image_aspect']
+        self.assertIsNone(placeholder_fields(casestudy))
+
+
+class PlaceholderRefreshTests(CasestudyTestCase):
+
+    def test_saving_a_new_image_does_not_fetch_it(self):
+        casestudy = self.casestudies[0]
+        casestudy.casestudyimage = 'new-image.jpg'
+        with mock.patch('casestudy.placeholders.fetch_image') as fetch, \
+                mock.patch('casestudy.signals.refresh_placeholder_later') as later, \
+                self.captureOnCommitCallbacks(execute=True) as callbacks:
+            casestudy.save()
+            fetch.assert_not_called()
+            later.assert_not_called()
+        self.assertEqual(len(callbacks), 1)
+        later.assert_called_once_with(casestudy.pk)
+
+    def test_saving_other_fields_schedules_nothing(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.casestudies[1].save()
+        self.assertEqual(callbacks, [])
+
+    def test_refresh_placeholder(self):
+        casestudy = self.casestudies[0]
+        Casestudy.objects.filter(pk=casestudy.pk).update(casestudyimage='new-image.jpg')
+        before = get_generation()
+        with mock.patch('casestudy.placeholders.fetch_image', return_value=png_bytes(40, 30)):
+            refresh_placeholder(casestudy.pk)
+        casestudy.refresh_from_db()
+        self.assertEqual(casestudy.image_placeholder_for, 'new-image')
+        self.assertEqual(casestudy.image_aspect, '40:30')
+        self.assertNotEqual(get_generation(), before)
+
+    def test_a_save_refreshes_once_after_commit(self):
+        casestudy = self.casestudies[0]
+        casestudy.casestudyimage = 'new-image.jpg'
+        with mock.patch('casestudy.placeholders.refresh_placeholder') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                casestudy.save()
+                refresh.assert_not_called()
+            self.assertTrue(wait_for_refreshes(timeout=10))
+        refresh.assert_called_once_with(casestudy.pk)
+
+
+class PlaceholderQueueTests(SimpleTestCase):
+
+    def test_queued_case_studies_are_not_queued_again(self):
+        submitted = []
+
+        def submit(fn, pk):
+            submitted.append((fn, pk, Future()))
+            return submitted[-1][2]
+
+        executor = mock.Mock(submit=mock.Mock(side_effect=submit))
+        with mock.patch('casestudy.placeholders._get_executor', return_value=executor), \
+                mock.patch('casestudy.placeholders.refresh_placeholder') as refresh:
+            refresh_placeholder_later(1)
+            refresh_placeholder_later(1)
+            refresh_placeholder_later(2)
+            self.assertEqual([pk for _, pk, _ in submitted], [1, 2])
+            self.assertFalse(wait_for_refreshes(timeout=0))
+
+            for fn, pk, future in list(submitted):
+                fn(pk)
+                future.set_result(None)
+            self.assertEqual(refresh.call_count, 2)
+            self.assertTrue(wait_for_refreshes(timeout=0))
+
+            # Once its refresh has started, a case study can be queued again
+            refresh_placeholder_later(1)
+            self.assertEqual(len(submitted), 3)
+            fn, pk, future = submitted[-1]
+            fn(pk)
+            future.set_result(None)
+
+
+class UploadCloudinaryTests(CasestudyTestCase):
+
+    def test_local_upload_links_case_studies_through_save(self):
+        self.casestudies[4].slug = 'floating-roof-storage-system'
+        self.casestudies[4].save()
+        with tempfile.TemporaryDirectory() as source, tempfile.TemporaryDirectory() as target:
+            for name, size in [('study-03.png', (4, 4)), ('Floating-Roof.png', (6, 4)),
+                               ('unrelated-screenshot.png', (8, 4)), ('default.png', (2, 2))]:
+                with open(os.path.join(source, name), 'wb') as f:
+                    f.write(png_bytes(*size))
+            before = get_generation()
+            with mock.patch('casestudy.signals.refresh_placeholder_later') as later, \
+                    self.captureOnCommitCallbacks(execute=True):
+                call_command(
+                    'upload_cloudinary', source=source, uploader='local', local_dir=target,
+                    manifest=os.path.join(target, 'manifest.json'), stdout=io.StringIO(),
+                )
+            self.assertTrue(os.path.exists(os.path.join(target, 'case_studies', 'study-03.png')))
+        self.assertEqual(str(Casestudy.objects.get(slug='study-03').casestudyimage),
+                         'case_studies/study-03')
+        self.assertEqual(str(Casestudy.objects.get(pk=self.casestudies[4].pk).casestudyimage),
+                         'case_studies/Floating-Roof')
+        self.assertFalse(Casestudy.objects.filter(
+            casestudyimage__contains='unrelated').exists())
+        self.assertNotEqual(get_generation(), before)
+        self.assertCountEqual(
+            [c.args[0] for c in later.call_args_list],
+            [self.casestudies[3].pk, self.casestudies[4].pk],
+        )
+
+
+class BenchmarkFixtureTests(CasestudyTestCase):
+
+    def test_cleanup_removes_the_temporary_user(self):
+        fixture = Fixture(sample_size=3)
+        self.assertTrue(fixture.user.is_superuser)
+        self.assertFalse(fixture.user.has_usable_password())
+        fixture.prepare_comments(2)
+        fixture.cleanup()
+        self.assertFalse(User.objects.filter(pk=fixture.user.pk).exists())
+        self.assertFalse(Comment.objects.filter(content__startswith='Benchmark').exists())
+        self.assertTrue(User.objects.filter(username='commenter').exists())
+
+
+class AsyncUrls:
+    """The URLs ``coreflowepc/asgi.py`` serves (``ASYNC_VIEWS``)."""
+    urlpatterns = [
+        path('', AsyncCasestudyList.as_view(), name='home'),
+        path('case-study/<slug:slug>/', casestudy_detail_async, name='casestudy_detail'),
+        path('', include('coreflowepc.urls')),
+    ]
+
+
+@override_settings(ROOT_URLCONF=AsyncUrls)
+class AsyncViewTests(CasestudyTestCase):
+    """The ASGI profile, through the async client and middleware stack."""
+
+    async def test_list_is_served_then_cached(self):
+        first = await self.async_client.get(reverse('home'))
+        self.assertEqual(first.status_code, 200)
+        self.assertContains(first, 'Study 03')
+        self.assertNotContains(first, 'Study 04')
+        self.assertEqual(first['X-Page-Cache'], 'MISS')
+        second = await self.async_client.get(reverse('home'))
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+
+    async def test_list_follows_the_cursor(self):
+        first = await self.async_client.get(reverse('home'))
+        cursor = first.context['page_obj'].next_cursor
+        self.assertIsNotNone(cursor)
+        second = await self.async_client.get(reverse('home'), {'cursor': cursor})
+        titles = {c.title for c in first.context['object_list']}
+        self.assertFalse(titles & {c.title for c in second.context['object_list']})
+        self.assertEqual((await self.async_client.get(
+            reverse('home'), {'cursor': 'garbage'})).status_code, 404)
+
+    async def test_detail_shows_approved_comments(self):
+        await sync_to_async(self.comment)(content='Approved remark')
+        await sync_to_async(self.comment)(approved=False, content='Pending remark')
+        response = await self.async_client.get(
+            reverse('casestudy_detail', args=['study-00']))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Study 00')
+        self.assertContains(response, 'Approved remark')
+        self.assertNotContains(response, 'Pending remark')
+        self.assertIn('Last-Modified', response)
+        missing = await self.async_client.get(reverse('casestudy_detail', args=['nope']))
+        self.assertEqual(missing.status_code, 404)
+
+    async def test_facet_counts_match_the_sync_version(self):
+        queryset = Casestudy.objects.all()
+        expected = await sync_to_async(facet_counts)(queryset)
+        await sync_to_async(cache.clear)()
+        self.assertEqual(await afacet_counts(queryset), expected)
+        self.assertEqual(expected['industry'], [(self.industry.pk, 'Energy', 10)])
+
+    def test_asgi_application(self):
+        from django.core.handlers.asgi import ASGIHandler
+
+        from coreflowepc.asgi import application
+        self.assertIsInstance(application, ASGIHandler)
+
+
+class CursorPaginationTests(CasestudyTestCase):
+
+    def test_pages_walk_forward_and_back(self):
+        paginator = CursorPaginator(Casestudy.objects.order_by('title'), 3)
+        titles, cursor, pages = [], None, []
+        while True:
+            page = paginator.page(cursor)
+            pages.append(page)
+            titles += [c.title for c in page]
+            cursor = page.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(titles, [f'Study {n:02d}' for n in range(10)])
+        self.assertEqual([len(p) for p in pages], [3, 3, 3, 1])
+        self.assertFalse(pages[0].has_previous())
+        back = paginator.page(pages[2].previous_cursor)
+        self.assertEqual([c.title for c in back], [c.title for c in pages[1]])
+        self.assertTrue(back.has_next())
+
+    def test_pages_need_no_offset_or_count(self):
+        paginator = CursorPaginator(Casestudy.objects.order_by('title'), 3)
+        cursor = paginator.page().next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            paginator.page(cursor)
+        self.assertEqual(len(queries), 1)
+        sql = queries[0]['sql'].upper()
+        self.assertNotIn('OFFSET', sql)
+        self.assertNotIn('COUNT(', sql)
+
+    def test_invalid_cursors(self):
+        paginator = CursorPaginator(Casestudy.objects.order_by('title'), 3)
+        for cursor in ('garbage', 'WyJ4IixbXV0', 'WyJuIixbMV1d'):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(cursor)
+        self.assertEqual(self.client.get(reverse('home'), {'cursor': 'garbage'}).status_code, 404)
+
+    def test_list_links_to_the_next_page(self):
+        first = self.client.get(reverse('home'))
+        next_cursor = first.context['page_obj'].next_cursor
+        self.assertContains(first, f'?cursor={next_cursor}')
+        second = self.client.get(reverse('home'), {'cursor': next_cursor})
+        self.assertContains(second, 'Study 04')
+        self.assertNotContains(second, 'Study 03')
+
+
+class InvalidationTests(CasestudyTestCase):
+
+    def test_saving_listing_content_bumps_the_generation(self):
+        for instance in (self.casestudies[0], self.client_, self.location, self.industry):
+            before = get_generation()
+            instance.save()
+            self.assertNotEqual(get_generation(), before, instance)
+        before = get_generation()
+        self.casestudies[9].delete()
+        self.assertNotEqual(get_generation(), before)
+
+    def test_cached_list_shows_an_edit_at_once(self):
+        self.assertContains(self.client.get(reverse('home')), 'Study 00')
+        casestudy = self.casestudies[0]
+        casestudy.title = 'Study 00 revised'
+        casestudy.save()
+        self.assertContains(self.client.get(reverse('home')), 'Study 00 revised')
+
+    def test_industry_rename_reaches_the_cached_cards(self):
+        self.client.get(reverse('home'))
+        self.industry.industry = 'Renewables'
+        self.industry.save()
+        self.assertContains(self.client.get(reverse('home')), 'Renewables')
+
+
+@override_settings(COMMENTS_PER_PAGE=3)
+class CommentThreadTests(CasestudyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for n in range(5):
+            self.comment(content=f'Approved {n}')
+        self.comment(approved=False, content='My pending')
+        other = User.objects.create_user('other', password='secret-pass')
+        Comment.objects.create(
+            casestudy=self.casestudies[0], author=other, content='Their pending',
+        )
+        self.url = reverse('comment_list', args=[self.casestudies[0].slug])
+
+    def next_url(self, response):
+        match = re.search(r'data-url="([^"]+)"', response.content.decode())
+        return match and match.group(1).replace('&amp;', '&')
+
+    def test_load_more_walks_the_thread_newest_first(self):
+        first = self.client.get(self.url)
+        self.assertEqual(
+            re.findall(r'Approved \d', first.content.decode()),
+            ['Approved 4', 'Approved 3', 'Approved 2'],
+        )
+        self.assertNotContains(first, 'pending')
+
+        second = self.client.get(self.next_url(first))
+        self.assertEqual(
+            re.findall(r'Approved \d', second.content.decode()), ['Approved 1', 'Approved 0'],
+        )
+        self.assertIsNone(self.next_url(second))
+        self.assertNotContains(second, 'No comments yet')
+
+    def test_authors_see_their_own_pending_comments(self):
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertContains(response, 'My pending')
+        self.assertNotContains(response, 'Their pending')
+
+    def test_detail_page_shows_the_first_page(self):
+        response = self.client.get(reverse('casestudy_detail', args=[self.casestudies[0].slug]))
+        self.assertContains(response, 'Approved 4')
+        self.assertNotContains(response, 'Approved 1')
+        self.assertContains(response, 'Load more comments')
+
+    def test_invalid_cursor_is_a_404(self):
+        self.assertEqual(self.client.get(self.url, {'cursor': 'junk'}).status_code, 404)
+
+
+@override_settings(SERVER_TIMING_STAFF=False)
+class ModerationTests(CasestudyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        for n in range(5):
+            self.comment(
+                casestudy=self.casestudies[n % 2], approved=False,
+                content=f'Pending {n} ' + 'x' * 60,
+            )
+        self.admin = User.objects.create_superuser('moderator', password='secret-pass')
+
+    def test_set_approved_in_batches(self):
+        before = get_generation()
+        self.assertEqual(Comment.objects.all().set_approved(True, batch_size=2), 5)
+        self.assertNotEqual(get_generation(), before)
+        counts = Casestudy.objects.filter(slug__in=['study-00', 'study-01']).order_by(
+            'slug').values_list('approved_comment_count', 'pending_comment_count')
+        self.assertEqual(list(counts), [(3, 0), (2, 0)])
+
+        before = get_generation()
+        self.assertEqual(Comment.objects.all().set_approved(True), 0)
+        self.assertEqual(get_generation(), before)
+
+    def test_capped_count(self):
+        with mock.patch.object(CappedCountPaginator, 'max_count', 3):
+            paginator = CappedCountPaginator(Comment.objects.order_by('pk'), 2)
+            self.assertEqual(paginator.count, 3)
+            self.assertTrue(paginator.truncated)
+            self.assertEqual(paginator.num_pages, 2)
+
+    def test_changelist_defers_the_content(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            reverse('admin:casestudy_comment_changelist'), {'approved__exact': '0'},
+        )
+        self.assertEqual(response.status_code, 200)
+        comments = response.context['cl'].result_list
+        self.assertEqual(len(comments), 5)
+        self.assertIn('content', comments[0].get_deferred_fields())
+        self.assertContains(response, 'Pending 0 ' + 'x' * 40 + '...')
+
+    def test_approve_action(self):
+        self.client.force_login(self.admin)
+        pks = list(Comment.objects.values_list('pk', flat=True)[:2])
+        response = self.client.post(
+            reverse('admin:casestudy_comment_changelist'),
+            {'action': 'approve_comments', '_selected_action': pks}, follow=True,
+        )
+        self.assertContains(response, '2 comments were successfully approved')
+        self.assertEqual(Comment.objects.filter(approved=True).count(), 2)
+
+
+@query_budget(queries=2, duplicates=3)
+def budgeted_view(request):
+    for casestudy in Casestudy.objects.all():
+        casestudy.client.client
+    return HttpResponse('ok')
+
+
+def excerpt_view(request):
+    return HttpResponse(str(Casestudy.objects.filter(excerpt=request.GET['q']).count()))
+
+
+class BudgetUrls:
+    urlpatterns = [
+        path('budgeted/', budgeted_view),
+        path('excerpt/', excerpt_view),
+    ]
+
+
+@override_settings(ROOT_URLCONF=BudgetUrls)
+class QueryBudgetTests(CasestudyTestCase):
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_strict_mode_raises(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'likely N+1: 10x'):
+            self.client.get('/budgeted/')
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_lenient_mode_logs(self):
+        with self.assertLogs('coreflowepc.middleware', 'WARNING') as logs:
+            response = self.client.get('/budgeted/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('11 queries (budget 2)', logs.output[0])
+
+    def test_the_test_runner_is_strict(self):
+        self.assertTrue(settings.QUERY_BUDGET_STRICT)
+
+
+@override_settings(
+    ROOT_URLCONF=BudgetUrls, QUERY_BUDGET_STRICT=False, SLOW_QUERY_THRESHOLD_MS=0,
+)
+class SlowQueryLogTests(CasestudyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.log = os.path.join(directory.name, 'slow.ndjson')
+
+    def get(self, url):
+        with override_settings(SLOW_QUERY_LOG=self.log):
+            with self.assertLogs('coreflowepc.middleware', 'WARNING'):
+                self.client.get(url)
+        with open(self.log, encoding='utf-8') as log:
+            records = [json.loads(line) for line in log]
+        return [r for r in records if 'excerpt' in r['sql']]
+
+    def test_params_are_redacted_by_default(self):
+        [record] = self.get('/excerpt/?q=secret@example.com')
+        self.assertEqual(record['view'], 'casestudy.tests.excerpt_view')
+        self.assertEqual(record['params'], [None])
+        self.assertNotIn('secret', json.dumps(record))
+
+    @override_settings(SLOW_QUERY_LOG_PARAMS=True)
+    def test_params_can_be_logged(self):
+        [record] = self.get('/excerpt/?q=Retrofit 1')
+        self.assertEqual(record['params'], ['Retrofit 1'])
+
+    def test_advise_indexes_suggests_a_missing_index(self):
+        self.get('/excerpt/?q=Retrofit 1')
+        out = io.StringIO()
+        call_command('advise_indexes', log=self.log, stdout=out)
+        output = out.getvalue()
+        self.assertIn('full scan of casestudy_casestudy: suggest index on (excerpt)', output)
+        self.assertIn("models.Index(fields=['excerpt']", output)
+
+    def test_advise_indexes_without_a_log(self):
+        with self.assertRaisesMessage(CommandError, 'does not exist'):
+            call_command('advise_indexes', log=self.log, stdout=io.StringIO())
+
+
+class SearchTests(CasestudyTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.wind = cls.casestudies[2]
+        cls.wind.description = '<p>Offshore wind &amp; turbines</p>'
+        cls.wind.save()
+
+    def titles(self, query):
+        return sorted(c.title for c in search(Casestudy.objects.all(), query))
+
+    def test_matches_stems_and_prefixes(self):
+        self.assertEqual(self.titles('turbine'), ['Study 02'])
+        self.assertEqual(self.titles('offsh'), ['Study 02'])
+        self.assertEqual(len(self.titles('retrofitting')), 10)
+        self.assertEqual(self.titles('nonexistent'), [])
+        self.assertEqual(len(self.titles('')), 10)
+
+    def test_index_follows_saves_and_deletes(self):
+        casestudy = self.casestudies[5]
+        casestudy.excerpt = 'Geothermal loop'
+        casestudy.save()
+        self.assertEqual(self.titles('geothermal'), ['Study 05'])
+        casestudy.delete()
+        self.assertEqual(self.titles('geothermal'), [])
+
+    def test_list_filters_by_query_and_facet(self):
+        other = Industry.objects.create(industry='Mining')
+        Casestudy.objects.filter(pk=self.casestudies[7].pk).update(industry=other)
+        response = self.client.get(reverse('home'), {'q': 'turbines'})
+        self.assertEqual([c.title for c in response.context['object_list']], ['Study 02'])
+        response = self.client.get(reverse('home'), {'industry': other.pk})
+        self.assertEqual([c.title for c in response.context['object_list']], ['Study 07'])
+
+    def test_facet_counts(self):
+        other = Location.objects.create(location='Leeds')
+        Casestudy.objects.filter(pk__in=[c.pk for c in self.casestudies[:3]]).update(location=other)
+        facets = facet_counts(Casestudy.objects.all())
+        self.assertEqual(facets['location'], [(other.pk, 'Leeds', 3), (self.location.pk, 'London', 7)])
+        self.assertEqual(facet_counts(Casestudy.objects.none())['client'], [])
+
+
+class SessionTests(TestCase):
+
+    def test_small_session_lives_in_the_cookie(self):
+        store = sessions.SessionStore()
+        store['colour'] = 'blue'
+        with self.assertNumQueries(0):
+            store.save()
+        self.assertTrue(sessions.is_signed(store.session_key))
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(sessions.SessionStore(store.session_key)['colour'], 'blue')
+
+    def test_large_session_spills_to_the_database(self):
+        store = sessions.SessionStore()
+        store['blob'] = os.urandom(3000).hex()
+        store.save()
+        self.assertFalse(sessions.is_signed(store.session_key))
+        self.assertTrue(Session.objects.filter(session_key=store.session_key).exists())
+        loaded = sessions.SessionStore(store.session_key)
+        self.assertEqual(loaded['blob'], store['blob'])
+        with self.assertNumQueries(0):
+            loaded.save()
+
+    def test_tampered_cookie_is_an_empty_session(self):
+        store = sessions.SessionStore()
+        store['user'] = 'alice'
+        store.save()
+        forged = signing.dumps({'user': 'admin'}, salt='other', compress=True)
+        for key in (store.session_key[:-2] + 'xx', forged):
+            loaded = sessions.SessionStore(key)
+            self.assertEqual(dict(loaded.items()), {})
+            self.assertIsNone(loaded.session_key)
+
+    def test_unchanged_cookie_session_is_re_signed(self):
+        with mock.patch('django.core.signing.time.time', return_value=time.time() - 3600):
+            store = sessions.SessionStore()
+            store['colour'] = 'blue'
+            store.save()
+        loaded = sessions.SessionStore(store.session_key)
+        self.assertEqual(loaded['colour'], 'blue')
+        loaded.save()
+        self.assertNotEqual(loaded.session_key, store.session_key)
+        self.assertEqual(sessions.SessionStore(loaded.session_key)['colour'], 'blue')
+
+    def test_login_is_stored_server_side(self):
+        User.objects.create_user('reader', password='secret-pass')
+        self.assertTrue(self.client.login(username='reader', password='secret-pass'))
+        key = self.client.cookies['sessionid'].value
+        self.assertFalse(sessions.is_signed(key))
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+
+    def test_logout_revokes_the_old_cookie(self):
+        User.objects.create_user('reader', password='secret-pass')
+        self.client.login(username='reader', password='secret-pass')
+        key = self.client.cookies['sessionid'].value
+        response = self.client.post(reverse('account_logout'))
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Session.objects.filter(session_key=key).exists())
+
+        # Replaying the logged-in cookie no longer authenticates
+        self.client.cookies['sessionid'] = key
+        response = self.client.get(reverse('healthz'))
+        self.assertFalse(response.wsgi_request.user.is_authenticated)
+
+
+class LoadCaseStudyDataTests(CasestudyTestCase):
+
+    records = [
+        {'title': 'Geothermal Plant', 'slug': 'geothermal-plant', 'client': 'Acme',
+         'location': 'Reykjavik', 'industry': 'Energy', 'description': '<p>Steam</p>'},
+        {'title': 'Study 00 (revised)', 'slug': 'study-00', 'client': 'Acme',
+         'location': 'London', 'industry': 'Energy', 'description': '<p>Revised</p>',
+         'excerpt': 'Revised'},
+        {'title': 'No slug', 'client': 'Acme', 'location': 'London',
+         'industry': 'Energy', 'description': '<p>Skipped</p>'},
+        {'title': 'Tidal Array', 'slug': 'tidal-array', 'client': 'Tidal Co',
+         'location': 'Orkney', 'industry': 'Marine', 'description': '<p>Tides</p>'},
+    ]
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        return path
+
+    def load(self, *args):
+        out = io.StringIO()
+        call_command('load_case_study_data', *args, stdout=out)
+        return out.getvalue()
+
+    def test_upserts_by_slug(self):
+        comment = self.comment()
+        path = self.write('data.ndjson', ''.join(json.dumps(r) + '\n' for r in self.records))
+        output = self.load(path, '--batch-size', '2')
+        self.assertIn('Loaded 3 case studies (2 created, 1 updated, 1 skipped)', output)
+        self.assertIn('record 3: missing slug', output)
+
+        revised = Casestudy.objects.get(slug='study-00')
+        self.assertEqual((revised.title, revised.excerpt), ('Study 00 (revised)', 'Revised'))
+        self.assertEqual(revised.pk, self.casestudies[0].pk)
+        self.assertTrue(Comment.objects.filter(pk=comment.pk).exists())
+        self.assertEqual(Casestudy.objects.get(slug='tidal-array').client.client, 'Tidal Co')
+        self.assertEqual(Client.objects.filter(client='Acme').count(), 1)
+        self.assertEqual(
+            list(search(Casestudy.objects.all(), 'geothermal').values_list('slug', flat=True)),
+            ['geothermal-plant'],
+        )
+
+        # Loading the same file again changes nothing but updated_on
+        output = self.load(path)
+        self.assertIn('(0 created, 3 updated, 1 skipped)', output)
+        self.assertEqual(Casestudy.objects.count(), 12)
+
+    def test_json_and_csv(self):
+        path = self.write('data.json', json.dumps(self.records[:2], indent=2))
+        self.assertIn('(1 created, 1 updated, 0 skipped)', self.load(path))
+
+        rows = ['title,slug,client,location,industry,description']
+        rows.append('Tidal Array,tidal-array,Tidal Co,Orkney,Marine,<p>Tides</p>')
+        path = self.write('data.csv', '\r\n'.join(rows) + '\r\n')
+        self.assertIn('(1 created, 0 updated, 0 skipped)', self.load(path))
+
+    def test_json_array_is_streamed(self):
+        text = json.dumps([{'a': 1}, 12345, 'text', [1, 2]])
+        self.assertEqual(
+            list(iter_json_array(io.StringIO(text), chunk_size=3)),
+            [{'a': 1}, 12345, 'text', [1, 2]],
+        )
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"a": 1}, '), chunk_size=3))
+
+    def test_bad_input(self):
+        with self.assertRaisesMessage(CommandError, 'Cannot guess the format'):
+            self.load(self.write('data.txt', ''))
+        with self.assertRaisesMessage(CommandError, 'Invalid input'):
+            self.load(self.write('data.json', '{"title": "not an array"}'))
+
+
+class CollectMediaTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.base = directory.name
+        self.media = os.path.join(self.base, 'media')
+        self.uploads = os.path.join(self.base, 'static', 'uploads')
+        override = override_settings(BASE_DIR=self.base, MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.write('a.png', b'first image')
+        self.write('cases/b.png', b'second image')
+
+    def write(self, name, data):
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def collect(self, *args):
+        out = io.StringIO()
+        call_command('collectmedia', *args, stdout=out)
+        return out.getvalue()
+
+    def test_incremental_sync(self):
+        output = self.collect()
+        self.assertIn('2 files (23B) copied [2 hardlinked', output)
+        self.assertEqual(
+            os.stat(os.path.join(self.uploads, 'a.png')).st_ino,
+            os.stat(os.path.join(self.media, 'a.png')).st_ino,
+        )
+        with open(os.path.join(self.uploads, '.collectmedia-manifest.json')) as f:
+            self.assertEqual(sorted(json.load(f)), ['a.png', 'cases/b.png'])
+
+        self.assertIn('0 files (0B) copied', self.collect())
+
+        # A touched file is re-hashed but not copied; a changed one is
+        path = os.path.join(self.media, 'a.png')
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        output = self.collect()
+        self.assertIn('0 files (0B) copied', output)
+        self.assertIn('2 unchanged', output)
+        self.write('cases/b.png', b'second image, edited')
+        output = self.collect()
+        self.assertIn('Copied: cases/b.png', output)
+        self.assertIn('1 files (20B) copied', output)
+
+    def test_copies_without_links(self):
+        self.collect('--no-link')
+        self.assertNotEqual(
+            os.stat(os.path.join(self.uploads, 'a.png')).st_ino,
+            os.stat(os.path.join(self.media, 'a.png')).st_ino,
+        )
+        with open(os.path.join(self.uploads, 'cases', 'b.png'), 'rb') as f:
+            self.assertEqual(f.read(), b'second image')
+
+    def test_orphans(self):
+        self.collect()
+        os.remove(os.path.join(self.media, 'cases', 'b.png'))
+        self.assertIn('0 orphans deleted', self.collect('--keep-orphans'))
+        self.assertTrue(os.path.exists(os.path.join(self.uploads, 'cases', 'b.png')))
+
+        output = self.collect()
+        self.assertIn('Deleted: cases/b.png', output)
+        self.assertIn('1 orphans deleted (12B)', output)
+        self.assertFalse(os.path.exists(os.path.join(self.uploads, 'cases')))
+        self.assertTrue(os.path.exists(os.path.join(self.uploads, 'a.png')))
+
+
+class OptimizeStaticTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        override = override_settings(STATICFILES_DIRS=[self.root])
+        override.enable()
+        self.addCleanup(override.disable)
+        # Names no source file mentions (this one included)
+        self.tag = 'asset-' + os.urandom(4).hex()
+
+        from PIL import Image
+        buffer = io.BytesIO()
+        Image.new('RGB', (64, 64), (200, 30, 30)).save(buffer, 'PNG', compress_level=0)
+        self.logo = buffer.getvalue()
+        self.write('images/{}-logo.png', self.logo)
+        self.write('images/{}-logo.0123456789ab.png', self.logo)
+        self.write('images/{}-copy.png', self.logo)
+        self.write('images/{}-unused.png', png_bytes(8, 8))
+        self.write('uploads/{}-upload.png', png_bytes(4, 4))
+        self.write('css/{}.css', self.name('.logo {{ background: url(../images/{}-logo.png); }}').encode())
+
+    def name(self, pattern):
+        return pattern.format(self.tag)
+
+    def write(self, pattern, data):
+        path = os.path.join(self.root, self.name(pattern))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, pattern):
+        with open(os.path.join(self.root, self.name(pattern)), 'rb') as f:
+            return f.read()
+
+    def optimize(self, *args):
+        out = io.StringIO()
+        # No template links the test stylesheet
+        call_command('optimize_static', '--keep', 'css/', *args, stdout=out)
+        return out.getvalue()
+
+    def test_recompresses_and_prunes_the_served_set(self):
+        from PIL import Image
+        output = self.optimize()
+        self.assertIn(self.name('Recompressed: images/{}-logo.png'), output)
+        self.assertIn('3 files', output)
+        optimized = self.read('images/{}-logo.png')
+        self.assertLess(len(optimized), len(self.logo))
+        self.assertEqual(
+            Image.open(io.BytesIO(optimized)).tobytes(),
+            Image.open(io.BytesIO(self.logo)).tobytes(),
+        )
+        self.assertEqual(load_manifest(self.root)['excluded'], [
+            self.name('images/{}-copy.png'),
+            self.name('images/{}-logo.0123456789ab.png'),
+            self.name('images/{}-unused.png'),
+        ])
+
+        # Already optimized images are not looked at again
+        self.assertIn('0 images checked', self.optimize())
+
+        finder = ServedSetFinder()
+        # collectstatic's default ignore patterns
+        listed = finder.list(['CVS', '.*', '*~'])
+        self.assertEqual(sorted(path for path, _ in listed), [
+            self.name('css/{}.css'),
+            self.name('images/{}-logo.png'),
+            self.name('uploads/{}-upload.png'),
+        ])
+        # Excluded files still resolve in development
+        self.assertTrue(finder.find(self.name('images/{}-unused.png')))
+
+    def test_dry_run_writes_nothing(self):
+        self.optimize('--dry-run')
+        self.assertFalse(os.path.exists(os.path.join(self.root, EXCLUDE_MANIFEST)))
+        self.assertEqual(self.read('images/{}-logo.png'), self.logo)
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class CriticalCssTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(CRITICAL_CSS_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        critical_css._load.cache_clear()
+        self.addCleanup(critical_css._load.cache_clear)
+        with open(os.path.join(directory.name, 'manifest.json'), 'w') as f:
+            json.dump({'stylesheets': ['css/style.css'], 'templates': ['test/page.html']}, f)
+        with open(os.path.join(directory.name, 'test__page.css'), 'w') as f:
+            f.write('.hero{content:"</style>"}')
+
+    def render(self, name):
+        return Template('{% load critical_css %}{% critical_css %}', name=name).render(Context())
+
+    def test_built_template(self):
+        html = self.render('test/page.html')
+        self.assertIn('<style>.hero{content:"<\\/style>"}</style>', html)
+        self.assertIn(
+            '<link rel="preload" href="/static/css/style.css" as="style" '
+            'onload="this.onload=null;this.rel=\'stylesheet\'">'
+            '<noscript><link rel="stylesheet" href="/static/css/style.css"></noscript>',
+            html,
+        )
+        # Not covered by the build: still render-blocking
+        self.assertIn('<link rel="stylesheet" href="https://cdn.jsdelivr.net/', html)
+        # Never extracted: always loaded without blocking
+        self.assertIn('<link rel="preload" href="https://fonts.googleapis.com/', html)
+
+    def test_template_without_a_build(self):
+        html = self.render('test/other.html')
+        self.assertNotIn('<style>', html)
+        self.assertIn('<link rel="stylesheet" href="/static/css/style.css">', html)
+
+    def test_extract_keeps_rules_for_the_fold(self):
+        elements = critical_css.fold_elements(
+            '<body><div class="a"><span class="logo"></span></div></body>'
+        )
+        css = (
+            '.a{color:red} .b{color:blue} @media (max-width:1px){.a{margin:0} .c{x:1}} '
+            '.logo{background:url(img/x.png)}'
+        )
+        self.assertEqual(
+            critical_css.extract(css, elements, base_url='/static/css/'),
+            '.a{color:red}\n@media (max-width:1px){.a{margin:0}}\n'
+            '.logo{background:url(/static/css/img/x.png)}',
+        )
+
+
+class ServerTimingTests(CasestudyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.staff = User.objects.create_user('staff', password='secret-pass', is_staff=True)
+        self.url = reverse('casestudy_detail', args=[self.casestudies[0].slug])
+
+    def test_staff_get_the_header_and_a_log_line(self):
+        self.client.force_login(self.staff)
+        with self.assertLogs('coreflowepc.timing', 'INFO') as logs:
+            response = self.client.get(self.url)
+        header = response['Server-Timing']
+        for name in ('total', 'db', 'template', 'session'):
+            self.assertRegex(header, rf'(^|, ){name};dur=\d+\.\d')
+        self.assertRegex(header, r'db;dur=[\d.]+;desc="\d+ queries"')
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'casestudy_detail')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(record['path'], self.url)
+        self.assertGreater(record['queries'], 0)
+        self.assertIn('total_ms', record)
+
+    def test_the_cache_line_matches_the_logged_counts(self):
+        self.client.force_login(self.staff)
+        with self.assertLogs('coreflowepc.timing', 'INFO') as logs:
+            response = self.client.get(self.url)
+        record = json.loads(logs.records[0].getMessage())
+        self.assertGreater(record['cache_l1_hits'] + record['cache_l2_hits'] + record['cache_misses'], 0)
+        self.assertIn(
+            f'desc="{record["cache_l1_hits"]} L1 hits, '
+            f'{record["cache_l2_hits"]} L2 hits, {record["cache_misses"]} misses"',
+            response['Server-Timing'],
+        )
+
+    def test_anonymous_requests_are_not_timed_by_default(self):
+        with self.assertNoLogs('coreflowepc.timing'):
+            response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+    def test_sampled_anonymous_requests_are_timed(self):
+        with self.assertLogs('coreflowepc.timing', 'INFO'):
+            response = self.client.get(self.url)
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(SERVER_TIMING_STAFF=False)
+    def test_staff_timing_can_be_switched_off(self):
+        self.client.force_login(self.staff)
+        with self.assertNoLogs('coreflowepc.timing'):
+            response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+
+
+class WarmupTests(CasestudyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(WARMUP_MARKER=os.path.join(directory.name, 'warm'))
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_healthz_answers_without_a_warm_up(self):
+        response = self.client.get(reverse('healthz'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ok'})
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertEqual(self.client.post(reverse('healthz')).status_code, 405)
+
+    def test_readyz_waits_for_warm_cache(self):
+        response = self.client.get(reverse('readyz'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'status': 'warming'})
+
+        out = io.StringIO()
+        call_command('warm_cache', stdout=out)
+        # 3 list pages of 4 and 10 case studies
+        self.assertIn('Warmed 13 pages', out.getvalue())
+        self.assertIn('(13 rendered, 0 already cached)', out.getvalue())
+
+        response = self.client.get(reverse('readyz'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['warmed_at'], warmed_at())
+
+    def test_warm_cache_fills_the_page_cache(self):
+        call_command('warm_cache', '--list-pages', '1', '--details', '2', stdout=io.StringIO())
+        for slug in ('study-00', 'study-01'):
+            response = self.client.get(reverse('casestudy_detail', args=[slug]))
+            self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertEqual(self.client.get(reverse('home'))['X-Page-Cache'], 'HIT')
+        response = self.client.get(reverse('casestudy_detail', args=['study-02']))
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+
+        out = io.StringIO()
+        call_command('warm_cache', '--list-pages', '1', '--details', '3', stdout=out)
+        self.assertIn('(0 rendered, 4 already cached)', out.getvalue())
+
+    def test_readyz_needs_the_database(self):
+        mark_warm()
+        with mock.patch('coreflowepc.health.connection') as db:
+            db.ensure_connection.side_effect = DatabaseError
+            response = self.client.get(reverse('readyz'))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'status': 'database unavailable'})
+
+    def test_clear_warm(self):
+        mark_warm()
+        self.assertIsNotNone(warmed_at())
+        clear_warm()
+        self.assertIsNone(warmed_at())
+        # Nothing to clear is fine too
+        clear_warm()
+
+    def test_warm_process_compiles_the_templates(self):
+        self.assertGreater(warm_process(), 0)
+
+    def gunicorn_config(self):
+        return runpy.run_path(os.path.join(settings.BASE_DIR, 'gunicorn.conf.py'))
+
+    def test_gunicorn_starts_unready_and_warms_when_ready(self):
+        config = self.gunicorn_config()
+        self.assertTrue(config['preload_app'])
+        mark_warm()
+        config['on_starting'](mock.Mock())
+        self.assertIsNone(warmed_at())
+
+        server = mock.Mock()
+        server.cfg.preload_app = True
+        with mock.patch('coreflowepc.warmup.warm_process', return_value=7) as warm, \
+                mock.patch.object(connections, 'close_all') as close_all, \
+                mock.patch('gc.freeze'), \
+                mock.patch('subprocess.Popen') as popen, \
+                mock.patch.dict(os.environ, {'WARM_CACHE_ON_START': '1'}):
+            config['when_ready'](server)
+        warm.assert_called_once_with()
+        close_all.assert_called_once_with()
+        server.log.info.assert_called_once_with('Warmed process: %d templates compiled', 7)
+        args, kwargs = popen.call_args
+        self.assertEqual(args[0][1:], ['manage.py', 'warm_cache'])
+        self.assertEqual(kwargs['cwd'], str(settings.BASE_DIR))
+
+    def test_gunicorn_cache_warm_up_can_be_switched_off(self):
+        config = self.gunicorn_config()
+        server = mock.Mock()
+        server.cfg.preload_app = False
+        with mock.patch('coreflowepc.warmup.warm_process') as warm, \
+                mock.patch('gc.freeze'), \
+                mock.patch('subprocess.Popen') as popen, \
+                mock.patch.dict(os.environ, {'WARM_CACHE_ON_START': '0'}):
+            config['when_ready'](server)
+        warm.assert_not_called()
+        popen.assert_not_called()
+
+
+class CommentJsonTests(CasestudyTestCase):
+    """The JSON answers comments.js gets instead of redirects."""
+
+    ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+
+    def setUp(self):
+        super().setUp()
+        self.casestudy = self.casestudies[0]
+        self.other = User.objects.create_user('other', password='secret-pass')
+
+    def url(self, name, *args):
+        return reverse(name, args=[self.casestudy.slug, *args])
+
+    def test_post_needs_a_login(self):
+        response = self.client.post(
+            self.url('casestudy_detail'), {'content': 'Hello'}, **self.ajax,
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(response.json()['ok'])
+        self.assertFalse(Comment.objects.exists())
+
+    def test_post_returns_the_rendered_comment_and_counts(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            self.url('casestudy_detail'), {'content': 'Nice retrofit'}, **self.ajax,
+        )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        comment = Comment.objects.get()
+        self.assertTrue(data['ok'])
+        self.assertEqual(data['comment_id'], comment.pk)
+        self.assertIn('Nice retrofit', data['html'])
+        self.assertEqual(data['approved_comment_count'], 0)
+        self.assertEqual(data['pending_comment_count'], 1)
+
+    def test_invalid_post_returns_the_errors(self):
+        self.client.force_login(self.user)
+        response = self.client.post(
+            self.url('casestudy_detail'), {'content': ''}, **self.ajax,
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('content', response.json()['errors'])
+
+    def test_edit(self):
+        comment = self.comment()
+        self.client.force_login(self.user)
+        response = self.client.post(
+            self.url('comment_edit', comment.pk), {'content': 'Edited'}, **self.ajax,
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertIn('Edited', data['html'])
+        self.assertEqual(
+            (data['approved_comment_count'], data['pending_comment_count']), (0, 1),
+        )
+        comment.refresh_from_db()
+        self.assertFalse(comment.approved)
+
+    def test_edit_someone_elses_comment(self):
+        comment = self.comment()
+        self.client.force_login(self.other)
+        response = self.client.post(
+            self.url('comment_edit', comment.pk), {'content': 'Edited'}, **self.ajax,
+        )
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['comment_id'], comment.pk)
+        comment.refresh_from_db()
+        self.assertEqual(comment.content, 'Great work')
+
+    def test_invalid_edit(self):
+        comment = self.comment()
+        self.client.force_login(self.user)
+        response = self.client.post(
+            self.url('comment_edit', comment.pk), {'content': ''}, **self.ajax,
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('content', response.json()['errors'])
+
+    def test_delete(self):
+        comment = self.comment()
+        self.client.force_login(self.user)
+        response = self.client.post(self.url('comment_delete', comment.pk), **self.ajax)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['comment_id'], comment.pk)
+        self.assertEqual(data['approved_comment_count'], 0)
+        self.assertFalse(Comment.objects.exists())
+
+    def test_delete_someone_elses_comment(self):
+        comment = self.comment()
+        self.client.force_login(self.other)
+        response = self.client.post(self.url('comment_delete', comment.pk), **self.ajax)
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Comment.objects.exists())
+
+    def test_delete_must_be_a_post(self):
+        comment = self.comment()
+        self.client.force_login(self.user)
+        response = self.client.get(self.url('comment_delete', comment.pk), **self.ajax)
+        self.assertEqual(response.status_code, 405)
+        self.assertTrue(Comment.objects.exists())
+
+
+@override_settings(SERVER_TIMING_STAFF=False)
+class ExportTests(CasestudyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.comment(content='=HYPERLINK("http://evil.example")')
+        self.comment(casestudy=self.casestudies[1], approved=False, content='Pending')
+        self.staff = User.objects.create_user('staff', password='secret-pass', is_staff=True)
+
+    def export(self, kind, fmt, **params):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('export', args=[kind, fmt]), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_escapes_formulas(self):
+        response, body = self.export('comments', 'csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="comments-', response['Content-Disposition'])
+        rows = list(csv.reader(io.StringIO(body)))
+        self.assertEqual(rows[0], ['id', 'casestudy', 'author', 'content', 'approved', 'created_on'])
+        self.assertEqual(rows[1][3], '\'=HYPERLINK("http://evil.example")')
+        self.assertEqual(len(rows), 3)
+
+    def test_ndjson_with_filters(self):
+        response, body = self.export('comments', 'ndjson', approved='no')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        [row] = [json.loads(line) for line in body.splitlines()]
+        self.assertEqual((row['casestudy'], row['content']), ('study-01', 'Pending'))
+
+        _, body = self.export('casestudies', 'ndjson', since='2999-01-01')
+        self.assertEqual(body, '')
+
+    def test_bad_filter_and_staff_only(self):
+        response = self.client.get(reverse('export', args=['comments', 'csv']))
+        self.assertEqual(response.status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get(
+            reverse('export', args=['casestudies', 'csv']), {'approved': 'yes'},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        out = io.StringIO()
+        call_command(
+            'export_data', 'comments', format='ndjson', approved='yes', stdout=out,
+        )
+        [row] = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(row['casestudy'], 'study-00')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'casestudies.csv')
+            out = io.StringIO()
+            call_command('export_data', 'casestudies', output=path, stdout=out)
+            with open(path, encoding='utf-8', newline='') as f:
+                self.assertEqual(len(list(csv.reader(f))), 11)
+        self.assertIn('Exported 10 casestudies', out.getvalue())
+
+        with self.assertRaisesMessage(CommandError, 'since must be a date'):
+            call_command('export_data', 'comments', since='soon', stdout=io.StringIO())
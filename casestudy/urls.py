@@ -1,10 +1,24 @@
-from . import views
+from . import api, export, views
+from django.conf import settings
 from django.urls import path
 
+# The ASGI entry point (coreflowepc/asgi.py) turns on the async versions
+if settings.ASYNC_VIEWS:
+    casestudy_list = views.AsyncCasestudyList.as_view()
+    casestudy_detail = views.casestudy_detail_async
+else:
+    casestudy_list = views.CasestudyList.as_view()
+    casestudy_detail = views.casestudy_detail
+
 urlpatterns = [
-    path('', views.CasestudyList.as_view(), name='home'),
-    path('case-study/<slug:slug>/', views.casestudy_detail, name='casestudy_detail'),
+    path('', casestudy_list, name='home'),
+    path('case-study/<slug:slug>/', casestudy_detail, name='casestudy_detail'),
+    path('case-study/<slug:slug>/comments/', views.comment_list, name='comment_list'),
     path('case-study/<slug:slug>/edit_comment/<int:comment_id>/', views.comment_edit, name='comment_edit'),
     path('case-study/<slug:slug>/delete_comment/<int:comment_id>/', views.comment_delete, name='comment_delete'),
+    path('api/v1/casestudies/', api.casestudy_list, name='api_casestudy_list'),
+    path('api/v1/casestudies/<slug:slug>/', api.casestudy_item, name='api_casestudy_item'),
+    path('api/v1/casestudies/<slug:slug>/comments/', api.casestudy_comments, name='api_casestudy_comments'),
+    path('export/<slug:kind>.<slug:fmt>', export.export, name='export'),
     path('debug-session/', views.debug_session, name='debug_session'),
 ]
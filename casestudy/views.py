@@ -1,4 +1,27 @@
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth import logout
+from django.db.models import Q
+from django.http import Http404, HttpResponse, HttpResponseRedirect, JsonResponse
+from django.shortcuts import render, get_object_or_404, reverse, redirect
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views import generic
+from django.views.decorators.cache import cache_control, cache_page
+from django.views.decorators.vary import vary_on_headers
+
+from coreflowepc.middleware import query_budget
+
+from .caching import aget_generation, fragment_timeout, get_generation
+from .forms import CommentForm
+from .models import Casestudy, Comment
+from .page_cache import anonymous_page_cache
+from .pagination import CursorPaginator, InvalidCursor
+from .search import FACETS, afacet_counts, facet_counts, search
+
 
 # Debug view to print session and user info
 def debug_session(request):
@@ -9,37 +32,200 @@ def debug_session(request):
         f"session items: {dict(request.session.items())}",
     ]
     return HttpResponse("<br>".join(info))
-from django.shortcuts import render, get_object_or_404, reverse, redirect
-from django.views import generic
-from django.contrib import messages
-from django.contrib.auth import logout
-from django.http import HttpResponseRedirect
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
-from django.views.decorators.vary import vary_on_headers
-from .models import Casestudy, Comment
-from .forms import CommentForm
-
 
 
-from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_control, cache_page
-from django.views.decorators.vary import vary_on_headers
-
+@method_decorator(anonymous_page_cache, name='dispatch')
 class CasestudyList(generic.ListView):
     queryset = Casestudy.objects.select_related('client', 'location', 'industry').order_by("title")
     template_name = "casestudy/index.html"
     paginate_by = 4
     context_object_name = "casestudy_list"
+    # Session + user + facets + one page of case studies (QueryBudgetMiddleware)
+    query_budget = {'queries': 6, 'time_ms': 100, 'duplicates': 1}
+    # Keyset pagination on (title, id): deep pages cost the same as page 1
+    cursor_ordering = ('title', 'id')
+    cursor_kwarg = 'cursor'
 
     # Remove per-user cache control to allow full-page caching
 
+    def get_queryset(self):
+        """Apply the full-text query (?q=) and facet filters."""
+        queryset = search(super().get_queryset(), self.request.GET.get("q"))
+        for name, _ in FACETS:
+            value = self.request.GET.get(name, "")
+            if value.isdigit():
+                queryset = queryset.filter(**{f"{name}_id": value})
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        Paginate by opaque cursor instead of page number.
+
+        Avoids the COUNT(*) and OFFSET scan of Django's default Paginator.
+        Invalid cursors raise a 404 just like invalid page numbers do.
+        """
+        paginator = CursorPaginator(
+            queryset, page_size, ordering=self.cursor_ordering
+        )
+        cursor = self.request.GET.get(self.cursor_kwarg) or None
+        try:
+            page = paginator.page(cursor)
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(self.listing_context(
+            get_generation(), facet_counts(self.object_list)
+        ))
+        return context
+
+    def listing_context(self, generation, facets):
+        """Search, facet and cache context; no queries of its own."""
+        context = {}
+        # Versioned fragment cache: edits bump the generation, so the
+        # cards can be cached for hours without going stale
+        context["cache_generation"] = generation
+        context["cache_timeout"] = fragment_timeout()
+        context["facets"] = facets
+        context["search_query"] = self.request.GET.get("q", "")
+        params = self.request.GET.copy()
+        params.pop(self.cursor_kwarg, None)
+        selected = {}
+        for name, _ in FACETS:
+            value = params.get(name, "")
+            selected[name] = int(value) if value.isdigit() else None
+        context["selected_facets"] = selected
+        # Carried through pagination links and the fragment cache key
+        context["query_string"] = params.urlencode()
+        return context
+
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        updated = [casestudy.updated_on for casestudy in context["object_list"]]
+        if updated:
+            response["Last-Modified"] = http_date(max(updated).timestamp())
+        return response
+
+
+class AsyncCasestudyList(CasestudyList):
+    """
+    ``CasestudyList`` for the ASGI deployment (``coreflowepc/asgi.py``).
+
+    Same template and context, but the page and the facet counts are
+    fetched through the async ORM and the cache's async API, so the
+    worker's event loop serves other connections while they run. The
+    template is rendered in a thread by Django, as it can still query.
+    """
+
+    @method_decorator(anonymous_page_cache)
+    async def dispatch(self, request, *args, **kwargs):
+        # Skip CasestudyList.dispatch, already wrapped by the sync cache
+        return await generic.View.dispatch(self, request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        # The search backend checks its table the first time it is used
+        self.object_list = await sync_to_async(self.get_queryset)()
+        paginator, page, object_list, is_paginated = await self.apaginate_queryset(
+            self.object_list, self.get_paginate_by(self.object_list)
+        )
+        context = {
+            "paginator": paginator,
+            "page_obj": page,
+            "is_paginated": is_paginated,
+            "object_list": object_list,
+            self.context_object_name: object_list,
+            "view": self,
+        }
+        context.update(self.listing_context(
+            await aget_generation(), await afacet_counts(self.object_list)
+        ))
+        return self.render_to_response(context)
+
+    async def apaginate_queryset(self, queryset, page_size):
+        """Async version of ``CasestudyList.paginate_queryset``."""
+        paginator = CursorPaginator(
+            queryset, page_size, ordering=self.cursor_ordering
+        )
+        cursor = self.request.GET.get(self.cursor_kwarg) or None
+        try:
+            page = await paginator.apage(cursor)
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
+
 
 class CasestudyDetail(generic.DetailView):
     model = Casestudy
     template_name = "casestudy/casestudy_detail.html"
 
 
+def _visible_comments(request, casestudy):
+    """Approved comments plus the current user's own pending comments."""
+    comments = casestudy.comments.select_related('author')
+    if request.user.is_authenticated:
+        return comments.filter(
+            Q(approved=True) | Q(author=request.user, approved=False)
+        )
+    return comments.filter(approved=True)
+
+
+def _comment_page(request, casestudy):
+    """
+    Return one cursor page of visible comments, newest first.
+
+    Keyed on (created_on, id) so memory and latency stay flat however
+    long the discussion grows.
+    """
+    paginator = CursorPaginator(
+        _visible_comments(request, casestudy),
+        settings.COMMENTS_PER_PAGE,
+        ordering=('-created_on', '-id'),
+    )
+    try:
+        return paginator.page(request.GET.get('cursor') or None)
+    except InvalidCursor as e:
+        raise Http404(str(e))
+
+
+def _is_ajax(request):
+    """True for requests from comments.js, which expect JSON back."""
+    return request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+
+def _comment_json(request, message, status=200, casestudy=None,
+                  comment=None, comment_id=None, errors=None):
+    """
+    Answer a comments.js request instead of redirecting.
+
+    Carries the message to show, the case study's current comment counts
+    and, for a new or edited comment, its rendered block, so the page can
+    be updated in place without re-rendering every comment.
+    """
+    data = {'ok': status < 400, 'message': message}
+    if casestudy is not None:
+        # The counters are updated with F() expressions; read them back
+        data.update(
+            Casestudy.objects.filter(pk=casestudy.pk)
+            .values('approved_comment_count', 'pending_comment_count').get()
+        )
+    if comment is not None:
+        data['comment_id'] = comment.pk
+        data['html'] = render_to_string(
+            "casestudy/includes/comment.html",
+            {"comment": comment},
+            request=request,
+        )
+    elif comment_id is not None:
+        data['comment_id'] = comment_id
+    if errors is not None:
+        data['errors'] = errors
+    return JsonResponse(data, status=status)
+
+
+@query_budget(queries=8, time_ms=150)
+@anonymous_page_cache
 def casestudy_detail(request, slug):
     """
     Display an individual case study with comments and comment form.
@@ -47,24 +233,17 @@ def casestudy_detail(request, slug):
     """
     queryset = Casestudy.objects.select_related(
         'client', 'location', 'industry'
-    ).prefetch_related('comments').all()
+    )
     casestudy = get_object_or_404(queryset, slug=slug)
-    
-    # Show approved comments + user's own pending comments
-    if request.user.is_authenticated:
-        from django.db.models import Q
-        comments = casestudy.comments.select_related('author').filter(
-            Q(approved=True) | Q(author=request.user, approved=False)
-        ).order_by("-created_on")
-    else:
-        comments = casestudy.comments.select_related('author').filter(
-            approved=True
-        ).order_by("-created_on")
-    
-    comment_count = casestudy.comments.filter(approved=True).count()
+    comment_count = casestudy.approved_comment_count
 
     if request.method == "POST":
         if not request.user.is_authenticated:
+            if _is_ajax(request):
+                return _comment_json(
+                    request, 'You must be logged in to submit a comment.',
+                    status=403,
+                )
             messages.add_message(
                 request,
                 messages.WARNING,
@@ -79,29 +258,40 @@ def casestudy_detail(request, slug):
                 comment.author = request.user
                 comment.casestudy = casestudy
                 comment.save()
-                messages.add_message(
-                    request,
-                    messages.SUCCESS,
+                message = (
                     f'Your comment has been submitted successfully! It will '
                     f'be reviewed by our team and published once approved. '
                     f'Thank you for contributing to the discussion about '
                     f'"{casestudy.title}".'
                 )
+                if _is_ajax(request):
+                    return _comment_json(
+                        request, message, status=201,
+                        casestudy=casestudy, comment=comment,
+                    )
+                messages.add_message(request, messages.SUCCESS, message)
                 # Clear the form by redirecting to the same page
                 return HttpResponseRedirect(
                     reverse('casestudy_detail', args=[slug])
                 )
             else:
-                messages.add_message(
-                    request,
-                    messages.ERROR,
+                message = (
                     'There was an error submitting your comment. Please '
                     'check your input and try again.'
                 )
+                if _is_ajax(request):
+                    return _comment_json(
+                        request, message, status=400,
+                        errors=comment_form.errors.get_json_data(),
+                    )
+                messages.add_message(request, messages.ERROR, message)
     else:
         comment_form = CommentForm()
 
-    return render(
+    # Show approved comments + user's own pending comments, one page at a time
+    comments = _comment_page(request, casestudy)
+
+    response = render(
         request,
         "casestudy/casestudy_detail.html",
         {
@@ -111,14 +301,90 @@ def casestudy_detail(request, slug):
             "comment_form": comment_form
         }
     )
+    last_modified = casestudy.updated_on
+    if comments and comments[0].created_on > last_modified:
+        last_modified = comments[0].created_on
+    response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+@query_budget(queries=8, time_ms=150)
+@anonymous_page_cache
+async def casestudy_detail_async(request, slug):
+    """
+    ``casestudy_detail`` for the ASGI deployment (``coreflowepc/asgi.py``).
+
+    GET fetches the case study and the first page of comments through the
+    async ORM and leaves rendering to Django, which does it in a thread.
+    Comment POSTs are rare and go to the sync view.
+    """
+    if request.method == "POST":
+        return await sync_to_async(casestudy_detail)(request, slug)
 
+    queryset = Casestudy.objects.select_related(
+        'client', 'location', 'industry'
+    )
+    try:
+        casestudy = await queryset.aget(slug=slug)
+    except Casestudy.DoesNotExist:
+        raise Http404("No Casestudy matches the given query.")
+    # Resolve the lazy user (session, then a query) before the comment
+    # queryset filters on it
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    paginator = CursorPaginator(
+        _visible_comments(request, casestudy),
+        settings.COMMENTS_PER_PAGE,
+        ordering=('-created_on', '-id'),
+    )
+    try:
+        comments = await paginator.apage(request.GET.get('cursor') or None)
+    except InvalidCursor as e:
+        raise Http404(str(e))
 
+    response = TemplateResponse(
+        request,
+        "casestudy/casestudy_detail.html",
+        {
+            "casestudy": casestudy,
+            "comments": comments,
+            "comment_count": casestudy.approved_comment_count,
+            "comment_form": CommentForm(),
+        }
+    )
+    last_modified = casestudy.updated_on
+    if comments and comments[0].created_on > last_modified:
+        last_modified = comments[0].created_on
+    response["Last-Modified"] = http_date(last_modified.timestamp())
+    return response
+
+
+@query_budget(queries=5, time_ms=100)
+@anonymous_page_cache
+def comment_list(request, slug):
+    """
+    Return the next page of comments as an HTML fragment.
+
+    Used by the "Load more" button on the case study detail page.
+    """
+    casestudy = get_object_or_404(Casestudy.objects.only('id', 'slug'), slug=slug)
+    return render(
+        request,
+        "casestudy/includes/comment_list.html",
+        {
+            "casestudy": casestudy,
+            "comments": _comment_page(request, casestudy),
+        }
+    )
+
+
+@query_budget(queries=10, time_ms=150)
 def comment_edit(request, slug, comment_id):
     """
     View to edit comments.
 
     Allows authenticated users to edit their own comments.
-    Edited comments require re-approval.
+    Edited comments require re-approval. Requests from comments.js get
+    the re-rendered comment back as JSON instead of a redirect.
     """
     if request.method == "POST":
         queryset = Casestudy.objects.all()
@@ -131,56 +397,68 @@ def comment_edit(request, slug, comment_id):
             comment.casestudy = casestudy
             comment.approved = False  # Re-approval required after edit
             comment.save()
-            messages.add_message(
-                request,
-                messages.SUCCESS,
+            message = (
                 'Your comment has been updated successfully! The updated '
                 'comment will be reviewed again and published once approved.'
             )
+            if _is_ajax(request):
+                return _comment_json(
+                    request, message, casestudy=casestudy, comment=comment
+                )
+            messages.add_message(request, messages.SUCCESS, message)
         else:
             if comment.author != request.user:
-                messages.add_message(
-                    request,
-                    messages.ERROR,
-                    'Permission denied: You can only edit your own comments.'
-                )
+                message = 'Permission denied: You can only edit your own comments.'
+                status = 403
             else:
-                messages.add_message(
-                    request,
-                    messages.ERROR,
+                message = (
                     'There was an error updating your comment. Please '
                     'check your input and try again.'
                 )
+                status = 400
+            if _is_ajax(request):
+                return _comment_json(
+                    request, message, status=status, comment_id=comment_id,
+                    errors=comment_form.errors.get_json_data(),
+                )
+            messages.add_message(request, messages.ERROR, message)
 
     return HttpResponseRedirect(reverse('casestudy_detail', args=[slug]))
 
 
+@query_budget(queries=10, time_ms=150)
 def comment_delete(request, slug, comment_id):
     """
     View to delete comment.
     Allows authenticated users to delete their own comments.
-    Deletion is permanent and cannot be undone.
+    Deletion is permanent and cannot be undone. Requests from
+    comments.js must be POSTs and get JSON back instead of a redirect.
     """
     queryset = Casestudy.objects.all()
     casestudy = get_object_or_404(queryset, slug=slug)
     comment = get_object_or_404(Comment, pk=comment_id)
+    ajax = _is_ajax(request)
+    if ajax and request.method != "POST":
+        return _comment_json(request, 'Use POST to delete a comment.', status=405)
 
     if comment.author == request.user:
         comment.delete()
-        messages.add_message(
-            request,
-            messages.SUCCESS,
+        message = (
             f'Your comment has been permanently deleted from the '
             f'discussion about "{casestudy.title}". This action '
             f'cannot be undone.'
         )
+        if ajax:
+            return _comment_json(
+                request, message, casestudy=casestudy, comment_id=comment_id
+            )
+        messages.add_message(request, messages.SUCCESS, message)
     else:
-        messages.add_message(
-            request,
-            messages.ERROR,
-            'Permission denied: You can only delete your own comments!'
-        )
+        message = 'Permission denied: You can only delete your own comments!'
+        if ajax:
+            return _comment_json(
+                request, message, status=403, comment_id=comment_id
+            )
+        messages.add_message(request, messages.ERROR, message)
 
     return HttpResponseRedirect(reverse('casestudy_detail', args=[slug]))
-
-
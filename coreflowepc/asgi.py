@@ -3,6 +3,15 @@ ASGI config for coreflowepc project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+This is the async deployment profile: the home and case study pages use
+their async views (``ASYNC_VIEWS``) and every middleware runs natively
+async, so one worker holds many slow connections on its event loop
+instead of one thread each. Serve it with uvicorn workers under gunicorn::
+
+    gunicorn coreflowepc.asgi:application -k uvicorn.workers.UvicornWorker
+
+``manage.py benchmark_servers`` compares it with the sync WSGI workers.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -12,5 +21,6 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'coreflowepc.settings')
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,439 @@
+"""
+Two-tier cache backend for coreflowepc.
+
+``LocMemCache`` gives every gunicorn worker its own private cache, so each
+worker warms separately and never sees the invalidations made by the
+others. ``TieredCache`` keeps a small in-process LRU (L1) in front of a
+SQLite file shared by every worker on the dyno (L2), so it needs no
+external service.
+
+Coherence: every write or delete appends the key to an invalidation log in
+L2 whose autoincrement sequence acts as a global generation number. Each
+process remembers the last sequence it has seen and, at most every
+``SYNC_INTERVAL`` seconds, evicts the L1 entries that were invalidated
+elsewhere since then.
+
+Statistics: ``stats()`` returns this process's L1 hits, L2 hits and
+misses, and every lookup made during a request is also reported to
+``coreflowepc.timing`` for the ``Server-Timing`` header.
+
+Single-flight: ``get_or_set()`` coalesces concurrent misses on the same
+key. The first thread in a process registers an in-flight event for the
+key that the others wait on, and processes take a short lease row in L2,
+so N simultaneous misses run the callable once. No lock is held while the
+callable runs, so it may itself call ``get_or_set()`` (a page render
+computing facets, counts, ...); a thread asking again for a key it is
+already computing computes it directly, and every wait gives up after
+``LEASE_TIMEOUT`` seconds and computes the value itself.
+
+Example settings::
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'coreflowepc.cache.TieredCache',
+            'LOCATION': '/tmp/coreflowepc-cache.sqlite3',
+            'OPTIONS': {'L1_MAX_ENTRIES': 1000, 'SYNC_INTERVAL': 0.5},
+        }
+    }
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .timing import record_cache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache_entries ('
+    ' key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_entries_expires'
+    ' ON cache_entries (expires)',
+    'CREATE TABLE IF NOT EXISTS cache_invalidations ('
+    ' seq INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT)',
+    'CREATE TABLE IF NOT EXISTS cache_leases ('
+    ' key TEXT PRIMARY KEY, expires REAL NOT NULL)',
+)
+
+
+class TieredCache(BaseCache):
+    """In-process LRU (L1) in front of a shared SQLite file (L2)."""
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self._sync_interval = float(options.get('SYNC_INTERVAL', 0.5))
+        self._lease_timeout = float(options.get('LEASE_TIMEOUT', 30))
+        self._log_size = int(options.get('INVALIDATION_LOG_SIZE', 10000))
+        self._l1 = OrderedDict()
+        self._l1_lock = threading.RLock()
+        # In-flight computations: key -> (owner thread id, Event)
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._local = threading.local()
+        self._seen_seq = None
+        self._synced_at = 0.0
+        self._writes = 0
+        self._stats = Counter()
+
+    # -- L2 plumbing -------------------------------------------------------
+
+    def _connection(self):
+        """Return a SQLite connection for this thread and process."""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=10,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _write(self, statements):
+        """
+        Run ``statements`` in one write transaction.
+
+        Each entry is ``(sql, params)``. Returns the cursors so callers can
+        inspect ``rowcount``/``lastrowid``.
+        """
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursors = [conn.execute(sql, params) for sql, params in statements]
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        self._writes += 1
+        if self._writes % 500 == 0:
+            self._cull()
+        return cursors
+
+    def _invalidate(self, key):
+        return ('INSERT INTO cache_invalidations (key) VALUES (?)', (key,))
+
+    def _cull(self):
+        """Drop expired rows and trim the invalidation log."""
+        now = time.time()
+        conn = self._connection()
+        conn.execute('DELETE FROM cache_entries WHERE expires <= ?', (now,))
+        conn.execute('DELETE FROM cache_leases WHERE expires <= ?', (now,))
+        conn.execute(
+            'DELETE FROM cache_invalidations WHERE seq <= '
+            '(SELECT MAX(seq) FROM cache_invalidations) - ?',
+            (self._log_size,)
+        )
+        max_entries = self._max_entries
+        count = conn.execute('SELECT COUNT(*) FROM cache_entries').fetchone()[0]
+        if count > max_entries:
+            conn.execute(
+                'DELETE FROM cache_entries WHERE key IN (SELECT key FROM '
+                'cache_entries ORDER BY expires IS NULL, expires LIMIT ?)',
+                (count - max_entries + max_entries // self._cull_frequency,)
+            )
+
+    # -- L1 plumbing -------------------------------------------------------
+
+    def _sync(self, force=False):
+        """Evict L1 entries invalidated by other processes."""
+        now = time.monotonic()
+        if not force and now - self._synced_at < self._sync_interval:
+            return
+        self._synced_at = now
+        conn = self._connection()
+        if self._seen_seq is None:
+            row = conn.execute(
+                'SELECT MAX(seq) FROM cache_invalidations').fetchone()
+            with self._l1_lock:
+                self._seen_seq = row[0] or 0
+                self._l1.clear()
+            return
+        rows = conn.execute(
+            'SELECT seq, key FROM cache_invalidations WHERE seq > ? '
+            'ORDER BY seq', (self._seen_seq,)
+        ).fetchall()
+        if not rows:
+            return
+        with self._l1_lock:
+            if rows[0][0] > self._seen_seq + 1:
+                oldest = conn.execute(
+                    'SELECT MIN(seq) FROM cache_invalidations').fetchone()[0]
+                if oldest > self._seen_seq + 1:
+                    # Log was trimmed past us: we may have missed entries
+                    self._l1.clear()
+            for seq, key in rows:
+                if key is None:
+                    self._l1.clear()
+                else:
+                    self._l1.pop(key, None)
+            self._seen_seq = rows[-1][0]
+
+    def _l1_get(self, key):
+        with self._l1_lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return None
+            if entry[1] is not None and entry[1] <= time.time():
+                del self._l1[key]
+                return None
+            self._l1.move_to_end(key)
+            return entry[0]
+
+    def _l1_set(self, key, blob, expires, seq):
+        """Fill L1 unless an invalidation newer than ``seq`` was applied."""
+        with self._l1_lock:
+            if self._seen_seq is None or seq < self._seen_seq:
+                self._l1.pop(key, None)
+                return
+            self._l1[key] = (blob, expires)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self._l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _dumps(self, value):
+        return zlib.compress(pickle.dumps(value, self.pickle_protocol), 1)
+
+    def _loads(self, blob):
+        return pickle.loads(zlib.decompress(blob))
+
+    # -- Cache API ---------------------------------------------------------
+
+    def _get_blob(self, key):
+        """Return the pickled value for an already-made key, or ``None``."""
+        start = time.perf_counter()
+        blob, tier = self._lookup(key)
+        self._stats[f'{tier}_hits' if tier else 'misses'] += 1
+        record_cache(tier, time.perf_counter() - start)
+        return blob
+
+    def _lookup(self, key):
+        """Return ``(blob, 'l1' | 'l2')``, or ``(None, None)`` on a miss."""
+        self._sync()
+        blob = self._l1_get(key)
+        if blob is not None:
+            return blob, 'l1'
+        conn = self._connection()
+        # One read transaction: the row and the log position are consistent
+        conn.execute('BEGIN')
+        try:
+            row = conn.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ?',
+                (key,)
+            ).fetchone()
+            seq = conn.execute(
+                'SELECT MAX(seq) FROM cache_invalidations').fetchone()[0] or 0
+        finally:
+            conn.execute('COMMIT')
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None, None
+        self._l1_set(key, row[0], row[1], seq)
+        return row[0], 'l2'
+
+    def stats(self):
+        """Lookups served by L1, by L2 and missed, in this process."""
+        stats = {name: self._stats[name] for name in ('l1_hits', 'l2_hits', 'misses')}
+        lookups = sum(stats.values())
+        stats['hit_ratio'] = (
+            (stats['l1_hits'] + stats['l2_hits']) / lookups if lookups else None
+        )
+        return stats
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        blob = self._get_blob(key)
+        if blob is None:
+            return default
+        return self._loads(blob)
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        return self._get_blob(key) is not None
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._set(key, self._dumps(value), self.get_backend_timeout(timeout))
+
+    def _set(self, key, blob, expires):
+        cursors = self._write([
+            ('INSERT OR REPLACE INTO cache_entries (key, value, expires) '
+             'VALUES (?, ?, ?)', (key, blob, expires)),
+            self._invalidate(key),
+        ])
+        self._sync(force=True)
+        self._l1_set(key, blob, expires, cursors[-1].lastrowid)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        blob = self._dumps(value)
+        expires = self.get_backend_timeout(timeout)
+        cursors = self._write([
+            ('DELETE FROM cache_entries WHERE key = ? AND expires <= ?',
+             (key, time.time())),
+            ('INSERT OR IGNORE INTO cache_entries (key, value, expires) '
+             'VALUES (?, ?, ?)', (key, blob, expires)),
+            # Like set(), log the write so other processes drop stale L1
+            # copies, but only if the insert happened
+            ('INSERT INTO cache_invalidations (key) SELECT ? WHERE changes() = 1',
+             (key,)),
+        ])
+        if cursors[1].rowcount != 1:
+            return False
+        self._sync(force=True)
+        self._l1_set(key, blob, expires, cursors[2].lastrowid)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursors = self._write([
+            ('UPDATE cache_entries SET expires = ? WHERE key = ? AND '
+             '(expires IS NULL OR expires > ?)',
+             (self.get_backend_timeout(timeout), key, time.time())),
+            self._invalidate(key),
+        ])
+        with self._l1_lock:
+            self._l1.pop(key, None)
+        return cursors[0].rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        cursors = self._write([
+            ('DELETE FROM cache_entries WHERE key = ?', (key,)),
+            self._invalidate(key),
+        ])
+        with self._l1_lock:
+            self._l1.pop(key, None)
+        return cursors[0].rowcount == 1
+
+    def incr(self, key, delta=1, version=None):
+        """Atomically add ``delta`` across every process sharing L2."""
+        key = self.make_and_validate_key(key, version=version)
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT value, expires FROM cache_entries WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is None or (row[1] is not None and row[1] <= time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            value = self._loads(row[0]) + delta
+            conn.execute(
+                'UPDATE cache_entries SET value = ? WHERE key = ?',
+                (self._dumps(value), key)
+            )
+            conn.execute(*self._invalidate(key))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        with self._l1_lock:
+            self._l1.pop(key, None)
+        return value
+
+    def clear(self):
+        self._write([
+            ('DELETE FROM cache_entries', ()),
+            ('DELETE FROM cache_leases', ()),
+            self._invalidate(None),
+        ])
+        with self._l1_lock:
+            self._l1.clear()
+
+    def close(self, **kwargs):
+        # Connections are per thread and reused across requests
+        pass
+
+    # -- Single-flight -----------------------------------------------------
+
+    def _acquire_lease(self, key):
+        now = time.time()
+        cursors = self._write([
+            ('DELETE FROM cache_leases WHERE key = ? AND expires <= ?',
+             (key, now)),
+            ('INSERT OR IGNORE INTO cache_leases (key, expires) '
+             'VALUES (?, ?)', (key, now + self._lease_timeout)),
+        ])
+        return cursors[-1].rowcount == 1
+
+    def _release_lease(self, key):
+        self._write([('DELETE FROM cache_leases WHERE key = ?', (key,))])
+
+    def get_or_set(self, key, default, timeout=DEFAULT_TIMEOUT, version=None):
+        """
+        Return the cached value, computing it at most once on a miss.
+
+        Concurrent callers missing the same key wait for the first one to
+        store its result instead of all running ``default``.
+        """
+        value = self.get(key, self._missing_key, version=version)
+        if value is not self._missing_key:
+            return value
+        made_key = self.make_and_validate_key(key, version=version)
+        me = threading.get_ident()
+        with self._flights_lock:
+            flight = self._flights.get(made_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[made_key] = (me, threading.Event())
+        owner, done = flight
+
+        if not leader:
+            if owner != me:
+                done.wait(self._lease_timeout)
+                value = self.get(key, self._missing_key, version=version)
+                if value is not self._missing_key:
+                    return value
+            # Re-entered by its own computation, or the leader failed or
+            # timed out: compute without coalescing
+            return self._compute(key, default, timeout, version)
+
+        try:
+            value = self.get(key, self._missing_key, version=version)
+            if value is not self._missing_key:
+                return value
+            leased = self._acquire_lease(made_key)
+            if not leased:
+                # Another process is computing it: wait for its result
+                deadline = time.monotonic() + self._lease_timeout
+                delay = 0.01
+                while time.monotonic() < deadline:
+                    time.sleep(delay)
+                    delay = min(delay * 2, 0.2)
+                    self._sync(force=True)
+                    value = self.get(key, self._missing_key, version=version)
+                    if value is not self._missing_key:
+                        return value
+                    if self._acquire_lease(made_key):
+                        leased = True
+                        break
+            try:
+                return self._compute(key, default, timeout, version)
+            finally:
+                if leased:
+                    self._release_lease(made_key)
+        finally:
+            with self._flights_lock:
+                del self._flights[made_key]
+            done.set()
+
+    def _compute(self, key, default, timeout, version):
+        if callable(default):
+            default = default()
+        if default is not None:
+            self.set(key, default, timeout=timeout, version=version)
+        return default
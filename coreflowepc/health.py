@@ -0,0 +1,38 @@
+"""
+Liveness and readiness endpoints for coreflowepc.
+
+``/healthz`` answers as soon as a worker can serve requests and looks at
+nothing else. ``/readyz`` answers 200 only once ``manage.py warm_cache``
+has filled the caches on this machine (gunicorn starts it when the server
+boots, see ``gunicorn.conf.py``) and the database accepts connections;
+until then it answers 503, so traffic can stay on the previous release.
+Neither touches the session, the cache or the templates.
+"""
+
+from django.db import DatabaseError, connection
+from django.http import JsonResponse
+from django.views.decorators.cache import never_cache
+from django.views.decorators.http import require_safe
+
+from .warmup import warmed_at
+
+
+@never_cache
+@require_safe
+def healthz(request):
+    """The process is up and serving requests."""
+    return JsonResponse({'status': 'ok'})
+
+
+@never_cache
+@require_safe
+def readyz(request):
+    """The caches are warm and the database is reachable."""
+    warmed = warmed_at()
+    if warmed is None:
+        return JsonResponse({'status': 'warming'}, status=503)
+    try:
+        connection.ensure_connection()
+    except DatabaseError:
+        return JsonResponse({'status': 'database unavailable'}, status=503)
+    return JsonResponse({'status': 'ready', 'warmed_at': warmed})
@@ -0,0 +1,416 @@
+"""
+Project middleware for coreflowepc.
+
+QueryBudgetMiddleware counts the ORM queries, total database time and
+repeated SQL shapes of every request through
+``connection.execute_wrapper`` and checks them against the budget declared
+on the view that handled it:
+
+- function views use the ``@query_budget(...)`` decorator;
+- class-based views set a ``query_budget`` dict attribute;
+- views under a URL namespace (e.g. ``admin``) can be given a budget in
+  ``settings.QUERY_BUDGETS``.
+
+The same SQL shape executed more than ``duplicates`` times in one request
+is reported as a likely N+1. With ``settings.QUERY_BUDGET_STRICT`` enabled
+(always under ``manage.py test``, see ``coreflowepc/test_runner.py``)
+query-count and N+1 violations raise ``QueryBudgetExceeded``; otherwise
+every violation is logged as a warning.
+Database time is always only logged, since it depends on the machine.
+
+Independently of budgets, every query slower than
+``settings.SLOW_QUERY_THRESHOLD_MS`` is logged and appended to the NDJSON
+file ``settings.SLOW_QUERY_LOG`` with its shape, duration and calling
+view. ``manage.py advise_indexes`` replays those queries with ``EXPLAIN``.
+Parameter values are left out (each is logged as ``null``) unless
+``settings.SLOW_QUERY_LOG_PARAMS`` is set, and even then only for
+``SELECT`` statements, so comment text, emails or session data never end
+up in the log.
+
+ServerTimingMiddleware breaks each request down into total, database
+(time and query count, from QueryBudgetMiddleware's collector), cache
+(time, L1/L2 hits and misses), template rendering and session loading
+time. For staff users (``settings.SERVER_TIMING_STAFF``) and a random
+``settings.SERVER_TIMING_SAMPLE_RATE`` fraction of requests the numbers
+are sent as a ``Server-Timing`` header, shown by browser devtools, and
+logged as one JSON line on the ``coreflowepc.timing`` logger.
+
+Every middleware here runs natively both under WSGI and under ASGI
+(``coreflowepc/asgi.py``): each sync-only layer makes Django hand the
+rest of the request to a thread. ``AsyncWhiteNoiseMiddleware`` is a
+drop-in async-capable ``WhiteNoiseMiddleware`` for the same reason.
+"""
+
+import datetime
+import json
+import logging
+import random
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+timing_logger = logging.getLogger('coreflowepc.timing')
+
+DEFAULT_DUPLICATES = 3
+
+# Collapse literal lists so "IN (%s, %s)" and "IN (%s)" share one shape
+_IN_LIST_RE = re.compile(r'\((?:%s|\?)(?:\s*,\s*(?:%s|\?))*\)')
+_NUMBER_RE = re.compile(r'\b\d+\b')
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a view goes over its query budget."""
+
+
+def query_budget(queries=None, time_ms=None, duplicates=DEFAULT_DUPLICATES):
+    """
+    Declare the query budget of a function view.
+
+    ``queries`` is the maximum number of queries, ``time_ms`` the maximum
+    total database time and ``duplicates`` how often one SQL shape may
+    repeat before it is reported as a likely N+1.
+    """
+    def decorator(view_func):
+        view_func.query_budget = {
+            'queries': queries,
+            'time_ms': time_ms,
+            'duplicates': duplicates,
+        }
+        return view_func
+    return decorator
+
+
+def sql_shape(sql):
+    """Normalize SQL so queries differing only in literals compare equal."""
+    return _NUMBER_RE.sub('N', _IN_LIST_RE.sub('(...)', sql))
+
+
+def _loggable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (datetime.date, datetime.datetime, datetime.time)):
+        return value.isoformat(' ')
+    return str(value)
+
+
+class QueryCollector:
+    """``execute_wrapper`` callable recording every query of a request."""
+
+    def __init__(self, slow_threshold=None):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+        self.slow_threshold = slow_threshold
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            self.shapes[sql_shape(sql)] += 1
+            if (self.slow_threshold is not None and not many
+                    and elapsed >= self.slow_threshold):
+                self.slow.append((sql, params, elapsed))
+
+
+class AsyncCapableMiddleware:
+    """
+    Base for middleware that runs natively under both WSGI and ASGI.
+
+    Subclasses implement ``__call__`` for the sync chain and ``acall``
+    for the async one; Django picks the chain when it builds the stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+
+class QueryBudgetMiddleware(AsyncCapableMiddleware):
+    """Check each request's queries against its view's declared budget."""
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        threshold = getattr(settings, 'SLOW_QUERY_THRESHOLD_MS', None)
+        self.slow_threshold = None if threshold is None else threshold / 1000
+        self.slow_log = getattr(settings, 'SLOW_QUERY_LOG', None)
+        self.log_params = getattr(settings, 'SLOW_QUERY_LOG_PARAMS', False)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        collector = QueryCollector(self.slow_threshold)
+        request._query_collector = collector
+        with self.collecting(collector):
+            response = self.get_response(request)
+        self.finish(request, collector)
+        return response
+
+    async def acall(self, request):
+        # Connections follow the request's context into the threads the
+        # async ORM runs queries in, so the wrappers still see every query
+        collector = QueryCollector(self.slow_threshold)
+        request._query_collector = collector
+        with self.collecting(collector):
+            response = await self.get_response(request)
+        self.finish(request, collector)
+        return response
+
+    def collecting(self, collector):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(collector))
+        return stack
+
+    def finish(self, request, collector):
+        if collector.slow:
+            self.log_slow_queries(request, collector.slow)
+        budget = getattr(request, '_query_budget', None)
+        if budget:
+            self.check_budget(request, budget, collector)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = self.budget_for(request, view_func)
+
+    def budget_for(self, request, view_func):
+        """Return the budget declared for ``view_func``, if any."""
+        budget = getattr(view_func, 'query_budget', None)
+        view_class = getattr(view_func, 'view_class', None)
+        if budget is None and view_class is not None:
+            budget = getattr(view_class, 'query_budget', None)
+        if budget is None:
+            match = request.resolver_match
+            budgets = getattr(settings, 'QUERY_BUDGETS', {})
+            if match is not None:
+                budget = budgets.get(match.view_name) or budgets.get(
+                    match.namespace
+                )
+        return budget
+
+    def log_slow_queries(self, request, slow):
+        """Log slow queries and append them to the slow-query file."""
+        match = request.resolver_match
+        view = match.view_name if match is not None else request.path
+        lines = []
+        for sql, params, elapsed in slow:
+            logger.warning('Slow query (%.1fms) in %s: %s',
+                           elapsed * 1000, view, sql[:200])
+            if not sql.lstrip().upper().startswith('SELECT'):
+                params = None
+            elif isinstance(params, dict):
+                params = {k: self.loggable(v) for k, v in params.items()}
+            else:
+                params = [self.loggable(p) for p in params or ()]
+            lines.append(json.dumps({
+                'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                'view': view,
+                'path': request.path,
+                'duration_ms': round(elapsed * 1000, 3),
+                'shape': sql_shape(sql),
+                'sql': sql,
+                'params': params,
+            }))
+        if not self.slow_log:
+            return
+        try:
+            with open(self.slow_log, 'a', encoding='utf-8') as log:
+                log.write('\n'.join(lines) + '\n')
+        except OSError:
+            logger.warning('Could not write slow query log %s', self.slow_log)
+
+    def loggable(self, value):
+        """A parameter value for the slow-query log, or None if redacted."""
+        return _loggable(value) if self.log_params else None
+
+    def check_budget(self, request, budget, collector):
+        """Log (or raise, in strict mode) every budget violation."""
+        problems = []
+        max_queries = budget.get('queries')
+        if max_queries is not None and collector.count > max_queries:
+            problems.append(
+                f'{collector.count} queries (budget {max_queries})'
+            )
+        max_duplicates = budget.get('duplicates', DEFAULT_DUPLICATES)
+        for shape, repeats in collector.shapes.most_common():
+            if max_duplicates is None or repeats <= max_duplicates:
+                break
+            problems.append(f'likely N+1: {repeats}x {shape[:200]}')
+
+        elapsed_ms = collector.duration * 1000
+        max_time = budget.get('time_ms')
+        if max_time is not None and elapsed_ms > max_time:
+            logger.warning(
+                'Query time budget exceeded on %s: %.1fms (budget %sms)',
+                request.path, elapsed_ms, max_time
+            )
+
+        if not problems:
+            return
+        message = 'Query budget exceeded on %s %s: %s' % (
+            request.method, request.path, '; '.join(problems)
+        )
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class ServerTimingMiddleware(AsyncCapableMiddleware):
+    """
+    Report where the time of a request went, as Server-Timing and a log line.
+
+    Goes right after ``SessionMiddleware``, so it can time the lazy
+    session load, and inside ``QueryBudgetMiddleware``, whose query
+    collector it reads.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.sample_rate = float(getattr(settings, 'SERVER_TIMING_SAMPLE_RATE', 0))
+        self.staff = getattr(settings, 'SERVER_TIMING_STAFF', True)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        timings, token, sampled = self.begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            timing.stop(token)
+        if sampled or self.is_staff(request):
+            self.report(request, response, timings)
+        return response
+
+    async def acall(self, request):
+        timings, token, sampled = self.begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            timing.stop(token)
+        # request.user may still need the session and a query
+        if sampled or await sync_to_async(self.is_staff)(request):
+            self.report(request, response, timings)
+        return response
+
+    def begin(self, request):
+        timings, token = timing.start()
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        session = getattr(request, 'session', None)
+        if session is not None:
+            self.time_session_load(session, timings)
+        return timings, token, sampled
+
+    def report(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        metrics = self.metrics(request, timings, total)
+        response['Server-Timing'] = self.header(metrics)
+        self.log(request, response, metrics, timings.counts)
+
+    def time_session_load(self, session, timings):
+        """Wrap the session's lazy ``load()`` to time it."""
+        load = session.load
+
+        def timed_load():
+            with timings.measure('session'):
+                return load()
+
+        session.load = timed_load
+
+    def is_staff(self, request):
+        if not self.staff:
+            return False
+        user = getattr(request, 'user', None)
+        return bool(user is not None and user.is_authenticated and user.is_staff)
+
+    def metrics(self, request, timings, total):
+        """Return ``[(name, milliseconds, description)]``."""
+        durations, counts = timings.durations, timings.counts
+        metrics = [('total', total * 1000, None)]
+        collector = getattr(request, '_query_collector', None)
+        if collector is not None:
+            metrics.append((
+                'db', collector.duration * 1000, f'{collector.count} queries'
+            ))
+        hits = counts['cache_l1_hits'] + counts['cache_l2_hits']
+        if hits or counts['cache_misses']:
+            metrics.append(('cache', durations['cache'] * 1000, (
+                f"{counts['cache_l1_hits']} L1 hits, "
+                f"{counts['cache_l2_hits']} L2 hits, "
+                f"{counts['cache_misses']} misses"
+            )))
+        if counts['template']:
+            metrics.append(('template', durations['template'] * 1000, None))
+        if counts['session']:
+            metrics.append(('session', durations['session'] * 1000, None))
+        return metrics
+
+    def header(self, metrics):
+        parts = []
+        for name, ms, desc in metrics:
+            part = f'{name};dur={ms:.1f}'
+            if desc:
+                part += f';desc="{desc}"'
+            parts.append(part)
+        return ', '.join(parts)
+
+    def log(self, request, response, metrics, counts):
+        match = request.resolver_match
+        record = {
+            'view': match.view_name if match is not None else None,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+        }
+        for name, ms, _ in metrics:
+            record[f'{name}_ms'] = round(ms, 2)
+        collector = getattr(request, '_query_collector', None)
+        if collector is not None:
+            record['queries'] = collector.count
+        for name in ('cache_l1_hits', 'cache_l2_hits', 'cache_misses'):
+            record[name] = counts[name]
+        timing_logger.info(json.dumps(record))
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """
+    ``WhiteNoiseMiddleware`` that also runs natively under ASGI.
+
+    Finding the file is a dictionary lookup (outside autorefresh mode),
+    so it needs no thread; Django's ASGI handler reads the file itself.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings=settings)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.acall(request)
+        return super().__call__(request)
+
+    async def acall(self, request):
+        response = self.process_request(request)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
@@ -0,0 +1,125 @@
+"""
+Hybrid session engine for coreflowepc.
+
+With the database backend every request that looks at the session reads
+``django_session``, and every ``modified`` flag, even one set by writing
+back an unchanged value, costs an UPDATE. Most anonymous sessions only
+hold a message or two, so
+``SessionStore`` keeps them in the session cookie itself:
+
+- a small anonymous session is stored as a signed, compressed cookie
+  value, like Django's ``signed_cookies`` backend, and costs no database
+  or cache access at all;
+- a logged-in session (one holding ``_auth_user_id``), or one whose signed
+  form exceeds ``SESSION_HYBRID_COOKIE_LIMIT`` bytes, lives in the
+  ``cached_db`` store under an ordinary random key until the key is
+  cycled (login) or flushed (logout);
+- nothing is loaded until the session is first accessed, a request
+  without a session cookie never loads anything, and ``save()`` of a
+  stored session skips the write when the data is identical to what was
+  loaded.
+
+The two kinds of key are told apart by the ``:`` separators of signed
+values, which random session keys never contain.
+
+A cookie-stored session cannot be revoked server side, which is why
+logins never stay in the cookie: logging out deletes the stored session,
+so a copy of the old cookie no longer authenticates anyone. Cookie
+sessions are re-signed on every save, so the signature's timestamp keeps
+up with the cookie's expiry.
+
+Example settings::
+
+    SESSION_ENGINE = 'coreflowepc.sessions'
+    SESSION_HYBRID_COOKIE_LIMIT = 2048
+
+Expired database sessions are removed with ``manage.py purge_sessions``.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.sessions.backends.cached_db import SessionStore as CachedDBStore
+from django.core import signing
+
+SALT = 'coreflowepc.sessions'
+
+
+def is_signed(session_key):
+    """Return True if ``session_key`` is a signed cookie session."""
+    return bool(session_key) and ':' in session_key
+
+
+class SessionStore(CachedDBStore):
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._loaded_digest = None
+
+    def _digest(self, data):
+        return hashlib.sha1(self.serializer().dumps(data)).hexdigest()
+
+    def load(self):
+        if is_signed(self.session_key):
+            try:
+                data = signing.loads(
+                    self.session_key, salt=SALT, serializer=self.serializer,
+                    max_age=self.get_session_cookie_age(),
+                )
+            except signing.BadSignature:
+                # Tampered with or expired (SignatureExpired is a subclass)
+                self._session_key = None
+                data = {}
+        else:
+            data = super().load()
+        self._loaded_digest = self._digest(data) if self.session_key else None
+        return data
+
+    def exists(self, session_key):
+        if is_signed(session_key):
+            return False
+        return super().exists(session_key)
+
+    def save(self, must_create=False):
+        data = self._get_session(no_load=must_create)
+        digest = self._digest(data)
+        if (not must_create and self.session_key
+                and not is_signed(self.session_key)
+                and digest == self._loaded_digest
+                and not settings.SESSION_SAVE_EVERY_REQUEST):
+            return
+        if not must_create and (self.session_key is None or is_signed(self.session_key)):
+            # Logins stay server side, where logging out revokes them
+            if SESSION_KEY not in data:
+                value = signing.dumps(
+                    data, salt=SALT, serializer=self.serializer, compress=True,
+                )
+                limit = getattr(settings, 'SESSION_HYBRID_COOKIE_LIMIT', 2048)
+                if len(value) <= limit:
+                    self._session_key = value
+                    self._loaded_digest = digest
+                    return
+            # A login, or too big for the cookie: store it under a new key
+            self._session_key = None
+        super().save(must_create=must_create)
+        self._loaded_digest = digest
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            session_key = self.session_key
+        if is_signed(session_key):
+            # Lives only in the browser; the middleware drops the cookie
+            return
+        super().delete(session_key)
+
+    def cycle_key(self):
+        """Give the session a new key without writing a database row for it."""
+        data = self._session
+        key = self.session_key
+        self._session_key = None
+        self._session_cache = data
+        self._loaded_digest = None
+        self.modified = True
+        if key:
+            self.delete(key)
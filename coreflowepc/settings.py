@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 import os
+import tempfile
 import dj_database_url
 import cloudinary
 import cloudinary.uploader
@@ -72,13 +73,18 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 MIDDLEWARE = [
     'django.middleware.gzip.GZipMiddleware',  # Enable compression - must be first
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'coreflowepc.middleware.AsyncWhiteNoiseMiddleware',
+    'coreflowepc.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'coreflowepc.middleware.ServerTimingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Sync only, and allauth insists on this exact path; under ASGI it is the
+    # one layer that runs in a thread (only while the view runs, not while
+    # slow clients send or receive)
     'allauth.account.middleware.AccountMiddleware',
 ]
 
@@ -86,7 +92,8 @@ ROOT_URLCONF = 'coreflowepc.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates that reports render time to ServerTimingMiddleware
+        'BACKEND': 'coreflowepc.timing.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -102,6 +109,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'coreflowepc.wsgi.application'
 
+# Serve the home and detail pages with their async views; coreflowepc/asgi.py
+# turns this on, since under WSGI every async view costs an event loop hop
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '') == '1'
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -154,7 +165,20 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')] if os.path.exists(os.path.join(BASE_DIR, 'static')) else []
 
-# Enable static file compression for better performance
+# Per-template critical CSS written by build_critical_css and inlined by
+# {% critical_css %}
+CRITICAL_CSS_DIR = os.path.join(BASE_DIR, 'critical_css')
+
+# optimize_static records hashed copies, duplicates and unreferenced files
+# in static/.optimize-static.json; ServedSetFinder keeps them out of
+# collectstatic
+STATICFILES_FINDERS = [
+    'casestudy.static_assets.ServedSetFinder',
+    'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+]
+
+# Enable static file compression for better performance (.gz, and .br
+# with the Brotli package installed)
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
 # WhiteNoise configuration for better performance
@@ -205,10 +229,88 @@ cloudinary.config(
 # Use Cloudinary for media storage
 DEFAULT_FILE_STORAGE = 'cloudinary_storage.storage.MediaCloudinaryStorage'
 
-# Enable in-memory caching for development
+# Two-tier cache: per-worker LRU in front of a SQLite file shared by every
+# gunicorn worker on the dyno, so workers share warm entries and see each
+# other's invalidations (see coreflowepc/cache.py)
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-snowflake',
+        'BACKEND': 'coreflowepc.cache.TieredCache',
+        'LOCATION': os.environ.get(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'coreflowepc-cache.sqlite3')
+        ),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+            'L1_MAX_ENTRIES': 1000,
+            'SYNC_INTERVAL': 0.5,
+        },
     }
 }
+
+# Written by `manage.py warm_cache` once the caches above are filled;
+# /readyz answers 503 until it exists (coreflowepc/warmup.py)
+WARMUP_MARKER = os.environ.get(
+    'WARMUP_MARKER',
+    os.path.join(tempfile.gettempdir(), 'coreflowepc-warm')
+)
+
+# Sessions (coreflowepc/sessions.py): small anonymous sessions live in a
+# signed cookie; logins and larger sessions are kept in cached_db. Expired database sessions are
+# removed by `manage.py purge_sessions`.
+SESSION_ENGINE = 'coreflowepc.sessions'
+SESSION_HYBRID_COOKIE_LIMIT = 2048
+
+# Versioned fragment caches are invalidated by signals (casestudy/signals.py),
+# so they can live much longer than a time-based expiry would allow
+CASESTUDY_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Anonymous full-page cache (casestudy/page_cache.py): pages are fresh for
+# a minute, then served stale while being re-rendered in the background
+ANONYMOUS_PAGE_CACHE_FRESH = 60
+ANONYMOUS_PAGE_CACHE_STALE = 60 * 60 * 24
+
+# Comments are shown newest first, one cursor page at a time
+COMMENTS_PER_PAGE = 10
+
+# Per-view query budgets (coreflowepc/middleware.py). Views declare their
+# own; these cover views we don't own, keyed by URL name or namespace.
+# Violations are logged, or raise with QUERY_BUDGET_STRICT=1 in the
+# environment; the test runner below always makes them raise.
+QUERY_BUDGETS = {
+    'admin': {'queries': 25, 'time_ms': 500, 'duplicates': 3},
+}
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT') == '1'
+TEST_RUNNER = 'coreflowepc.test_runner.TestRunner'
+
+# Queries slower than this are appended to SLOW_QUERY_LOG as NDJSON (SQL
+# shape, duration, view); `manage.py advise_indexes` replays them.
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+SLOW_QUERY_LOG = os.environ.get(
+    'SLOW_QUERY_LOG',
+    os.path.join(tempfile.gettempdir(), 'coreflowepc-slow-queries.ndjson')
+)
+# Query parameters can hold emails, tokens or search terms, so only their
+# count is logged unless SLOW_QUERY_LOG_PARAMS=1 (e.g. on a staging copy)
+SLOW_QUERY_LOG_PARAMS = os.environ.get('SLOW_QUERY_LOG_PARAMS') == '1'
+
+# Server-Timing header and JSON log line (coreflowepc.timing logger) with
+# the total/db/cache/template/session breakdown of a request: always for
+# staff, and for this fraction of all other requests
+SERVER_TIMING_STAFF = True
+SERVER_TIMING_SAMPLE_RATE = float(os.environ.get('SERVER_TIMING_SAMPLE_RATE', 0))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'coreflowepc.timing': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
@@ -0,0 +1,24 @@
+"""
+Test runner for coreflowepc.
+
+Turns on ``settings.QUERY_BUDGET_STRICT`` for the whole test run, so a
+view that goes over its query budget or shows an N+1 fails its tests
+instead of only logging a warning. Tests can still switch it off with
+``override_settings(QUERY_BUDGET_STRICT=False)``.
+"""
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """``DiscoverRunner`` with strict query budgets."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._strict_budgets = override_settings(QUERY_BUDGET_STRICT=True)
+        self._strict_budgets.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._strict_budgets.disable()
+        super().teardown_test_environment(**kwargs)
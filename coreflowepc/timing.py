@@ -0,0 +1,102 @@
+"""
+Per-request timing collection for ServerTimingMiddleware.
+
+The middleware starts a ``RequestTimings`` for each request and stores it
+in a context variable, so code anywhere below it can report into it
+without having the request at hand:
+
+- ``TieredCache`` calls ``record_cache()`` for every lookup;
+- ``TimedDjangoTemplates`` (the template backend in settings) times every
+  top-level template render;
+- ``measure(name)`` times any other block.
+
+Outside a request (management commands, the page cache's background
+revalidation threads) there is no current ``RequestTimings`` and all of
+this is a no-op.
+"""
+
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates, Template
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Durations (seconds) and counters gathered during one request."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = Counter()
+        self._active = set()
+
+    @contextmanager
+    def measure(self, name):
+        # Nested blocks of the same name (a template rendered while
+        # rendering another) would otherwise be counted twice
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - start
+            self.counts[name] += 1
+            self._active.discard(name)
+
+
+def start():
+    """Begin collecting for the current request; returns (timings, token)."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def stop(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def measure(name):
+    """Time a block into the current request's timings, if any."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    with timings.measure(name):
+        yield
+
+
+def record_cache(hit, elapsed):
+    """Record one cache lookup: ``hit`` is 'l1', 'l2' or None for a miss."""
+    timings = _current.get()
+    if timings is None:
+        return
+    timings.durations['cache'] += elapsed
+    timings.counts[f'cache_{hit}_hits' if hit else 'cache_misses'] += 1
+
+
+class TimedTemplate(Template):
+
+    def render(self, context=None, request=None):
+        with measure('template'):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """``DjangoTemplates`` whose top-level renders report their duration."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
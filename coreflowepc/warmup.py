@@ -0,0 +1,90 @@
+"""
+Deploy-time warm-up for coreflowepc.
+
+Two kinds of state start out cold after a deploy:
+
+- per process: the URL resolver, compiled templates and translation
+  catalogs are built lazily on the first request that needs them.
+  ``warm_process()`` builds them up front; ``gunicorn.conf.py`` calls it
+  in the preloaded master, so every forked worker shares one copy.
+- per machine: the anonymous page cache and the fragment caches behind
+  it. ``manage.py warm_cache`` renders the public pages into them and
+  then calls ``mark_warm()``.
+
+``/readyz`` (``coreflowepc/health.py``) reports ready once the marker
+file ``WARMUP_MARKER`` exists; gunicorn removes it when it starts.
+"""
+
+import os
+import time
+
+from django.conf import settings
+from django.template import TemplateDoesNotExist, TemplateSyntaxError
+from django.template.loader import get_template
+from django.urls import get_resolver
+from django.utils import translation
+
+
+def _template_names():
+    """Names of the project's and this app's templates."""
+    directories = [str(directory) for directory in settings.TEMPLATES[0]['DIRS']]
+    directories.append(os.path.join(settings.BASE_DIR, 'casestudy', 'templates'))
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                if name.endswith('.html'):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, directory).replace(os.sep, '/')
+
+
+def warm_process():
+    """
+    Build the URL resolver, templates and translations of this process.
+
+    Touches neither the database nor the cache, so it is safe to run in a
+    process that forks afterwards. Returns the number of templates
+    compiled; templates that do not compile (overrides for allauth
+    features we don't use) are skipped, as they are never rendered.
+    """
+    resolver = get_resolver()
+    resolver.reverse_dict
+    with translation.override(settings.LANGUAGE_CODE):
+        translation.gettext('')
+    compiled = 0
+    for name in sorted(set(_template_names())):
+        try:
+            get_template(name)
+        except (TemplateDoesNotExist, TemplateSyntaxError):
+            continue
+        compiled += 1
+    return compiled
+
+
+def _marker():
+    return settings.WARMUP_MARKER
+
+
+def mark_warm():
+    """Record that the caches on this machine have been warmed."""
+    path = _marker()
+    tmp = f'{path}.{os.getpid()}'
+    with open(tmp, 'w') as f:
+        f.write(str(time.time()))
+    os.replace(tmp, path)
+
+
+def clear_warm():
+    """Forget an earlier warm-up, e.g. when the server restarts."""
+    try:
+        os.remove(_marker())
+    except FileNotFoundError:
+        pass
+
+
+def warmed_at():
+    """Timestamp of the last warm-up on this machine, or None."""
+    try:
+        with open(_marker()) as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return None
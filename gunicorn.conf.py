@@ -0,0 +1,85 @@
+"""
+Gunicorn configuration for coreflowepc.
+
+Picked up automatically by ``gunicorn`` run from the project root (see
+the ``Procfile``).
+
+- ``preload_app``: Django is imported and set up once, in the master,
+  which then also builds the URL resolver, templates and translations
+  (``coreflowepc.warmup.warm_process``) before forking. Workers start
+  warm and share those pages of memory with the master.
+- ``gc.freeze()`` after that moves everything allocated so far out of the
+  garbage collector's reach, so collections in the workers don't write
+  to (and so copy) the shared pages.
+- Workers: ``WEB_CONCURRENCY`` if set (Heroku sets it per dyno size),
+  otherwise 2 per available CPU plus one, capped by
+  ``GUNICORN_MAX_WORKERS``. The async profile
+  (``GUNICORN_PROFILE=asgi``) runs one uvicorn worker per CPU instead,
+  as each already holds many connections.
+- Once the server listens, ``manage.py warm_cache`` renders the public
+  pages into the cache in the background (``WARM_CACHE_ON_START=0``
+  turns this off) and ``/readyz`` answers 200 when it is done.
+"""
+
+import gc
+import os
+import subprocess
+import sys
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'coreflowepc.settings')
+
+PROFILES = {
+    'wsgi': ('coreflowepc.wsgi:application', 'sync'),
+    'asgi': ('coreflowepc.asgi:application', 'uvicorn.workers.UvicornWorker'),
+}
+profile = os.environ.get('GUNICORN_PROFILE', 'wsgi')
+wsgi_app, worker_class = PROFILES[profile]
+
+
+def cpu_count():
+    """CPUs this process may run on (respects container CPU sets)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_workers():
+    cpus = cpu_count()
+    workers = cpus if profile == 'asgi' else cpus * 2 + 1
+    return min(workers, int(os.environ.get('GUNICORN_MAX_WORKERS', 8)))
+
+
+bind = [f"0.0.0.0:{os.environ.get('PORT', '8000')}"]
+workers = int(os.environ.get('WEB_CONCURRENCY') or default_workers())
+preload_app = True
+# Heroku's router gives up on a request after 30 seconds
+timeout = 30
+
+
+def on_starting(server):
+    from coreflowepc.warmup import clear_warm
+
+    # Not ready until this server's warm-up has run
+    clear_warm()
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        from django.db import connections
+        from coreflowepc.warmup import warm_process
+
+        compiled = warm_process()
+        # Nothing opened here may be shared with the forked workers
+        connections.close_all()
+        server.log.info('Warmed process: %d templates compiled', compiled)
+    gc.collect()
+    gc.freeze()
+
+    if os.environ.get('WARM_CACHE_ON_START', '1') == '1':
+        # Reaped by the arbiter along with the workers; manage.py never
+        # exits with gunicorn's worker boot/app load error codes (3, 4)
+        subprocess.Popen(
+            [sys.executable, 'manage.py', 'warm_cache'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
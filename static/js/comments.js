@@ -1,148 +1,240 @@
 /**
- * Initializes edit functionality for the provided edit buttons.
- * 
- * For each button in the editButtons collection:
- * - Retrieves the associated comment's ID upon click.
- * - Fetches the content of the corresponding comment.
- * - Populates the commentText input/textarea with the comment's content for editing.
- * - Updates the submit button's text to "Update".
- * - Sets the form's action attribute to the edit_comment/{commentId} endpoint.
+ * Comment posting, editing and deleting on the case study detail page.
+ *
+ * Submits the comment form and the delete confirmation with fetch(), so
+ * the server answers with JSON (the message, the comment counts and the
+ * rendered comment block) instead of redirecting to a full re-render of
+ * the page. Without JavaScript the form and the delete link work as plain
+ * page loads. If a request fails, an error is shown and the page is left
+ * as it was: the form is never re-posted (the comment may already have
+ * been saved) and nothing is deleted with a GET.
  */
-
-console.log("Comments.js loaded successfully");
-
-// Wait for DOM to be ready
 document.addEventListener('DOMContentLoaded', function() {
-    console.log("DOM ready - initializing comment editing");
-    
-    // Get all edit buttons
-    const editButtons = document.getElementsByClassName("btn-edit");
-    console.log("Edit buttons found:", editButtons.length);
-
-    // Get all delete buttons
-    const deleteModal = new bootstrap.Modal(document.getElementById("deleteModal"));
-    const deleteButtons = document.getElementsByClassName("btn-delete");
-    const deleteConfirm = document.getElementById("deleteConfirm");
-    
-    // Get form elements
+    const commentList = document.getElementById("commentList");
     const commentForm = document.getElementById("commentForm");
     const submitButton = document.getElementById("submitButton");
-    
-    console.log("Form found:", !!commentForm);
-    console.log("Submit button found:", !!submitButton);
-    
-    // Update debug panel
-    const debugElement = document.getElementById("form-field-debug");
-    if (debugElement) {
-        const allInputs = document.querySelectorAll("input, textarea");
-        let debugText = `Script loaded! Found ${allInputs.length} inputs/textareas:<br><br>`;
-        
-        allInputs.forEach((input, i) => {
-            debugText += `${i+1}. ${input.tagName} - name:"${input.name || 'none'}" id:"${input.id || 'none'}"<br>`;
-        });
-        
-        debugElement.innerHTML = debugText;
+    const deleteConfirm = document.getElementById("deleteConfirm");
+    const commentCount = document.getElementById("commentCount");
+
+    if (!commentList) {
+        return;
     }
-    
-    // Add click handlers to each edit button
-    for (let i = 0; i < editButtons.length; i++) {
-        const button = editButtons[i];
-        
-        button.addEventListener("click", function(e) {
-            console.log("Edit button clicked!");
-            
-            // Step 1: Retrieve the associated comment's ID upon click
-            const commentId = this.getAttribute("comment_id");
-            console.log("Comment ID retrieved:", commentId);
-            
-            // Step 2: Fetch the content of the corresponding comment
-            const commentElement = document.getElementById(`comment${commentId}`);
-            if (!commentElement) {
-                console.error("Comment element not found:", `comment${commentId}`);
-                return;
-            }
-            
-            const commentContent = commentElement.innerText.trim();
-            console.log("Comment content fetched:", commentContent);
-            
-            // Step 3: Populate the commentText input/textarea with the comment's content for editing
-            const commentTextArea = document.querySelector("textarea[name='content']") ||
-                                  document.querySelector("#id_content") ||
-                                  document.querySelector("#commentForm textarea") ||
-                                  document.querySelector("textarea");
-            
-            if (!commentTextArea) {
-                console.error("Comment text area not found");
-                alert("Error: Could not find comment text field");
-                return;
-            }
-            
-            commentTextArea.value = commentContent;
-            console.log("Comment text area populated with content");
-            
-            // Step 4: Update the submit button's text to "Update"
-            if (submitButton) {
-                submitButton.innerText = "Update";
-                submitButton.classList.remove("btn-signup");
-                submitButton.classList.add("btn-primary");
-                console.log("Submit button text updated to 'Update'");
-            }
-            
-            // Step 5: Set the form's action attribute to the edit_comment/{commentId} endpoint
-            if (commentForm) {
-                commentForm.setAttribute("action", `edit_comment/${commentId}/`);
-                console.log("Form action set to:", `edit_comment/${commentId}/`);
+
+    // Django's CSRF token: from the cookie, or the form's hidden field
+    function csrfToken() {
+        const match = document.cookie.match(/(?:^|;\s*)csrftoken=([^;]+)/);
+        if (match) {
+            return decodeURIComponent(match[1]);
+        }
+        const field = document.querySelector("input[name='csrfmiddlewaretoken']");
+        return field ? field.value : "";
+    }
+
+    // POST and parse the JSON reply; rejects when the server sent no JSON
+    function postJSON(url, body) {
+        return fetch(url, {
+            method: "POST",
+            body: body || new FormData(),
+            credentials: "same-origin",
+            headers: {
+                "X-CSRFToken": csrfToken(),
+                "X-Requested-With": "XMLHttpRequest",
+                "Accept": "application/json"
             }
-            
-            // Additional enhancements
-            // Add cancel button
-            if (!document.getElementById("cancelBtn")) {
-                const cancelBtn = document.createElement("button");
-                cancelBtn.type = "button";
-                cancelBtn.id = "cancelBtn";
-                cancelBtn.className = "btn btn-secondary btn-lg ms-2";
-                cancelBtn.innerText = "Cancel";
-                
-                cancelBtn.onclick = function() {
-                    // Reset everything
-                    commentTextArea.value = "";
-                    submitButton.innerText = "Submit";
-                    submitButton.classList.remove("btn-primary");
-                    submitButton.classList.add("btn-signup");
-                    commentForm.setAttribute("action", "");
-                    cancelBtn.remove();
-                    console.log("Form reset to initial state");
-                };
-                
-                submitButton.parentNode.appendChild(cancelBtn);
-                console.log("Cancel button added");
+        }).then(response => {
+            const type = response.headers.get("Content-Type") || "";
+            if (!type.includes("application/json")) {
+                throw new Error("HTTP " + response.status);
             }
-            
-            // Scroll to form and focus
-            commentForm.scrollIntoView({ behavior: 'smooth' });
-            commentTextArea.focus();
-            
-            console.log("Edit functionality initialization complete for comment", commentId);
+            return response.json();
         });
     }
-    
-    console.log("All edit buttons initialized successfully");
-});
 
-/**
-* Initializes deletion functionality for the provided delete buttons.
-* 
-* For each button in the `deleteButtons` collection:
-* - Retrieves the associated comment's ID upon click.
-* - Updates the `deleteConfirm` link's href to point to the 
-* deletion endpoint for the specific comment.
-* - Displays a confirmation modal (`deleteModal`) to prompt 
-* the user for confirmation before deletion.
-*/
-for (let button of deleteButtons) {
-  button.addEventListener("click", (e) => {
-    let commentId = e.target.getAttribute("comment_id");
-    deleteConfirm.href = `delete_comment/${commentId}`;
-    deleteModal.show();
-  });
-}
\ No newline at end of file
+    // Show a dismissible alert like the server-rendered Django messages
+    function showMessage(text, level) {
+        const container = document.querySelector(".messages-container .col-12");
+        if (!container || !text) {
+            return;
+        }
+        const alert = document.createElement("div");
+        alert.className = "alert message-alert alert-" + level + " alert-dismissible fade show mt-2";
+        alert.setAttribute("role", "alert");
+        alert.style.fontSize = "1.1rem";
+        alert.textContent = text;
+        const close = document.createElement("button");
+        close.type = "button";
+        close.className = "btn-close";
+        close.setAttribute("data-bs-dismiss", "alert");
+        close.setAttribute("aria-label", "Close");
+        alert.appendChild(close);
+        container.appendChild(alert);
+        setTimeout(() => alert.remove(), 6000);
+    }
+
+    function updateCount(data) {
+        if (commentCount && data.approved_comment_count !== undefined) {
+            commentCount.textContent = data.approved_comment_count;
+        }
+    }
+
+    function commentBlock(commentId) {
+        return commentList.querySelector('[data-comment="' + commentId + '"]');
+    }
+
+    function fromHTML(html) {
+        const template = document.createElement("template");
+        template.innerHTML = html.trim();
+        return template.content.firstElementChild;
+    }
+
+    // Delegated handlers: comments added by "Load more" or fetch() work too
+    commentList.addEventListener("click", function(e) {
+        const editButton = e.target.closest(".btn-edit");
+        const deleteButton = e.target.closest(".btn-delete");
+        const loadMoreButton = e.target.closest(".btn-load-more");
+        if (editButton) {
+            startEdit(e, editButton);
+        } else if (deleteButton) {
+            confirmDelete(e, deleteButton);
+        } else if (loadMoreButton) {
+            loadMore(e, loadMoreButton);
+        }
+    });
+
+    // Fetch the next page of comments and replace the button with it
+    function loadMore(e, button) {
+        e.preventDefault();
+        button.disabled = true;
+        fetch(button.dataset.url, { headers: { "X-Requested-With": "XMLHttpRequest" } })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error("HTTP " + response.status);
+                }
+                return response.text();
+            })
+            .then(html => {
+                button.closest(".load-more").outerHTML = html;
+            })
+            .catch(() => {
+                button.disabled = false;
+                alert("Error: Could not load more comments");
+            });
+    }
+
+    function resetForm() {
+        const commentTextArea = commentForm.querySelector("textarea[name='content']");
+        if (commentTextArea) {
+            commentTextArea.value = "";
+        }
+        submitButton.innerText = "Submit";
+        submitButton.className = "btn btn-signup btn-lg w-100";
+        commentForm.setAttribute("action", "");
+        const cancelBtn = document.getElementById("cancelBtn");
+        if (cancelBtn) {
+            cancelBtn.remove();
+        }
+    }
+
+    // Put a comment into the form and point the form at its edit URL
+    function startEdit(e, button) {
+        e.preventDefault();
+
+        const commentId = button.getAttribute("comment_id");
+        const commentElement = document.getElementById("comment" + commentId);
+        const commentTextArea = commentForm && commentForm.querySelector("textarea[name='content']");
+
+        if (!commentId || !commentElement || !commentTextArea) {
+            alert("Error: Could not find required elements for editing");
+            return;
+        }
+
+        commentTextArea.value = commentElement.innerText.trim();
+        submitButton.innerText = "Update";
+        submitButton.className = "btn btn-primary btn-lg";
+        commentForm.setAttribute("action", "edit_comment/" + commentId + "/");
+
+        if (!document.getElementById("cancelBtn")) {
+            const cancelBtn = document.createElement("button");
+            cancelBtn.type = "button";
+            cancelBtn.id = "cancelBtn";
+            cancelBtn.className = "btn btn-secondary btn-lg ms-2";
+            cancelBtn.innerText = "Cancel";
+            cancelBtn.onclick = resetForm;
+            submitButton.parentNode.appendChild(cancelBtn);
+        }
+
+        commentForm.scrollIntoView({ behavior: 'smooth' });
+        commentTextArea.focus();
+    }
+
+    // Submit a new comment or an edit; the reply carries the rendered block
+    if (commentForm) {
+        commentForm.addEventListener("submit", function(e) {
+            e.preventDefault();
+            submitButton.disabled = true;
+            postJSON(commentForm.action, new FormData(commentForm))
+                .then(data => {
+                    submitButton.disabled = false;
+                    showMessage(data.message, data.ok ? "success" : "danger");
+                    if (!data.ok) {
+                        return;
+                    }
+                    updateCount(data);
+                    const block = fromHTML(data.html);
+                    const existing = commentBlock(data.comment_id);
+                    if (existing) {
+                        existing.replaceWith(block);
+                    } else {
+                        const empty = commentList.querySelector(".no-comments");
+                        if (empty) {
+                            empty.remove();
+                        }
+                        commentList.prepend(block);
+                    }
+                    resetForm();
+                })
+                .catch(() => {
+                    submitButton.disabled = false;
+                    showMessage("Your comment could not be sent. Please try again.", "danger");
+                });
+        });
+    }
+
+    // Show the confirmation modal; its link is the no-JavaScript fallback
+    function confirmDelete(e, button) {
+        e.preventDefault();
+
+        const commentId = button.getAttribute("comment_id");
+        if (!commentId || !deleteConfirm) {
+            alert("Error: Could not find comment to delete");
+            return;
+        }
+
+        deleteConfirm.setAttribute("href", window.location.pathname + "delete_comment/" + commentId + "/");
+        deleteConfirm.dataset.commentId = commentId;
+        bootstrap.Modal.getOrCreateInstance(document.getElementById('deleteModal')).show();
+    }
+
+    if (deleteConfirm) {
+        deleteConfirm.addEventListener("click", function(e) {
+            e.preventDefault();
+            const url = deleteConfirm.getAttribute("href");
+            bootstrap.Modal.getOrCreateInstance(document.getElementById('deleteModal')).hide();
+            postJSON(url)
+                .then(data => {
+                    showMessage(data.message, data.ok ? "success" : "danger");
+                    if (!data.ok) {
+                        return;
+                    }
+                    updateCount(data);
+                    const block = commentBlock(data.comment_id);
+                    if (block) {
+                        block.remove();
+                    }
+                })
+                .catch(() => {
+                    showMessage("The comment could not be deleted. Please try again.", "danger");
+                });
+        });
+    }
+});